@@ -0,0 +1,70 @@
+"""ローカルのTLSクライアントが送るClientHelloを記録して、corpus/に保存する。
+
+1回だけ接続を受け付けて、ClientHelloのハンドシェイクメッセージがそろうまで
+受信したTLSRecordをそのまま16進数で書き出す。{port}はコマンドの中で置き換える。
+
+    python benchmarks/capture_client_hello.py openssl \\
+        "openssl s_client -connect 127.0.0.1:{port} -servername example.com"
+    python benchmarks/capture_client_hello.py curl "curl -sk https://localhost:{port}/"
+"""
+
+import argparse
+import shlex
+import socket
+import subprocess
+
+from corpus import CORPUS_DIR
+
+from tiny_tls_py.models.enums import ContentType
+from tiny_tls_py.models.tls_record_framer import (
+    RECORD_HEADER_LENGTH,
+    HandshakeReassembler,
+    TlsRecordFramer,
+)
+
+
+def capture(command: str, port: int) -> bytes:
+    with socket.create_server(("127.0.0.1", port)) as server:
+        client = subprocess.Popen(
+            shlex.split(command.format(port=port)),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            connection, _ = server.accept()
+            with connection:
+                framer = TlsRecordFramer()
+                reassembler = HandshakeReassembler()
+                captured = bytearray()
+                while True:
+                    if not framer.recv_into(connection):
+                        raise RuntimeError("ClientHelloの途中で切断されました。")
+                    for record in framer.records():
+                        if record[0] != ContentType.handshake:
+                            raise RuntimeError(
+                                "ClientHelloの前に別のレコードを受信しました。"
+                            )
+                        captured += record
+                        for _ in reassembler.feed(record[RECORD_HEADER_LENGTH:]):
+                            return bytes(captured)
+        finally:
+            client.kill()
+            client.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("name", help="保存するファイル名(corpus/<name>.hex)")
+    parser.add_argument("command", help="接続するクライアントのコマンド")
+    parser.add_argument("--port", type=int, default=10443)
+    args = parser.parse_args()
+
+    records = capture(args.command, args.port)
+    path = CORPUS_DIR / f"{args.name}.hex"
+    path.write_text(records.hex() + "\n")
+    print(f"{path}: {len(records)}バイト")
+
+
+if __name__ == "__main__":
+    main()
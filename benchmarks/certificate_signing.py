@@ -0,0 +1,87 @@
+"""CertificateVerifyの署名のコストを、証明書の鍵のアルゴリズムごとに比べる。
+
+1回の署名の時間(最小値)と、署名スレッドのプールで並列に署名したときの
+1秒あたりの署名数、Certificateメッセージの大きさを出す。スレッドで速く
+なるかどうかは、cryptographyが署名中にGILを手放すかどうかで決まる。
+
+ChromeなどのブラウザはEd25519の証明書に対応していないので、
+ブラウザ向けにはECDSAかRSAから選ぶ必要がある。
+
+    python benchmarks/certificate_signing.py --threads 1 4 --json signing.json
+"""
+
+import argparse
+import os
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from results import save_results
+
+from tiny_tls_py.models.certificate import KEY_ALGORITHMS, ServerCredentials
+
+
+def signing_rate(credentials: ServerCredentials, threads: int, count: int) -> float:
+    """threads本のスレッドでcount回署名したときの1秒あたりの署名数。"""
+    transcript_hash = os.urandom(48)
+    with ThreadPoolExecutor(threads) as executor:
+        # スレッドを起動しておく
+        list(executor.map(credentials.sign, [transcript_hash] * threads))
+        start = time.perf_counter()
+        list(executor.map(credentials.sign, [transcript_hash] * count))
+        return count / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--algorithms", nargs="+", choices=KEY_ALGORITHMS, default=list(KEY_ALGORITHMS)
+    )
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'algorithm':<12} {'sign µs':>9} {'cert bytes':>10}"
+        + "".join(f" {f'{threads} thr/s':>10}" for threads in args.threads)
+    )
+    for algorithm in args.algorithms:
+        credentials = ServerCredentials.generate_self_signed(algorithm)
+        transcript_hash = os.urandom(48)
+        seconds = (
+            min(
+                timeit.repeat(
+                    partial(credentials.sign, transcript_hash),
+                    number=args.number,
+                    repeat=args.repeat,
+                )
+            )
+            / args.number
+        )
+        result = {
+            "name": algorithm,
+            "sign_us": seconds * 1e6,
+            "certificate_bytes": len(credentials.certificate_message),
+        }
+        for threads in args.threads:
+            result[f"threads_{threads}_per_s"] = signing_rate(
+                credentials, threads, args.number * args.repeat
+            )
+        results.append(result)
+        print(
+            f"{algorithm:<12} {seconds * 1e6:>9.1f} {result['certificate_bytes']:>10}"
+            + "".join(
+                f" {result[f'threads_{threads}_per_s']:>10.0f}"
+                for threads in args.threads
+            )
+        )
+    if args.json:
+        save_results(args.json, "certificate_signing", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""ベンチマークで使うClientHelloレコードを組み立てるヘルパー。"""
+
+import os
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+from tiny_tls_py.models.key_schedule import HASH_LENGTH, KeySchedule
+
+# X25519MLKEM768(draft-ietf-tls-ecdhe-mlkem)のグループIDと鍵共有のサイズ
+X25519_MLKEM768 = 0x11EC
+X25519_MLKEM768_KEY_LENGTH = 1216
+
+
+def build_client_hello(
+    post_quantum: bool = False,
+    padding: int = 0,
+    psk: tuple[bytes, int, bytes] | None = None,
+    psk_modes: bytes = b"\x01",
+    record_size_limit: int | None = None,
+) -> bytes:
+    """x25519の鍵共有を持つTLS1.3 ClientHelloレコードを作る。
+
+    post_quantumを指定すると、ブラウザと同じようにX25519MLKEM768の鍵共有を
+    x25519の前に付けるので、ClientHelloが1レコードでも1500バイトを超える。
+    pskに(チケット, obfuscated_ticket_age, PSK)を渡すと、psk_modesの
+    psk_key_exchange_modesと、binderを計算したpre_shared_keyを最後に付ける。
+    record_size_limitを指定すると、その値のrecord_size_limit(RFC 8449)を付ける。
+    """
+    public_key = X25519PrivateKey.generate().public_key().public_bytes_raw()
+    key_share_entries = b"\x00\x1d" + len(public_key).to_bytes(2, "big") + public_key
+    if post_quantum:
+        key_share_entries = (
+            X25519_MLKEM768.to_bytes(2, "big")
+            + X25519_MLKEM768_KEY_LENGTH.to_bytes(2, "big")
+            + os.urandom(X25519_MLKEM768_KEY_LENGTH)
+            + key_share_entries
+        )
+    key_share = len(key_share_entries).to_bytes(2, "big") + key_share_entries
+    extensions = (
+        # supported_versions: TLS1.3
+        b"\x00\x2b\x00\x03\x02\x03\x04"
+        # supported_groups: x25519
+        + b"\x00\x0a\x00\x04\x00\x02\x00\x1d"
+        # signature_algorithms: ed25519, ecdsa_secp256r1_sha256,
+        # ecdsa_secp384r1_sha384, rsa_pss_rsae_sha256
+        + b"\x00\x0d\x00\x0a\x00\x08\x08\x07\x04\x03\x05\x03\x08\x04"
+        + b"\x00\x33"
+        + len(key_share).to_bytes(2, "big")
+        + key_share
+    )
+    if padding:
+        # padding(RFC 7685)
+        extensions += b"\x00\x15" + padding.to_bytes(2, "big") + bytes(padding)
+    if record_size_limit is not None:
+        extensions += _extension(0x001C, record_size_limit.to_bytes(2, "big"))
+    # binderは後で計算するので、いったん0で埋めておく
+    binders = b""
+    if psk is not None:
+        ticket, obfuscated_ticket_age, _ = psk
+        # psk_key_exchange_modes
+        extensions += (
+            b"\x00\x2d"
+            + (1 + len(psk_modes)).to_bytes(2, "big")
+            + len(psk_modes).to_bytes(1, "big")
+            + psk_modes
+        )
+        identities = (
+            len(ticket).to_bytes(2, "big")
+            + ticket
+            + obfuscated_ticket_age.to_bytes(4, "big")
+        )
+        binders = (
+            (1 + HASH_LENGTH).to_bytes(2, "big")
+            + bytes([HASH_LENGTH])
+            + bytes(HASH_LENGTH)
+        )
+        pre_shared_key = len(identities).to_bytes(2, "big") + identities + binders
+        # pre_shared_keyは最後の拡張でなければいけない
+        extensions += (
+            b"\x00\x29" + len(pre_shared_key).to_bytes(2, "big") + pre_shared_key
+        )
+    body = (
+        b"\x03\x03"
+        + os.urandom(32)
+        + b"\x20"
+        + os.urandom(32)
+        # cipher_suites: TLS_AES_256_GCM_SHA384
+        + b"\x00\x02\x13\x02"
+        # compression_methods: null
+        + b"\x01\x00"
+        + len(extensions).to_bytes(2, "big")
+        + extensions
+    )
+    handshake = b"\x01" + len(body).to_bytes(3, "big") + body
+    if psk is not None:
+        # binderはbindersより前の部分(Truncate(ClientHello))に対するHMAC
+        key_schedule = KeySchedule(psk=psk[2])
+        binder = key_schedule.psk_binder(handshake[: -len(binders)])
+        handshake = handshake[:-HASH_LENGTH] + binder
+    return b"\x16\x03\x01" + len(handshake).to_bytes(2, "big") + handshake
+
+
+def _extension(extension_type: int, data: bytes) -> bytes:
+    return extension_type.to_bytes(2, "big") + len(data).to_bytes(2, "big") + data
+
+
+def _vector(data: bytes, length_size: int = 2) -> bytes:
+    return len(data).to_bytes(length_size, "big") + data
+
+
+def _u16s(*values: int) -> bytes:
+    return b"".join(value.to_bytes(2, "big") for value in values)
+
+
+def build_browser_client_hello(browser: str) -> bytes:
+    """ChromeやFirefoxのClientHelloの構造(拡張の種類と順番、サイズ)をまねたレコードを作る。
+
+    実際のキャプチャではないが、GREASE、X25519MLKEM768の鍵共有、
+    ECHのGREASEなど、ブラウザのClientHelloでパースが重くなる要素はそろえてある。
+    """
+    x25519 = X25519PrivateKey.generate().public_key().public_bytes_raw()
+    mlkem_share = _u16s(X25519_MLKEM768, X25519_MLKEM768_KEY_LENGTH) + os.urandom(
+        X25519_MLKEM768_KEY_LENGTH
+    )
+    x25519_share = _u16s(0x001D, len(x25519)) + x25519
+    signature_algorithms = _u16s(
+        0x0403, 0x0804, 0x0401, 0x0503, 0x0805, 0x0501, 0x0806, 0x0601
+    )
+    alpn = _vector(b"\x02h2" + b"\x08http/1.1")
+    server_name = _vector(b"\x00" + _vector(b"www.example.com"))
+    # ECHのGREASE: HPKEの設定 + config_id + enc(32) + payload
+    ech_grease = (
+        b"\x00" + _u16s(0x0001, 0x0001) + b"\x2a" + _vector(os.urandom(32))
+    ) + _vector(os.urandom(208))
+    match browser:
+        case "chrome":
+            cipher_suites = _u16s(
+                0x2A2A,  # GREASE
+                0x1301,
+                0x1302,
+                0x1303,
+                0xC02B,
+                0xC02F,
+                0xC02C,
+                0xC030,
+                0xCCA9,
+                0xCCA8,
+                0xC013,
+                0xC014,
+                0x009C,
+                0x009D,
+                0x002F,
+                0x0035,
+            )
+            extensions = [
+                _extension(0x0A0A, b""),  # GREASE
+                _extension(0x0000, server_name),
+                _extension(0x0017, b""),  # extended_master_secret
+                _extension(0xFF01, b"\x00"),  # renegotiation_info
+                _extension(
+                    0x000A, _vector(_u16s(0x5A5A, X25519_MLKEM768, 0x001D, 0x0017))
+                ),
+                _extension(0x000B, b"\x01\x00"),  # ec_point_formats
+                _extension(0x0023, b""),  # session_ticket
+                _extension(0x0010, alpn),
+                _extension(0x0005, b"\x01\x00\x00\x00\x00"),  # status_request
+                _extension(0x000D, _vector(signature_algorithms)),
+                _extension(0x0012, b""),  # signed_certificate_timestamp
+                _extension(
+                    0x0033,
+                    _vector(_u16s(0x5A5A, 1) + b"\x00" + mlkem_share + x25519_share),
+                ),
+                _extension(0x002D, b"\x01\x01"),  # psk_key_exchange_modes
+                _extension(0x002B, _vector(_u16s(0x7A7A, 0x0304, 0x0303), 1)),
+                _extension(0x001B, b"\x02\x00\x02"),  # compress_certificate: brotli
+                _extension(0x44CD, _vector(b"\x02h2")),  # application_settings
+                _extension(0xFE0D, ech_grease),
+                _extension(0x1A1A, b"\x00"),  # GREASE
+            ]
+        case "firefox":
+            secp256r1 = b"\x04" + os.urandom(64)
+            cipher_suites = _u16s(
+                0x1301,
+                0x1303,
+                0x1302,
+                0xC02B,
+                0xC02F,
+                0xCCA9,
+                0xCCA8,
+                0xC02C,
+                0xC030,
+                0xC00A,
+                0xC009,
+                0xC013,
+                0xC014,
+                0x009C,
+                0x009D,
+                0x002F,
+                0x0035,
+            )
+            extensions = [
+                _extension(0x0000, server_name),
+                _extension(0x0017, b""),  # extended_master_secret
+                _extension(0xFF01, b"\x00"),  # renegotiation_info
+                _extension(
+                    0x000A,
+                    _vector(
+                        _u16s(
+                            X25519_MLKEM768,
+                            0x001D,
+                            0x0017,
+                            0x0018,
+                            0x0019,
+                            0x0100,
+                            0x0101,
+                        )
+                    ),
+                ),
+                _extension(0x000B, b"\x01\x00"),  # ec_point_formats
+                _extension(0x0023, b""),  # session_ticket
+                _extension(0x0010, alpn),
+                _extension(0x0005, b"\x01\x00\x00\x00\x00"),  # status_request
+                # delegated_credentials
+                _extension(0x0022, _vector(_u16s(0x0403, 0x0503, 0x0603, 0x0203))),
+                _extension(
+                    0x0033,
+                    _vector(
+                        mlkem_share
+                        + x25519_share
+                        + _u16s(0x0017, len(secp256r1))
+                        + secp256r1
+                    ),
+                ),
+                _extension(0x002B, _vector(_u16s(0x0304, 0x0303), 1)),
+                _extension(0x000D, _vector(signature_algorithms + _u16s(0x0203))),
+                _extension(0x002D, b"\x01\x01"),  # psk_key_exchange_modes
+                _extension(0x001C, b"\x40\x01"),  # record_size_limit
+                # compress_certificate: zlib, brotli, zstd
+                _extension(0x001B, _vector(_u16s(0x0001, 0x0002, 0x0003), 1)),
+                _extension(0xFE0D, ech_grease),
+            ]
+        case _:
+            raise ValueError(f"Unknown browser: {browser}")
+    extensions_data = b"".join(extensions)
+    body = (
+        b"\x03\x03"
+        + os.urandom(32)
+        + _vector(os.urandom(32), 1)
+        + _vector(cipher_suites)
+        + b"\x01\x00"
+        + _vector(extensions_data)
+    )
+    handshake = b"\x01" + len(body).to_bytes(3, "big") + body
+    return b"\x16\x03\x01" + len(handshake).to_bytes(2, "big") + handshake
@@ -0,0 +1,56 @@
+"""2つのベンチマーク結果(results.pyで保存したJSON)を比べる。
+
+同じ名前の結果の指標を並べて変化率を出し、threshold(%)より悪くなったものに
+印を付ける。印の付いたものがあれば終了コード1で終わる。
+
+    python benchmarks/compare.py before.json after.json --threshold 5
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> tuple[dict[str, object], dict[str, dict[str, object]]]:
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    return data["environment"], {result["name"]: result for result in data["results"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=5.0)
+    args = parser.parse_args()
+
+    before_environment, before = load(args.before)
+    after_environment, after = load(args.after)
+    print(
+        f"before: {before_environment['commit']}  after: {after_environment['commit']}"
+    )
+    print(f"{'name':<40} {'metric':<16} {'before':>12} {'after':>12} {'change':>8}")
+    regressions = 0
+    for name, result in after.items():
+        if name not in before:
+            continue
+        for metric, value in result.items():
+            old = before[name].get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            if old == 0:
+                continue
+            change = (value - old) / old * 100
+            # "_per_s"の指標は大きいほど良く、それ以外(時間)は小さいほど良い
+            worse = -change if metric.endswith("_per_s") else change
+            mark = " !" if worse > args.threshold else ""
+            regressions += bool(mark)
+            print(
+                f"{name:<40} {metric:<16} {old:>12.2f} {value:>12.2f}"
+                f" {change:>+7.1f}%{mark}"
+            )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""ベンチマークで使うClientHelloのコーパス(corpus/*.hex)を読み込む。
+
+- openssl.hex, curl.hex: capture_client_hello.pyでローカルのクライアント
+  (OpenSSL 3.0.17のs_client、curl 7.88.1)から記録した実際のClientHello
+- chrome_reconstructed.hex, firefox_reconstructed.hex:
+  build_browser_client_hello()で作った、ブラウザの構造をまねたClientHello。
+  実機のキャプチャが取れたら、capture_client_hello.pyで置き換えてよい
+
+ファイルにはクライアントが送ったTLSRecordをそのまま16進数で入れてある。
+複数のレコードに分かれていても、load_corpus()は1つのレコードにまとめて返す。
+"""
+
+from pathlib import Path
+
+from tiny_tls_py.models.tls_record_framer import (
+    RECORD_HEADER_LENGTH,
+    HandshakeReassembler,
+    TlsRecordFramer,
+)
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+
+def load_corpus() -> dict[str, bytes]:
+    """名前 -> ClientHelloを1つのハンドシェイクレコードにしたもの。"""
+    corpus = {}
+    for path in sorted(CORPUS_DIR.glob("*.hex")):
+        framer = TlsRecordFramer()
+        framer.feed(bytes.fromhex(path.read_text()))
+        reassembler = HandshakeReassembler()
+        messages = [
+            bytes(message)
+            for record in framer.records()
+            for message in reassembler.feed(record[RECORD_HEADER_LENGTH:])
+        ]
+        if len(messages) != 1:
+            raise ValueError(
+                f"{path}にはClientHelloが1つだけ入っている必要があります。"
+            )
+        corpus[path.stem] = (
+            b"\x16\x03\x01" + len(messages[0]).to_bytes(2, "big") + messages[0]
+        )
+    return corpus
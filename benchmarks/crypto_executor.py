@@ -0,0 +1,104 @@
+"""KeyServiceのcrypto_executor(inline, thread, process)ごとに、1秒あたりのハンドシェイク数を比べる。
+
+backendごとにAsyncTlsServerを別プロセスで起動し、concurrency本の接続を
+同時に張りながら、ClientHelloを送ってServerHelloを受け取るまでを繰り返す
+(証明書は設定しないので、CertificateVerifyの署名は含まない)。
+
+inlineはイベントループの上で鍵交換を計算するので、同時接続を増やしても
+1本ずつしか進まない。threadとprocessは鍵交換をプールに任せて、結果を待つ間に
+イベントループが他の接続のClientHelloを読んだりServerHelloを書いたりする。
+threadはcryptographyがGILを手放す間しか並列に計算できず、processは
+プロセス間の往復のコストがかかる。
+
+    python benchmarks/crypto_executor.py --concurrency 1 16 --json crypto_executor.json
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+
+from results import save_results
+from server_throughput import SRC_DIR, percentiles, run_clients, wait_until_listening
+
+from tiny_tls_py.models.crypto_executor import CRYPTO_EXECUTORS
+
+SERVER = """
+import asyncio
+from tiny_tls_py.async_server import AsyncTlsServer
+from tiny_tls_py.models.key_service import KeyService
+KeyService.configure_crypto_executor({backend!r}, {workers})
+asyncio.run(AsyncTlsServer(ip="127.0.0.1", port={port}).serve_forever())
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=10113)
+    parser.add_argument("--handshakes", type=int, default=2000)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 16])
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=CRYPTO_EXECUTORS,
+        default=list(CRYPTO_EXECUTORS),
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="thread/processのプールの大きさ"
+    )
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]} (GIL {'有効' if gil_enabled else '無効'})")
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    results = []
+    print(
+        f"{'backend':<9} {'concurrency':>11} {'handshakes/s':>13}"
+        f" {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for offset, backend in enumerate(args.backends):
+        port = args.port + offset
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                SERVER.format(backend=backend, workers=args.workers, port=port),
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            asyncio.run(wait_until_listening(port))
+            # プールのスレッドやプロセスを起動しておく
+            asyncio.run(run_clients(port, 16, 4))
+            for concurrency in args.concurrency:
+                rate, latencies = asyncio.run(
+                    run_clients(port, args.handshakes, concurrency)
+                )
+                p50, p99 = percentiles(latencies)
+                results.append(
+                    {
+                        "name": f"{backend} concurrency={concurrency}",
+                        "handshakes_per_s": rate,
+                        "p50_ms": p50,
+                        "p99_ms": p99,
+                        "gil_enabled": gil_enabled,
+                    }
+                )
+                print(
+                    f"{backend:<9} {concurrency:>11} {rate:>13.1f}"
+                    f" {p50:>8.2f} {p99:>8.2f}"
+                )
+        finally:
+            process.terminate()
+            process.wait()
+    if args.json:
+        save_results(args.json, "crypto_executor", results)
+
+
+if __name__ == "__main__":
+    main()
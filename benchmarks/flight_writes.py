@@ -0,0 +1,185 @@
+"""サーバーのフライトを送るときの、1ハンドシェイクあたりのシステムコールとTCPセグメントの数。
+
+同期サーバー(server.TCPHandler)を同じプロセスのスレッドで起動し、ClientHelloを
+送ってServerHello、ChangeCipherSpec、暗号化したフライトを受け取るまでを繰り返す。
+サーバー側のソケットを包んで送受信のシステムコールを数え、接続を閉じる前に
+TCP_INFOのtcpi_segs_outで送ったセグメント数を読む(SYN-ACKとACKも含む)。
+
+    sendmsg     TlsConnection.outgoingを1回のsendmsg()で送る(TCP_NODELAY)
+    per_record  レコードごとにsendall()で送る(Nagleあり)。まとめる前の書き方
+
+    python benchmarks/flight_writes.py --handshakes 500 --json flight_writes.json
+"""
+
+import argparse
+import socket
+import socketserver
+import statistics
+import struct
+import threading
+import time
+from collections import Counter
+from typing import ClassVar
+
+from client_hellos import build_client_hello
+from results import save_results
+
+from tiny_tls_py.models.certificate import KEY_ALGORITHMS, ServerCredentials
+from tiny_tls_py.models.enums import ContentType
+from tiny_tls_py.models.tls_handshake_processor import TlsHandshakeProcessor
+from tiny_tls_py.models.tls_record_framer import RECORD_HEADER_LENGTH
+from tiny_tls_py.server import TCPHandler
+
+# struct tcp_infoのtcpi_segs_out(__u32)の位置(Linux 4.2以降)
+TCPI_SEGS_OUT = struct.Struct("=I")
+TCPI_SEGS_OUT_OFFSET = 136
+TCP_INFO_LENGTH = 256
+
+
+class CountingSocket:
+    """送受信のシステムコールを数えるだけのソケットの包み。"""
+
+    def __init__(self, sock: socket.socket, calls: Counter[str]):
+        self._sock = sock
+        self._calls = calls
+
+    def __getattr__(self, name: str):
+        return getattr(self._sock, name)
+
+    def recv_into(self, *args) -> int:
+        self._calls["recv"] += 1
+        return self._sock.recv_into(*args)
+
+    def sendmsg(self, *args) -> int:
+        self._calls["send"] += 1
+        return self._sock.sendmsg(*args)
+
+    def send(self, *args) -> int:
+        self._calls["send"] += 1
+        return self._sock.send(*args)
+
+    def sendall(self, data) -> None:
+        # sendall()は送りきるまでsend()を繰り返す
+        view = memoryview(data)
+        while view:
+            view = view[self.send(view) :]
+
+
+def segments_out(sock: socket.socket) -> int:
+    info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_LENGTH)
+    if len(info) < TCPI_SEGS_OUT_OFFSET + TCPI_SEGS_OUT.size:
+        return 0
+    return TCPI_SEGS_OUT.unpack_from(info, TCPI_SEGS_OUT_OFFSET)[0]
+
+
+class CountingHandler(TCPHandler):
+    calls: ClassVar[Counter[str]] = Counter()
+
+    def setup(self):
+        self.raw_socket = self.request
+        self.request = CountingSocket(self.request, self.calls)
+        super().setup()
+
+    def finish(self):
+        self.calls["segments"] += segments_out(self.raw_socket)
+        self.calls["handshakes"] += 1
+
+
+class PerRecordHandler(CountingHandler):
+    def setup(self):
+        self.raw_socket = self.request
+        self.request = CountingSocket(self.request, self.calls)
+
+    def flush(self, connection):
+        for segment in connection.outgoing.drain():
+            # 暗号化したフライトは1レコードなので、セグメントの境界はレコードの境界
+            offset = 0
+            while offset < len(segment):
+                length = int.from_bytes(segment[offset + 3 : offset + 5], "big")
+                record_end = offset + RECORD_HEADER_LENGTH + length
+                self.request.sendall(segment[offset:record_end])
+                offset = record_end
+
+
+HANDLERS = {"sendmsg": CountingHandler, "per_record": PerRecordHandler}
+
+
+def handshake(port: int) -> float:
+    """暗号化したフライトを受け取るまでの秒数を返す。"""
+    start = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(build_client_hello())
+        reader = sock.makefile("rb")
+        while True:
+            header = reader.read(RECORD_HEADER_LENGTH)
+            if len(header) < RECORD_HEADER_LENGTH:
+                raise ConnectionError("フライトの途中で切断されました。")
+            fragment = reader.read(int.from_bytes(header[3:5], "big"))
+            if header[0] == ContentType.alert:
+                raise ConnectionError(f"alertを受信しました: {fragment.hex()}")
+            if header[0] == ContentType.application_data:
+                break
+    return time.perf_counter() - start
+
+
+def measure(name: str, handshakes: int) -> dict[str, object]:
+    handler = HANDLERS[name]
+    handler.calls = Counter()
+    with socketserver.TCPServer(("127.0.0.1", 0), handler) as server:
+        port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        handshake(port)
+        handler.calls.clear()
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(handshakes):
+            latencies.append(handshake(port))
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        thread.join()
+    calls = handler.calls
+    # クライアントが切断した後のハンドラーも数え終わってから割る
+    count = calls["handshakes"] or 1
+    return {
+        "name": name,
+        "handshakes_per_s": handshakes / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "send_calls": calls["send"] / count,
+        "recv_calls": calls["recv"] / count,
+        "segments": calls["segments"] / count,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--handshakes", type=int, default=500)
+    parser.add_argument("--certificate", choices=KEY_ALGORITHMS, default="ecdsa-p256")
+    parser.add_argument("--modes", nargs="+", choices=HANDLERS, default=list(HANDLERS))
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    TlsHandshakeProcessor.set_credentials(
+        ServerCredentials.generate_self_signed(args.certificate)
+    )
+    results = []
+    print(
+        f"{'mode':<11} {'handshakes/s':>13} {'p50 ms':>8}"
+        f" {'send':>6} {'recv':>6} {'segments':>9}"
+    )
+    for name in args.modes:
+        result = measure(name, args.handshakes)
+        results.append(result)
+        print(
+            f"{name:<11} {result['handshakes_per_s']:>13.1f} {result['p50_ms']:>8.2f}"
+            f" {result['send_calls']:>6.2f} {result['recv_calls']:>6.2f}"
+            f" {result['segments']:>9.2f}"
+        )
+    if args.json:
+        save_results(args.json, "flight_writes", results)
+
+
+if __name__ == "__main__":
+    main()
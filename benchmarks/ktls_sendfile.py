@@ -0,0 +1,146 @@
+"""ハンドシェイクの後に大きいファイルをループバックで送るスループットを、kTLSの有無で比べる。
+
+同期サーバー(server.TCPHandler)を別プロセスで起動し、Pythonのsslモジュールの
+クライアントがハンドシェイクを終えると、サーバーはファイルを送ってclose_notifyで閉じる。
+
+    userspace  ファイルを64KiBずつ読んで、RecordProtectionで暗号化して送る
+    ktls       送信の鍵をkTLSに入れて、os.sendfile()で送る
+
+カーネルにtlsモジュールがなければ、ktlsはユーザー空間にフォールバックするので
+結果は"ktls (fallback)"として出す。
+
+    python benchmarks/ktls_sendfile.py --megabytes 256 --rounds 3 --json ktls.json
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+from results import save_results
+from server_throughput import SRC_DIR, wait_until_listening
+
+from tiny_tls_py.connection import ConnectionState, TlsConnection
+from tiny_tls_py.ktls import kernel_tls_available
+from tiny_tls_py.models.enums import AlertDescription
+from tiny_tls_py.models.tls_handshake_processor import TlsHandshakeProcessor
+from tiny_tls_py.server import TCPHandler, load_credentials
+
+MODES = ("userspace", "ktls")
+
+
+class FileHandler(TCPHandler):
+    path = ""
+
+    def serve(self, connection: TlsConnection) -> None:
+        while connection.state != ConnectionState.CONNECTED:
+            if connection.closed or not self.receive(connection):
+                return
+            self.flush(connection)
+        connection.offload_to_kernel(self.request)
+        with open(self.path, "rb") as file:
+            self.sendfile(connection, file)
+        # handle()がclose_notifyを送ってから閉じる
+        connection.send_alert(AlertDescription.close_notify)
+
+
+def serve(port: int, path: str, mode: str) -> None:
+    TlsHandshakeProcessor.set_credentials(load_credentials())
+    TlsConnection.configure_kernel_tls(mode == "ktls")
+    FileHandler.path = path
+    socketserver.TCPServer.allow_reuse_address = True
+    with socketserver.TCPServer(("127.0.0.1", port), FileHandler) as server:
+        server.serve_forever()
+
+
+def download(port: int) -> int:
+    """ハンドシェイクしてから、サーバーが閉じるまでに受け取ったバイト数。"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.minimum_version = ssl.TLSVersion.TLSv1_3
+    received = 0
+    buffer = bytearray(2**20)
+    with (
+        socket.create_connection(("127.0.0.1", port)) as sock,
+        context.wrap_socket(sock) as tls,
+    ):
+        while size := tls.recv_into(buffer):
+            received += size
+    return received
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=10203)
+    parser.add_argument("--megabytes", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port, args.path, args.serve)
+        return
+
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    results = []
+    with tempfile.NamedTemporaryFile() as file:
+        for _ in range(args.megabytes):
+            file.write(os.urandom(2**20))
+        file.flush()
+        size = args.megabytes * 2**20
+        print(f"{'mode':<17} {'MB/s':>9} {'seconds':>8}")
+        for offset, mode in enumerate(args.modes):
+            port = args.port + offset
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    __file__,
+                    "--serve",
+                    mode,
+                    "--port",
+                    str(port),
+                    "--path",
+                    file.name,
+                ],
+                env=env,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                asyncio.run(wait_until_listening(port))
+                seconds = []
+                for _ in range(args.rounds):
+                    start = time.perf_counter()
+                    received = download(port)
+                    seconds.append(time.perf_counter() - start)
+                    if received != size:
+                        raise RuntimeError(
+                            f"{received}バイトしか受け取れませんでした。"
+                        )
+            finally:
+                process.terminate()
+                process.wait()
+            name = mode
+            if mode == "ktls" and not kernel_tls_available():
+                name = "ktls (fallback)"
+            best = min(seconds)
+            results.append(
+                {"name": name, "megabytes_per_s": size / 1e6 / best, "seconds": best}
+            )
+            print(f"{name:<17} {size / 1e6 / best:>9.1f} {best:>8.3f}")
+    if args.json:
+        save_results(args.json, "ktls_sendfile", results)
+
+
+if __name__ == "__main__":
+    main()
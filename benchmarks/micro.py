@@ -0,0 +1,92 @@
+"""パースやシリアライズ、鍵の操作のマイクロベンチマーク。
+
+パースはcorpus/のClientHelloごとに測る。各ベンチマークはnumber回の
+呼び出しをrepeat回繰り返し、いちばん速かった回の1回あたりの時間を出す。
+
+    python benchmarks/micro.py --json micro.json
+"""
+
+import argparse
+import time
+import timeit
+
+from corpus import load_corpus
+from results import save_results
+
+from tiny_tls_py.models.enums import ExtensionType
+from tiny_tls_py.models.key_service import KeyService
+from tiny_tls_py.models.server_hello import ServerHello
+from tiny_tls_py.wire.client_hello import ClientHello
+from tiny_tls_py.wire.extension import KeyShare
+from tiny_tls_py.wire.tls_record import TlsRecord
+
+
+def parse_benchmarks(corpus: dict[str, bytes]):
+    for name, record in corpus.items():
+        # レコードヘッダー(5) + ハンドシェイクヘッダー(4)の後ろがClientHello
+        client_hello_body = record[9:]
+        client_hello = ClientHello.from_bytes(client_hello_body)
+        offset, length = client_hello._extension_index[ExtensionType.KeyShare]
+        key_share_data = client_hello._original_data[offset : offset + length]
+        yield f"TlsRecord.from_bytes[{name}]", lambda r=record: TlsRecord.from_bytes(r)
+        yield (
+            f"ClientHello.from_bytes[{name}]",
+            lambda b=client_hello_body: ClientHello.from_bytes(b),
+        )
+        yield (
+            f"KeyShare.from_bytes[{name}]",
+            lambda d=key_share_data: KeyShare.from_bytes(d),
+        )
+
+
+def key_service_benchmarks(number: int, repeat: int):
+    key_pair = KeyService.generate_X25519_KeyPair()
+    peer = KeyService.generate_X25519_KeyPair()
+    server_hello = ServerHello.from_bytes(
+        client_sessionid=bytes(32), raw_public_key=key_pair.raw_public_key
+    )
+    yield "ServerHello.bytes", server_hello.bytes
+    yield "KeyService.generate_X25519_KeyPair", KeyService.generate_X25519_KeyPair
+    yield (
+        "KeyService.load_X25519_publickey",
+        lambda: KeyService.load_X25519_publickey(peer.raw_public_key),
+    )
+    yield (
+        "KeyService.generate_common_secret",
+        lambda: KeyService.generate_common_secret(
+            key_pair.private_key, peer.public_key
+        ),
+    )
+    # 測っている間に空にならないだけの鍵ペアを先に貯めておく
+    pool = KeyService.start_key_pool(number * repeat + 1, 1)
+    while pool.stats.depth < number * repeat:
+        time.sleep(0.05)
+    yield "KeyService.acquire_X25519_KeyPair (pool)", KeyService.acquire_X25519_KeyPair
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'benchmark':<58} {'µs/op':>9} {'ops/s':>11}")
+    benchmarks = [
+        *parse_benchmarks(load_corpus()),
+        *key_service_benchmarks(args.number, args.repeat),
+    ]
+    for name, function in benchmarks:
+        seconds = (
+            min(timeit.repeat(function, number=args.number, repeat=args.repeat))
+            / args.number
+        )
+        results.append({"name": name, "us": seconds * 1e6, "ops_per_s": 1 / seconds})
+        print(f"{name:<58} {seconds * 1e6:>9.2f} {1 / seconds:>11.0f}")
+    if args.json:
+        save_results(args.json, "micro", results)
+
+
+if __name__ == "__main__":
+    main()
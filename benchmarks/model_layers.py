@@ -0,0 +1,74 @@
+"""pydanticのモデル(models/)と__slots__のwireモデル(wire/)の生成コストとメモリを比べる。
+
+1ハンドシェイク分として、ClientHelloレコードのパースと、
+ServerHelloを包むHandshake/TlsRecordの生成を測る。
+
+    python benchmarks/model_layers.py
+"""
+
+import os
+import timeit
+import tracemalloc
+from functools import partial
+
+from client_hellos import build_client_hello
+
+from tiny_tls_py.models import handshake as model_handshake
+from tiny_tls_py.models import tls_record as model_tls_record
+from tiny_tls_py.models.enums import ContentType, HandshakeType, ProtocolVersion
+from tiny_tls_py.wire import handshake as wire_handshake
+from tiny_tls_py.wire import tls_record as wire_tls_record
+
+LAYERS = {
+    "pydantic": (model_tls_record.TlsRecord, model_handshake.Handshake),
+    "wire": (wire_tls_record.TlsRecord, wire_handshake.Handshake),
+}
+ROUNDS = 5000
+SERVER_HELLO_BODY = os.urandom(118)
+
+
+def one_handshake(tls_record_class, handshake_class, client_hello: bytes):
+    received = tls_record_class.from_bytes(client_hello)
+    server_hello = handshake_class(
+        msg_type=HandshakeType.ServerHello,
+        length=len(SERVER_HELLO_BODY),
+        body=SERVER_HELLO_BODY,
+    )
+    sent = tls_record_class(
+        content_type=ContentType.handshake,
+        legacy_record_version=ProtocolVersion.TLS_1_2,
+        length=len(SERVER_HELLO_BODY) + 4,
+        fragment=server_hello,
+    )
+    return received, sent
+
+
+def retained_bytes(tls_record_class, handshake_class, client_hello: bytes) -> int:
+    """1ハンドシェイク分のオブジェクトを生かしておくのに必要なメモリ。"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [
+        one_handshake(tls_record_class, handshake_class, client_hello)
+        for _ in range(ROUNDS)
+    ]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del kept
+    return size // ROUNDS
+
+
+def main() -> None:
+    client_hello = build_client_hello()
+    print(f"{'layer':<9} {'us/handshake':>12} {'bytes/handshake':>15}")
+    for name, (tls_record_class, handshake_class) in LAYERS.items():
+        seconds = timeit.timeit(
+            partial(one_handshake, tls_record_class, handshake_class, client_hello),
+            number=ROUNDS,
+        )
+        size = retained_bytes(tls_record_class, handshake_class, client_hello)
+        print(f"{name:<9} {seconds / ROUNDS * 1e6:>12.2f} {size:>15}")
+
+
+if __name__ == "__main__":
+    main()
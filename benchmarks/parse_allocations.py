@@ -0,0 +1,157 @@
+"""ClientHelloを1回パースするときのメモリ確保をtracemallocで数える。
+
+memoryviewで下の層に渡すようになる前は、TlsRecord → Handshake → ClientHello →
+parse_extensions → KeyShare → KeyShareEntryの各層でbytesをスライスしていた。
+そのbytesをスライスするパーサー(legacy)と今のmemoryviewのパーサー(memoryview)を
+同じモデルを作るところまで同じ条件でtracemallocの下で動かし、1回あたりに
+
+    transient_bytes  パース中に確保されて、終わる前に解放されたバイト数の最大
+                     (中間のbytesのコピーはここに出る)
+    retained_bytes   パースが終わった後も残っているバイト数(モデルそのもの)
+
+を比べる。
+
+    python benchmarks/parse_allocations.py
+"""
+
+import tracemalloc
+
+from client_hellos import build_client_hello
+
+from tiny_tls_py.models.client_hello import ClientHello, ProtocolVersion
+from tiny_tls_py.models.enums import ContentType, ExtensionType, HandshakeType
+from tiny_tls_py.models.enums import ProtocolVersion as RecordVersion
+from tiny_tls_py.models.extension import (
+    Extension,
+    KeyShare,
+    KeyShareEntry,
+    SupportedVersion,
+)
+from tiny_tls_py.models.handshake import Handshake
+from tiny_tls_py.models.tls_record import TlsRecord
+
+ROUNDS = 1000
+
+
+def legacy_key_share(data: bytes) -> KeyShare:
+    entries = []
+    offset = 2
+    while offset < len(data):
+        entry_length = int.from_bytes(data[offset + 2 : offset + 4], "big")
+        entry = data[offset : offset + 4 + entry_length]
+        entries.append(
+            KeyShareEntry(
+                group=entry[:2],
+                length=int.from_bytes(entry[2:4], "big"),
+                key_exchange=entry[4:],
+            )
+        )
+        offset += 4 + entry_length
+    return KeyShare(length=int.from_bytes(data[0:2], "big"), entries=entries)
+
+
+def legacy_extensions(data: bytes) -> list[Extension]:
+    extensions = []
+    offset = 0
+    while offset < len(data):
+        extension_type = ExtensionType(int.from_bytes(data[offset : offset + 2], "big"))
+        length = int.from_bytes(data[offset + 2 : offset + 4], "big")
+        extension_data = data[offset + 4 : offset + 4 + length]
+        parsed: SupportedVersion | KeyShare | bytes
+        if extension_type == ExtensionType.SupportedVersions:
+            parsed = SupportedVersion(version=extension_data)
+        elif extension_type == ExtensionType.KeyShare:
+            parsed = legacy_key_share(extension_data)
+        else:
+            parsed = extension_data
+        extensions.append(Extension(extension_type=extension_type, data=parsed))
+        offset += 4 + length
+    return extensions
+
+
+def legacy_client_hello(data: bytes) -> ClientHello:
+    session_id_length = data[34]
+    cipher_suites_start = 35 + session_id_length
+    cipher_suites_end = (
+        cipher_suites_start
+        + 2
+        + int.from_bytes(data[cipher_suites_start : cipher_suites_start + 2], "big")
+    )
+    extensions_length = int.from_bytes(
+        data[cipher_suites_end + 2 : cipher_suites_end + 4], "big"
+    )
+    extensions = data[cipher_suites_end + 4 : cipher_suites_end + 4 + extensions_length]
+    client_hello = ClientHello(
+        protocol_version=ProtocolVersion(int.from_bytes(data[:2], "big")),
+        session_id=data[35:cipher_suites_start],
+        random=data[2:34],
+        cipher_suites=data[cipher_suites_start + 2 : cipher_suites_end],
+        extensions=legacy_extensions(extensions),
+    )
+    client_hello._original_data = data
+    return client_hello
+
+
+def legacy_parse(record: bytes) -> TlsRecord:
+    """memoryviewを使う前のパーサー。各層が受け取ったbytesをスライスして下に渡す。"""
+    fragment = record[5:]  # TlsRecord.from_bytes -> Handshake.from_bytes(data[5:])
+    body = fragment[4:]  # Handshake.from_bytes -> ClientHello.from_bytes(body)
+    handshake = Handshake(
+        msg_type=HandshakeType(fragment[0]),
+        length=int.from_bytes(fragment[1:4], "big"),
+        body=legacy_client_hello(body),
+    )
+    return TlsRecord(
+        content_type=ContentType(record[0]),
+        legacy_record_version=RecordVersion(int.from_bytes(record[1:3], "big")),
+        length=int.from_bytes(record[3:5], "big"),
+        fragment=handshake,
+    )
+
+
+PARSERS = {
+    "legacy": legacy_parse,
+    "memoryview": TlsRecord.from_bytes,
+}
+
+
+def traced(parse, record: bytes) -> tuple[int, int]:
+    """parseをROUNDS回呼んで、1回あたりの(transient_bytes, retained_bytes)を返す。"""
+    parse(record)
+    transient = retained = 0
+    results = []
+    tracemalloc.start()
+    for _ in range(ROUNDS):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        results.append(parse(record))
+        current, peak = tracemalloc.get_traced_memory()
+        # 結果をresultsに残しているので、ピークから終わった時点の量を引いた分が
+        # 途中で解放されたメモリになる
+        transient += peak - current
+        retained += current - before
+    tracemalloc.stop()
+    return transient // ROUNDS, retained // ROUNDS
+
+
+def main() -> None:
+    samples = {
+        "x25519": build_client_hello(),
+        "x25519+mlkem768": build_client_hello(post_quantum=True),
+        "x25519+padding512": build_client_hello(padding=512),
+    }
+    print(
+        f"{'client_hello':<18} {'size':>5} {'parser':<10}"
+        f" {'transient_bytes':>15} {'retained_bytes':>14}"
+    )
+    for name, record in samples.items():
+        for parser, parse in PARSERS.items():
+            transient, retained = traced(parse, record)
+            print(
+                f"{name:<18} {len(record):>5} {parser:<10}"
+                f" {transient:>15} {retained:>14}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""preforkサーバーのワーカー数を変えて、1台でのハンドシェイク/秒の伸びを測る。
+
+クライアント側もPythonなので、負荷をかける側は別プロセスを複数起動する。
+
+    python benchmarks/prefork_scaling.py --workers 1 2 4 8 --clients 8
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from server_throughput import SRC_DIR, run_clients, wait_until_listening
+
+PREFORK_SERVER = """
+from tiny_tls_py.prefork import PreforkServer
+PreforkServer(workers={workers}, ip="127.0.0.1", port={port}).run()
+"""
+
+
+def client_process(port: int, connections: int, concurrency: int) -> float:
+    return asyncio.run(run_clients(port, connections, concurrency))[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=10303)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    print(f"{'workers':>7} {'handshakes/s':>13} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                PREFORK_SERVER.format(workers=workers, port=args.port),
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            asyncio.run(wait_until_listening(args.port))
+            # 全ワーカーがbindし終わるのを待つ
+            time.sleep(1.0)
+            per_client = args.connections // args.clients
+            with multiprocessing.Pool(args.clients) as pool:
+                start = time.perf_counter()
+                pool.starmap(
+                    client_process,
+                    [(args.port, per_client, args.concurrency)] * args.clients,
+                )
+                rate = per_client * args.clients / (time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait()
+        baseline = baseline or rate
+        print(f"{workers:>7} {rate:>13.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
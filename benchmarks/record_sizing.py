@@ -0,0 +1,137 @@
+"""application_dataのレコードの大きさの決め方で、最初のバイトまでの時間とスループットを比べる。
+
+asyncioサーバー(AsyncTlsServer)にstream.pyのhandlerを渡して別プロセスで起動し、
+Pythonのsslモジュールのクライアントが1行送ると、サーバーはwrite_all()で
+レスポンスを送って閉じる。クライアントは送ってから最初の平文を読めるまでの
+時間(ttfb)と、全部を受け取るまでの時間を測る。
+
+    adaptive  最初の128KiBは1セグメントに収まるレコード、その後は16KiB(デフォルト)
+    fixed     最初から16KiBのレコード
+    small     ずっと1セグメントに収まるレコード
+
+ループバックは輻輳ウィンドウがすぐに広がるので、ttfbの差は実際の回線より小さく出る。
+
+    python benchmarks/record_sizing.py --megabytes 8 --rounds 5 --json sizing.json
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import time
+
+from results import save_results
+from server_throughput import SRC_DIR, wait_until_listening
+
+from tiny_tls_py.async_server import AsyncTlsServer
+from tiny_tls_py.connection import TlsConnection
+from tiny_tls_py.models.record_sizer import RAMP_UP_BYTES
+from tiny_tls_py.models.tls_handshake_processor import TlsHandshakeProcessor
+from tiny_tls_py.server import load_credentials
+from tiny_tls_py.stream import TlsReader, TlsWriter
+
+# モード -> TlsConnection.configure_record_sizing()のramp_up_bytes
+MODES = {"adaptive": RAMP_UP_BYTES, "fixed": 0, "small": 2**62}
+
+
+def serve(port: int, megabytes: int, mode: str) -> None:
+    TlsHandshakeProcessor.set_credentials(load_credentials())
+    TlsConnection.configure_record_sizing(ramp_up_bytes=MODES[mode])
+    response = os.urandom(megabytes * 2**20)
+
+    async def handler(reader: TlsReader, writer: TlsWriter) -> None:
+        await reader.read()
+        await writer.write_all(response)
+
+    asyncio.run(AsyncTlsServer(port=port, handler=handler).serve_forever())
+
+
+def download(port: int) -> tuple[float, float, int]:
+    """(最初のバイトまでの秒数, 全部を受け取るまでの秒数, 受け取ったバイト数)。"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.minimum_version = ssl.TLSVersion.TLSv1_3
+    buffer = bytearray(2**20)
+    with (
+        socket.create_connection(("127.0.0.1", port)) as sock,
+        context.wrap_socket(sock) as tls,
+    ):
+        # Finishedの直後の小さい書き込みを、Nagleで遅らせない
+        tls.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        start = time.perf_counter()
+        tls.sendall(b"GET\n")
+        received = tls.recv_into(buffer)
+        first_byte = time.perf_counter() - start
+        while size := tls.recv_into(buffer):
+            received += size
+        return first_byte, time.perf_counter() - start, received
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=10303)
+    parser.add_argument("--megabytes", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port, args.megabytes, args.serve)
+        return
+
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    size = args.megabytes * 2**20
+    results = []
+    print(f"{'mode':<9} {'ttfb ms':>8} {'MB/s':>9}")
+    for offset, mode in enumerate(args.modes):
+        port = args.port + offset
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                __file__,
+                "--serve",
+                mode,
+                "--port",
+                str(port),
+                "--megabytes",
+                str(args.megabytes),
+            ],
+            env=env,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            asyncio.run(wait_until_listening(port))
+            first_bytes = []
+            seconds = []
+            for _ in range(args.rounds):
+                first_byte, elapsed, received = download(port)
+                if received != size:
+                    raise RuntimeError(f"{received}バイトしか受け取れませんでした。")
+                first_bytes.append(first_byte)
+                seconds.append(elapsed)
+        finally:
+            process.terminate()
+            process.wait()
+        ttfb = min(first_bytes) * 1000
+        best = min(seconds)
+        results.append(
+            {
+                "name": mode,
+                "ttfb_ms": ttfb,
+                "megabytes_per_s": size / 1e6 / best,
+            }
+        )
+        print(f"{mode:<9} {ttfb:>8.3f} {size / 1e6 / best:>9.1f}")
+    if args.json:
+        save_results(args.json, "record_sizing", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""ベンチマークの結果をJSONに保存するヘルパー。
+
+コミットごとに保存しておけば、compare.pyで2つの結果を並べて
+遅くなったベンチマークを探せる。
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from importlib.metadata import version
+
+
+def git_commit() -> str:
+    """今のコミットのハッシュ。コミットしていない変更があれば"-dirty"を付ける。"""
+    repository = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=repository,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=repository,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def environment() -> dict[str, object]:
+    return {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "cryptography": version("cryptography"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def save_results(path: str, benchmark: str, results: list[dict[str, object]]) -> None:
+    """resultsの各要素は"name"と数値の指標を持つ辞書。
+
+    指標の名前が"_per_s"で終わるものは大きいほど良く、それ以外は小さいほど良い。
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(
+            {"benchmark": benchmark, "environment": environment(), "results": results},
+            file,
+            ensure_ascii=False,
+            indent=2,
+        )
+        file.write("\n")
@@ -0,0 +1,145 @@
+"""TCPServer版(server.py)とasyncio版(async_server.py)のハンドシェイクスループットを比べる。
+
+それぞれのサーバーを別プロセスで起動し、同時接続数を変えながら
+ClientHelloを送ってServerHelloを受け取るまでを繰り返す。
+1回ごとの所要時間からp50/p99のレイテンシも出す。
+
+    python benchmarks/server_throughput.py --connections 2000 --concurrency 1 16 128
+    python benchmarks/server_throughput.py --client-hello chrome_reconstructed \\
+        --json throughput.json
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from client_hellos import build_client_hello
+from corpus import load_corpus
+from results import save_results
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..", "src")
+
+SERVERS = {
+    "tcpserver": """
+import socketserver
+from tiny_tls_py.server import TCPHandler
+socketserver.TCPServer.allow_reuse_address = True
+with socketserver.TCPServer(("127.0.0.1", {port}), TCPHandler) as server:
+    server.serve_forever()
+""",
+    "asyncio": """
+import asyncio
+from tiny_tls_py.async_server import AsyncTlsServer
+asyncio.run(AsyncTlsServer(ip="127.0.0.1", port={port}).serve_forever())
+""",
+}
+
+
+async def handshake_once(port: int, client_hello: bytes) -> float:
+    """接続してからServerHelloを受け取るまでの秒数。"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(client_hello)
+        await writer.drain()
+        header = await reader.readexactly(5)
+        await reader.readexactly(int.from_bytes(header[3:5], "big"))
+        return time.perf_counter() - start
+    finally:
+        writer.close()
+
+
+async def run_clients(
+    port: int, connections: int, concurrency: int, client_hello: bytes | None = None
+) -> tuple[float, list[float]]:
+    """(1秒あたりのハンドシェイク数, 1回ごとの秒数のリスト)を返す。"""
+    client_hello = client_hello or build_client_hello()
+    remaining = connections
+    latencies = []
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            latencies.append(await handshake_once(port, client_hello))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return connections / (time.perf_counter() - start), latencies
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float]:
+    """(p50, p99)をミリ秒で返す。"""
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49] * 1000, quantiles[98] * 1000
+
+
+async def wait_until_listening(port: int) -> None:
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except ConnectionRefusedError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"ポート{port}でサーバーが起動しませんでした。")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=10103)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS))
+    parser.add_argument(
+        "--client-hello", help="corpus/から使うClientHelloの名前(既定は合成したもの)"
+    )
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    client_hello = load_corpus()[args.client_hello] if args.client_hello else None
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    results = []
+    print(
+        f"{'server':<10} {'concurrency':>11} {'handshakes/s':>13}"
+        f" {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for offset, name in enumerate(args.servers):
+        port = args.port + offset
+        process = subprocess.Popen(
+            [sys.executable, "-c", SERVERS[name].format(port=port)],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            asyncio.run(wait_until_listening(port))
+            for concurrency in args.concurrency:
+                rate, latencies = asyncio.run(
+                    run_clients(port, args.connections, concurrency, client_hello)
+                )
+                p50, p99 = percentiles(latencies)
+                results.append(
+                    {
+                        "name": f"{name} concurrency={concurrency}",
+                        "handshakes_per_s": rate,
+                        "p50_ms": p50,
+                        "p99_ms": p99,
+                    }
+                )
+                print(
+                    f"{name:<10} {concurrency:>11} {rate:>13.1f}"
+                    f" {p50:>8.2f} {p99:>8.2f}"
+                )
+        finally:
+            process.terminate()
+            process.wait()
+    if args.json:
+        save_results(args.json, "server_throughput", results)
+
+
+if __name__ == "__main__":
+    main()
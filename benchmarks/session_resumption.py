@@ -0,0 +1,102 @@
+"""フルハンドシェイクとチケットによるセッション再開の、サーバー側のコストを比べる。
+
+ClientHelloレコードのパースからServerHelloの生成、サーバーのFinishedまでの
+暗号化したフライトまでを1回として、レイテンシ(p50/p99)と1回あたりの
+CPU時間を測る。フルハンドシェイクには--certificateの鍵での署名が入る。鍵プールは使わないので、フルハンドシェイクと
+psk_dhe_keには鍵ペアの生成も入る(プールを使っても別スレッドでCPUを使う)。
+
+    python benchmarks/session_resumption.py --rounds 2000 --certificate ed25519
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from client_hellos import build_client_hello
+
+from tiny_tls_py.models.certificate import KEY_ALGORITHMS, ServerCredentials
+from tiny_tls_py.models.key_schedule import KeySchedule
+from tiny_tls_py.models.tls_handshake_processor import TlsHandshakeProcessor
+from tiny_tls_py.wire.new_session_ticket import NewSessionTicket
+from tiny_tls_py.wire.tls_record import TlsRecord
+
+PSK_KE = b"\x00"
+PSK_DHE_KE = b"\x01"
+
+
+def issue_ticket() -> tuple[bytes, int, bytes]:
+    """フルハンドシェイクを終えたことにして、チケットと(クライアント側の)PSKを作る。"""
+    key_schedule = KeySchedule()
+    key_schedule.derive_handshake_secrets(os.urandom(32))
+    key_schedule.derive_resumption_master_secret()
+    handshake = TlsHandshakeProcessor.new_session_ticket(key_schedule)
+    assert handshake is not None and isinstance(handshake.body, NewSessionTicket)
+    ticket = handshake.body
+    # 発行してすぐ再接続したことにするので、経過時間は0ミリ秒
+    obfuscated_ticket_age = ticket.ticket_age_add % 2**32
+    return (
+        ticket.ticket,
+        obfuscated_ticket_age,
+        key_schedule.resumption_psk(ticket.ticket_nonce),
+    )
+
+
+def measure(
+    client_hellos: list[bytes], clear_cache: bool
+) -> tuple[float, float, float]:
+    """(p50 µs, p99 µs, 1回あたりのCPU µs)を返す。"""
+    tickets = TlsHandshakeProcessor.session_tickets
+    if tickets is None:
+        raise RuntimeError("先にenable_session_tickets()を呼んでください。")
+    latencies = []
+    cpu_start = time.process_time()
+    for client_hello in client_hellos:
+        if clear_cache:
+            tickets.cache.clear()
+        start = time.perf_counter()
+        response = TlsHandshakeProcessor.build_response(
+            TlsRecord.from_bytes(client_hello), KeySchedule()
+        )
+        latencies.append(time.perf_counter() - start)
+        assert response is not None
+    cpu = (time.process_time() - cpu_start) / len(client_hellos)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49] * 1e6, quantiles[98] * 1e6, cpu * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--certificate", choices=KEY_ALGORITHMS, default="ecdsa-p256")
+    args = parser.parse_args()
+
+    TlsHandshakeProcessor.set_credentials(
+        ServerCredentials.generate_self_signed(args.certificate)
+    )
+    tickets = TlsHandshakeProcessor.enable_session_tickets(
+        lifetime=7200, rotation_interval=3600, cache_size=4096
+    )
+    psk = issue_ticket()
+    scenarios = {
+        "full": (lambda: build_client_hello(), False),
+        "psk_dhe_ke": (
+            lambda: build_client_hello(psk=psk, psk_modes=PSK_DHE_KE),
+            False,
+        ),
+        "psk_ke": (lambda: build_client_hello(psk=psk, psk_modes=PSK_KE), False),
+        "psk_ke (cache miss)": (
+            lambda: build_client_hello(psk=psk, psk_modes=PSK_KE),
+            True,
+        ),
+    }
+    print(f"{'handshake':<20} {'p50 µs':>8} {'p99 µs':>8} {'CPU µs':>8}")
+    for name, (build, clear_cache) in scenarios.items():
+        client_hellos = [build() for _ in range(args.rounds)]
+        p50, p99, cpu = measure(client_hellos, clear_cache)
+        print(f"{name:<20} {p50:>8.1f} {p99:>8.1f} {cpu:>8.1f}")
+    print(tickets.stats())
+
+
+if __name__ == "__main__":
+    main()
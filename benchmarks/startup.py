@@ -0,0 +1,148 @@
+"""tiny-tls-pyの起動の速さとメモリ。コマンドごとに新しいPythonを起動して測る。
+
+    startup_ms  プロセスを起動してから終わるまで(--repeat回の中央値)
+    import_ms   -X importtimeで測った、importにかかった時間の合計
+    rss_mb      プロセスの最大RSS
+
+--max-msや--max-rss-mbを超えたコマンドがあれば、終了コード1で終わる
+(CIで起動が遅くなったのを見つけるため)。.pycのキャッシュがある状態で測るので、
+最初に1回ずつ捨てる実行をする。
+
+    python benchmarks/startup.py --top 5 --json startup.json
+    python benchmarks/startup.py --max-ms cli_help=150 --max-rss-mb serve_prefork=80
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from results import save_results
+
+# 名前 -> pythonに渡す引数
+COMMANDS: dict[str, list[str]] = {
+    "import": ["-c", "import tiny_tls_py"],
+    "cli_help": ["-m", "tiny_tls_py", "--help"],
+    "inspect_config": ["-m", "tiny_tls_py", "inspect", "config"],
+    "serve_sync": ["-c", "import tiny_tls_py.server"],
+    "serve_prefork": ["-c", "import tiny_tls_py.prefork"],
+    "benchmark_client": ["-c", "import tiny_tls_py.client"],
+}
+# どのコマンドでも読み込まないはずのモジュール
+HEAVY_MODULES = ("rich", "pydantic", "http.server")
+
+
+def run(arguments: list[str]) -> tuple[float, float, str]:
+    """(経過秒, 最大RSS(MB), 標準エラー出力)を返す。"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, *arguments],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    # stderr=PIPEなのでNoneにはならない
+    assert process.stderr is not None
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(f"{arguments}が失敗しました:\n{stderr}")
+    # Linuxのru_maxrssはKiB
+    return elapsed, usage.ru_maxrss / 1024, stderr
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int, int]]:
+    """-X importtimeの出力を(モジュール, 深さ, 自身のµs, 累積のµs)にする。"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        if not self_time.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, int(self_time), int(cumulative)))
+    return modules
+
+
+def parse_limits(values: list[str]) -> dict[str, float]:
+    limits = {}
+    for value in values:
+        name, _, limit = value.partition("=")
+        if name not in COMMANDS:
+            raise SystemExit(f"知らないコマンドです: {name}")
+        limits[name] = float(limit)
+    return limits
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--commands", nargs="+", choices=COMMANDS, default=list(COMMANDS)
+    )
+    parser.add_argument(
+        "--top", type=int, default=0, help="自身の時間が長いモジュールを表示する数"
+    )
+    parser.add_argument("--max-ms", action="append", default=[], metavar="NAME=MS")
+    parser.add_argument("--max-rss-mb", action="append", default=[], metavar="NAME=MB")
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+    max_ms = parse_limits(args.max_ms)
+    max_rss_mb = parse_limits(args.max_rss_mb)
+
+    results = []
+    failures = []
+    print(f"{'command':<17} {'startup_ms':>10} {'import_ms':>10} {'rss_mb':>7}")
+    for name in args.commands:
+        arguments = COMMANDS[name]
+        run(arguments)
+        timings = []
+        rss = []
+        for _ in range(args.repeat):
+            elapsed, rss_mb, _ = run(arguments)
+            timings.append(elapsed * 1000)
+            rss.append(rss_mb)
+        _, _, stderr = run(["-X", "importtime", *arguments])
+        modules = parse_importtime(stderr)
+        import_ms = sum(cumulative for _, depth, _, cumulative in modules if not depth)
+        result = {
+            "name": name,
+            "startup_ms": statistics.median(timings),
+            "import_ms": import_ms / 1000,
+            "rss_mb": max(rss),
+        }
+        results.append(result)
+        print(
+            f"{name:<17} {result['startup_ms']:>10.1f} {result['import_ms']:>10.1f}"
+            f" {result['rss_mb']:>7.1f}"
+        )
+        loaded = {module for module, *_ in modules}
+        for heavy in HEAVY_MODULES:
+            if heavy in loaded:
+                failures.append(f"{name}: {heavy}を読み込んでいます")
+        for module, _, self_time, _ in sorted(modules, key=lambda m: -m[2])[: args.top]:
+            print(f"    {self_time / 1000:>7.1f}ms {module}")
+        if name in max_ms and result["startup_ms"] > max_ms[name]:
+            failures.append(
+                f"{name}: 起動に{result['startup_ms']:.1f}ms (上限{max_ms[name]}ms)"
+            )
+        if name in max_rss_mb and result["rss_mb"] > max_rss_mb[name]:
+            failures.append(
+                f"{name}: RSSが{result['rss_mb']:.1f}MB (上限{max_rss_mb[name]}MB)"
+            )
+    if args.json:
+        save_results(args.json, "startup", results)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""キャプチャのコスト。TlsConnectionにClientHelloを渡してServerHelloを返すまでを
+1秒あたり何回できるかを、キャプチャのしかたごとに比べる。
+
+    off      キャプチャしない
+    hex      以前のように、受信したバイト列をhex()にしてprintする(出力は/dev/null)
+    ring     WireCaptureでリングファイルにすべての接続を書く
+    sampled  WireCaptureで10%の接続だけをリングファイルに書く
+
+証明書は設定しないので、署名やフライトの暗号化は含まない(キャプチャの差が
+見えやすいように、1回のハンドシェイクをできるだけ軽くしている)。
+
+    python benchmarks/wire_capture.py --handshakes 5000 --json wire_capture.json
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from client_hellos import build_client_hello
+from results import save_results
+
+from tiny_tls_py.capture import CaptureRingReader, WireCapture
+from tiny_tls_py.connection import TlsConnection
+from tiny_tls_py.models.send_queue import SendQueue
+
+# モード -> WireCapture.configure()に渡すsample_rate(Noneならリングを作らない)
+MODES: dict[str, float | None] = {
+    "off": None,
+    "hex": None,
+    "ring": 1.0,
+    "sampled": 0.1,
+}
+
+
+def handshake_rate(client_hellos: list[bytes], mode: str) -> float:
+    with open(os.devnull, "w") as devnull:
+        start = time.perf_counter()
+        for client_hello in client_hellos:
+            connection = TlsConnection("127.0.0.1")
+            buffer = connection.framer.writable()
+            buffer[: len(client_hello)] = client_hello
+            connection.framer.advance(len(client_hello))
+            if mode == "hex":
+                print(
+                    f"クライアントからのメッセージ: {client_hello.hex()}", file=devnull
+                )
+            connection.receive_records()
+            # kTLSに任せていないので、送る分はSendQueueにある
+            assert isinstance(connection.outgoing, SendQueue)
+            for segment in connection.outgoing.drain():
+                if mode == "hex":
+                    print(f"サーバーからのメッセージ: {segment.hex()}", file=devnull)
+            connection.close()
+        return len(client_hellos) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--handshakes", type=int, default=5000)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    client_hellos = [build_client_hello() for _ in range(args.handshakes)]
+    # 鍵プールなどの初期化を最初のモードに含めないように、先に少し回しておく
+    handshake_rate(client_hellos[:100], "off")
+    results = []
+    print(f"{'mode':<8} {'handshakes/s':>13} {'captured':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.ring")
+        for mode in args.modes:
+            sample_rate = MODES[mode]
+            WireCapture.configure(
+                None if sample_rate is None else path,
+                sample_rate=sample_rate or 1.0,
+                enabled=sample_rate is not None,
+            )
+            rate = handshake_rate(client_hellos, mode)
+            captured = 0
+            if sample_rate is not None:
+                with CaptureRingReader(path) as reader:
+                    captured = sum(1 for _ in reader.entries())
+            WireCapture.configure(None)
+            results.append(
+                {"name": mode, "handshakes_per_s": rate, "captured_entries": captured}
+            )
+            print(f"{mode:<8} {rate:>13.1f} {captured:>9}")
+    if args.json:
+        save_results(args.json, "wire_capture", results)
+
+
+if __name__ == "__main__":
+    main()
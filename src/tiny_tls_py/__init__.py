@@ -0,0 +1,5 @@
+def main() -> None:
+    """tiny-tls-pyコマンド(cli.py)。パッケージを読み込むだけでは何も読み込まない。"""
+    from tiny_tls_py.cli import main
+
+    main()
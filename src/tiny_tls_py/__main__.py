@@ -0,0 +1,4 @@
+from tiny_tls_py.cli import main
+
+if __name__ == "__main__":
+    main()
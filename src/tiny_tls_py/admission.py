@@ -0,0 +1,287 @@
+"""ClientHelloをモデルに組み立てる前の、安いチェックと流量制限。
+
+TlsHandshakeProcessorはClientHelloをモデルにしてから鍵を生成するので、
+ゴミや巨大なClientHelloを大量に送られると、断る前にその分のCPUを使ってしまう。
+ここではバイト列の長さのフィールドを数か所たどるだけで処理できないものを落とし、
+送信元IPごとの接続数とハンドシェイク数をトークンバケットで制限する。
+"""
+
+import struct
+import threading
+import time
+from typing import Final
+
+from tiny_tls_py.metrics import Metrics
+from tiny_tls_py.models.alert import TlsAlert
+from tiny_tls_py.models.enums import (
+    AlertDescription,
+    ContentType,
+    ExtensionType,
+    HandshakeType,
+    ProtocolVersion,
+)
+from tiny_tls_py.models.tls_record_framer import (
+    HANDSHAKE_HEADER_LENGTH,
+    MAX_RECORD_LENGTH,
+)
+
+# 1つのレコードに収まる長さ。ポスト量子のkey_shareとチケットが入っていても十分
+MAX_CLIENT_HELLO_LENGTH: Final[int] = 2**14
+# legacy_version(2) + random(32) + session_id(1) + cipher_suites(2 + 2)
+# + compression_methods(1 + 1) + extensions(2)
+MIN_CLIENT_HELLO_LENGTH: Final[int] = 43
+# TLSには過負荷を表すalertがないので、相手のせいではない理由で断るときに使う
+# internal_error(RFC 8446 6.2)を送る
+SHED_ALERT: Final[AlertDescription] = AlertDescription.internal_error
+
+_CONTENT_TYPES = frozenset(ContentType)
+_CLIENT_HELLO: Final[int] = int(HandshakeType.ClientHello)
+_LEGACY_VERSION: Final[bytes] = ProtocolVersion.TLS_1_2.to_bytes(2, "big")
+_TLS_1_3: Final[bytes] = ProtocolVersion.TLS_1_3.to_bytes(2, "big")
+_CIPHER_SUITE: Final[bytes] = b"\x13\x02"  # TLS_AES_256_GCM_SHA384
+# 長さ(1) + null(0x00)
+_COMPRESSION_METHODS: Final[bytes] = b"\x01\x00"
+_GROUP_X25519: Final[int] = 0x001D
+_SUPPORTED_VERSIONS: Final[int] = int(ExtensionType.SupportedVersions)
+_KEY_SHARE: Final[int] = int(ExtensionType.KeyShare)
+_PRE_SHARED_KEY: Final[int] = int(ExtensionType.PreSharedKey)
+_UINT16 = struct.Struct("!H")
+# extension_type(2) + length(2)。KeyShareEntryのgroup(2) + length(2)にも使う
+_EXTENSION_HEADER = struct.Struct("!HH")
+
+
+def check_record_header(header: bytes | memoryview) -> int:
+    """レコードのヘッダー(5バイト)を確かめて、fragmentの長さを返す。"""
+    if header[0] not in _CONTENT_TYPES:
+        raise TlsAlert(
+            AlertDescription.unexpected_message,
+            f"不正なContentTypeを検出しました: {header[0]}",
+        )
+    # legacy_record_versionは0x0301〜0x0303だが、上位バイトだけ見ればゴミは落とせる
+    if header[1] != 0x03:
+        raise TlsAlert(
+            AlertDescription.decode_error,
+            f"TLSのレコードではありません: {bytes(header[:3]).hex()}",
+        )
+    length = (header[3] << 8) | header[4]
+    if length > MAX_RECORD_LENGTH:
+        raise TlsAlert(
+            AlertDescription.record_overflow, f"TLSRecordが長すぎます: {length}バイト"
+        )
+    return length
+
+
+def check_client_hello(
+    message: bytes | memoryview, max_length: int = MAX_CLIENT_HELLO_LENGTH
+) -> None:
+    """ハンドシェイクヘッダー込みのメッセージが、処理できるClientHelloかを確かめる。
+
+    モデルは作らずに長さのフィールドをたどるだけで、各ベクターの長さが
+    メッセージと合っているか、TLS 1.3とTLS_AES_256_GCM_SHA384を提案しているか、
+    x25519のkey_share(かpre_shared_key)があるかを見る。だめならTlsAlertにする。
+    """
+    # memoryviewの添字アクセスより速いので、数KBのコピーをしてでもbytesにする
+    message = bytes(message)
+    end = len(message)
+    if message[0] != _CLIENT_HELLO:
+        raise TlsAlert(
+            AlertDescription.unexpected_message,
+            f"ClientHelloではないハンドシェイクメッセージです: {message[0]}",
+        )
+    length = int.from_bytes(message[1:4], "big")
+    if length + HANDSHAKE_HEADER_LENGTH != end or length < MIN_CLIENT_HELLO_LENGTH:
+        raise TlsAlert(
+            AlertDescription.decode_error, f"ClientHelloの長さが不正です: {length}"
+        )
+    if length > max_length:
+        raise TlsAlert(
+            AlertDescription.illegal_parameter,
+            f"ClientHelloが長すぎます: {length}バイト",
+        )
+    if message[4:6] != _LEGACY_VERSION:
+        raise TlsAlert(
+            AlertDescription.protocol_version,
+            f"Unsupported protocol version: {message[4:6].hex()}",
+        )
+    # ヘッダー(4) + legacy_version(2) + random(32)の後ろがsession_id
+    offset = 38
+    if message[offset] > 32:
+        raise TlsAlert(AlertDescription.illegal_parameter, "session_idが長すぎます。")
+    offset += 1 + message[offset]
+    if offset + 2 > end:
+        raise TlsAlert(
+            AlertDescription.decode_error, "ClientHelloが途中で切れています。"
+        )
+    (cipher_suites_length,) = _UINT16.unpack_from(message, offset)
+    offset += 2
+    cipher_suites_end = offset + cipher_suites_length
+    if (
+        cipher_suites_length == 0
+        or cipher_suites_length % 2
+        or cipher_suites_end + 3 > end
+    ):
+        raise TlsAlert(AlertDescription.decode_error, "cipher_suitesの長さが不正です。")
+    cipher_suite = _find_uint16(message, _CIPHER_SUITE, offset, cipher_suites_end)
+    # RFC 8446 4.1.2: legacy_compression_methodsはnull(0)の1つだけでなければいけない
+    if message[cipher_suites_end : cipher_suites_end + 2] != _COMPRESSION_METHODS:
+        raise TlsAlert(
+            AlertDescription.illegal_parameter,
+            "compression_methodsがnullだけではありません。",
+        )
+    offset = cipher_suites_end + 2
+    if offset + 2 > end or offset + 2 + _UINT16.unpack_from(message, offset)[0] != end:
+        raise TlsAlert(AlertDescription.decode_error, "拡張の長さが不正です。")
+    offset += 2
+
+    tls_1_3 = x25519 = pre_shared_key = False
+    extension_header = _EXTENSION_HEADER.unpack_from
+    while offset < end:
+        if offset + 4 > end:
+            raise TlsAlert(AlertDescription.decode_error, "拡張の長さが不正です。")
+        extension_type, extension_length = extension_header(message, offset)
+        data = offset + 4
+        offset = data + extension_length
+        if offset > end:
+            raise TlsAlert(
+                AlertDescription.decode_error,
+                "拡張の長さがClientHelloをはみ出しています。",
+            )
+        if extension_type == _SUPPORTED_VERSIONS:
+            # ProtocolVersion versions<2..254>
+            tls_1_3 = extension_length > 0 and _find_uint16(
+                message,
+                _TLS_1_3,
+                data + 1,
+                min(data + 1 + message[data], offset),
+            )
+        elif extension_type == _KEY_SHARE:
+            x25519 = _has_x25519_share(message, data, offset)
+        elif extension_type == _PRE_SHARED_KEY:
+            pre_shared_key = True
+        if tls_1_3 and x25519:
+            # 残りの拡張の長さはClientHello.from_bytes()で確かめる
+            break
+    if not tls_1_3:
+        raise TlsAlert(
+            AlertDescription.protocol_version,
+            "supported_versionsにTLS 1.3がありません。",
+        )
+    # TLS 1.2までのクライアントにはprotocol_versionを返したいので、後で確かめる
+    if not cipher_suite:
+        raise TlsAlert(
+            AlertDescription.handshake_failure,
+            "TLS_AES_256_GCM_SHA384を提案していないClientHelloです。",
+        )
+    if not (x25519 or pre_shared_key):
+        raise TlsAlert(
+            AlertDescription.handshake_failure, "x25519のkey_shareがありません。"
+        )
+
+
+def _find_uint16(message: bytes, value: bytes, start: int, end: int) -> bool:
+    """message[start:end]の2バイトずつの並びにvalueがあるか。"""
+    offset = message.find(value, start, end)
+    # 2バイトの境界からずれた位置で見つかったら、その先を探し直す
+    while offset >= 0 and (offset - start) % 2:
+        offset = message.find(value, offset + 1, end)
+    return offset >= 0
+
+
+def _has_x25519_share(message: bytes, start: int, end: int) -> bool:
+    # KeyShareEntry client_shares<0..2^16-1>。各エントリーはgroup(2) + key_exchange(2 + n)
+    offset = start + 2
+    while offset + 4 <= end:
+        group, length = _EXTENSION_HEADER.unpack_from(message, offset)
+        if group == _GROUP_X25519:
+            return length == 32 and offset + 4 + length <= end
+        offset += 4 + length
+    return False
+
+
+class RateLimiter:
+    """送信元ごとのトークンバケット。
+
+    バケットにはrate個/秒でトークンが補充され、burst個までたまる。
+    allow()は1個使えればTrueを返す。バケットは(トークン, 更新した時刻)の
+    タプルだけなので、送信元が多くても小さい。覚えておくのはmax_sources個までで、
+    溢れたら一番長く使われていない送信元から忘れる(次は満タンから始まる)。
+    ThreadedServerでは全スレッドが1つのRateLimiterを使うので、取り出してから
+    入れ直すまでをロックの中で行う。
+    """
+
+    def __init__(self, rate: float, burst: float, max_sources: int = 65536):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        # dictの順番をLRUに使う。使うたびに取り出して最後に入れ直す
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, source: str, now: float | None = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        buckets = self._buckets
+        with self._lock:
+            bucket = buckets.pop(source, None)
+            if bucket is None:
+                tokens = self.burst
+                if len(buckets) >= self.max_sources:
+                    del buckets[next(iter(buckets))]
+            else:
+                tokens, updated = bucket
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            buckets[source] = (tokens, now)
+        return allowed
+
+
+class AdmissionFilter:
+    """接続とClientHelloを、TlsHandshakeProcessorに渡す前にふるい分ける。
+
+    rateがNoneの制限はかけない。断ったときはMetricsのカウンターを増やすので、
+    呼び出し側はalertを送って接続を切るだけでよい。
+    """
+
+    def __init__(
+        self,
+        connection_rate: float | None = None,
+        connection_burst: float = 1.0,
+        handshake_rate: float | None = None,
+        handshake_burst: float = 1.0,
+        max_sources: int = 65536,
+        max_client_hello_length: int = MAX_CLIENT_HELLO_LENGTH,
+    ):
+        self.connections = (
+            RateLimiter(connection_rate, connection_burst, max_sources)
+            if connection_rate is not None
+            else None
+        )
+        self.handshakes = (
+            RateLimiter(handshake_rate, handshake_burst, max_sources)
+            if handshake_rate is not None
+            else None
+        )
+        self.max_client_hello_length = max_client_hello_length
+
+    def admit_connection(self, source: str) -> bool:
+        """送信元の接続数の制限内ならTrue。"""
+        if self.connections is None or self.connections.allow(source):
+            return True
+        Metrics.count("rate_limited_connections")
+        return False
+
+    def admit_client_hello(self, source: str, message: bytes | memoryview) -> None:
+        """ハンドシェイクメッセージを処理してよいか。だめならTlsAlertにする。"""
+        if self.handshakes is not None and not self.handshakes.allow(source):
+            Metrics.count("rate_limited_handshakes")
+            raise TlsAlert(SHED_ALERT, f"{source}からのハンドシェイクが多すぎます。")
+        try:
+            check_client_hello(message, self.max_client_hello_length)
+        except TlsAlert:
+            Metrics.count("rejected_client_hellos")
+            raise
@@ -0,0 +1,491 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Coroutine
+
+from tiny_tls_py.admission import SHED_ALERT, AdmissionFilter
+from tiny_tls_py.config import ServerConfig, configure_logging
+from tiny_tls_py.connection import ConnectionState, TlsConnection
+from tiny_tls_py.metrics import Metrics
+from tiny_tls_py.models.alert import TlsAlert
+from tiny_tls_py.models.enums import AlertDescription
+from tiny_tls_py.models.key_service import KeyService
+from tiny_tls_py.models.send_queue import SendQueue
+from tiny_tls_py.models.tls_handshake_processor import (
+    HandshakeKeys,
+    TlsHandshakeProcessor,
+)
+from tiny_tls_py.server import (
+    build_admission_filter,
+    configure_capture,
+    load_credentials,
+)
+from tiny_tls_py.stream import TlsReader, TlsWriter
+
+logger = logging.getLogger(__name__)
+
+# ハンドシェイクが終わった接続ごとに動かす関数(stream.py)
+Handler = Callable[[TlsReader, TlsWriter], Awaitable[None]]
+
+
+class TlsServerProtocol(asyncio.BufferedProtocol):
+    """1接続ぶんのプロトコル。受信データはTlsConnectionのframerに直接読み込む。
+
+    asyncioはソケットが読めるようになってからget_buffer()を呼ぶので、
+    受信バッファはデータが届いている間だけプールから借りればよい。
+    StreamReaderのようにrecvごとにbytesを作ることもない。
+
+    ClientHelloを受け取ってからCONNECTEDになるまでは、サーバーのハンドシェイクの
+    枠を1つ使う。空きがなければ受信を止めて待ち、待っている接続も多すぎれば断る。
+    鍵交換をcrypto_executorのプールで、署名をsigning_executorで計算するときは、
+    その間この接続の受信を止めて、イベントループは他の接続を処理する。
+
+    サーバーにhandlerがあれば、CONNECTEDになったところでhandler(reader, writer)の
+    タスクを作る。readerは最初から作っておき、クライアントのFinishedと同じ
+    セグメントで届いたapplication_dataも取りこぼさないようにする。
+    """
+
+    def __init__(self, server: "AsyncTlsServer"):
+        self.server = server
+        self.loop = asyncio.get_running_loop()
+        # connection_made()で入る
+        self.transport: asyncio.Transport
+        self.connection = TlsConnection(admission=server.admission)
+        # crypto_executorがプールなら、鍵交換もその結果を待つ間に他の接続を処理する
+        self.connection.defer_key_exchange = KeyService.crypto_executor.offloads
+        # 鍵交換かCertificateVerifyの署名をプールで計算している間のタスク
+        self._crypto: asyncio.Task | None = None
+        # サーバーのハンドシェイクの枠を使っているか、空きを待っているか
+        self._has_slot = False
+        self._queued = False
+        # 最後に受信したか、application_dataを送った時刻
+        self._last_activity = 0.0
+        # get_buffer()を呼ばれた時刻。buffer_updated()までを"recv"として記録する
+        self._recv_start = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        self.reader: TlsReader | None = None
+        self.writer: TlsWriter | None = None
+        self._handler: asyncio.Task | None = None
+        if server.handler is not None:
+            self.reader = TlsReader(self)
+            self.writer = TlsWriter(self)
+            self.connection.on_application_data = self.reader.feed_data
+        # transportの書き込み待ちが多い間、drain()で待っているFuture
+        self._writing_paused = False
+        self._drain_waiters: deque[asyncio.Future] = deque()
+        # connection_lost()で終わるFuture(TlsWriter.wait_closed())
+        self.closed: asyncio.Future = self.loop.create_future()
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+        self.transport = transport
+        Metrics.count("connections")
+        peername = transport.get_extra_info("peername")
+        self.connection.source = peername[0] if peername else ""
+        if not self.server.admission.admit_connection(self.connection.source):
+            self.connection.send_alert(SHED_ALERT)
+            self._flush()
+            transport.close()
+            return
+        if self.server.overloaded():
+            # ClientHelloを待たずに、読み込む前に断る
+            Metrics.count("shed_handshakes")
+            self.connection.send_alert(SHED_ALERT)
+            self._flush()
+            transport.close()
+            return
+        self._last_activity = self.loop.time()
+        self._timer = self.loop.call_later(
+            self.server.connection_timeout, self._check_timeout
+        )
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        # トランスポートはこの後すぐにrecv_into()してbuffer_updated()を呼ぶ
+        self._recv_start = time.perf_counter()
+        return self.connection.framer.writable()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        Metrics.observe("recv", time.perf_counter() - self._recv_start)
+        self.connection.framer.advance(nbytes)
+        Metrics.count("bytes_received", nbytes)
+        self._last_activity = self.loop.time()
+        if self._crypto is None:
+            self._receive()
+
+    def eof_received(self) -> bool:
+        # 半分だけ閉じた状態は使わないので、こちらも閉じる
+        return False
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if exc is not None:
+            logger.info("接続エラー: %s", exc)
+            Metrics.count("connection_errors")
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._crypto is not None:
+            self._crypto.cancel()
+        if self._queued:
+            self._queued = False
+            self.server._waiting.remove(self)
+        self._release_slot()
+        self.connection.close()
+        if self.reader is not None:
+            self.reader.feed_eof()
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError("接続が切れました。"))
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def send_application_data(self, data: bytes | bytearray | memoryview) -> None:
+        """dataを暗号化してtransportに渡す(TlsWriter.write())。"""
+        if self.connection.closed or self.transport.is_closing():
+            raise ConnectionResetError("接続は閉じています。")
+        self.connection.send_application_data(data)
+        self._last_activity = self.loop.time()
+        self._flush()
+
+    async def drain(self) -> None:
+        if self.closed.done():
+            raise ConnectionResetError("接続が切れました。")
+        if not self._writing_paused:
+            return
+        waiter = self.loop.create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def close(self) -> None:
+        """close_notifyを送って閉じる(TlsWriter.close())。"""
+        if self.transport.is_closing():
+            return
+        self.connection.send_alert(AlertDescription.close_notify)
+        self._flush()
+        self.transport.close()
+
+    def _receive(self, keys: HandshakeKeys | None = None) -> None:
+        """framerに届いたレコードを処理する。keysは_exchange_keys()で計算した鍵交換の結果。"""
+        connection = self.connection
+        previous_state = connection.state
+        if self._queued:
+            return
+        try:
+            if keys is not None:
+                connection.finish_key_exchange(keys)
+            elif (
+                connection.state == ConnectionState.START
+                and not self._has_slot
+                and not self._acquire_slot()
+            ):
+                # 空きが出たら_release_slot()が受信を再開する
+                return
+            connection.receive_records()
+            # スレッドプールがなければ、その場で署名して続きのレコードも処理する
+            while (
+                connection.state == ConnectionState.NEGOTIATED
+                and TlsHandshakeProcessor.signing_executor is None
+            ):
+                connection.finish_flight(
+                    TlsHandshakeProcessor.sign_flight(connection.negotiated_flight)
+                )
+                connection.receive_records()
+            if connection.state == ConnectionState.KEY_EXCHANGE:
+                self._start_crypto(self._exchange_keys())
+            elif connection.state == ConnectionState.NEGOTIATED:
+                self._start_crypto(self._sign())
+        except TlsAlert as e:
+            logger.info("ハンドシェイクを中断します: %s", e)
+            Metrics.count("connection_errors")
+            connection.send_alert(e.description)
+        except ValueError as e:
+            logger.info("接続エラー: %s", e)
+            Metrics.count("connection_errors")
+            connection.send_alert(AlertDescription.decode_error)
+        if previous_state in (
+            ConnectionState.START,
+            ConnectionState.KEY_EXCHANGE,
+        ) and connection.state in (
+            ConnectionState.WAIT_FINISHED,
+            ConnectionState.CONNECTED,
+        ):
+            self.server.handshake_count += 1
+        if (
+            self.reader is not None
+            and self._handler is None
+            and previous_state != ConnectionState.CONNECTED
+            and connection.state == ConnectionState.CONNECTED
+        ):
+            self._handler = self.loop.create_task(self._run_handler())
+        if connection.state in (ConnectionState.CONNECTED, ConnectionState.CLOSED):
+            self._release_slot()
+        self._flush()
+        if connection.closed:
+            if self.reader is not None:
+                # close_notifyを受信したら、handlerのread()にEOFを返す
+                self.reader.feed_eof()
+            self.transport.close()
+
+    def _acquire_slot(self) -> bool:
+        """ハンドシェイクの枠を取る。空きがなければ受信を止めて並び、Falseを返す。"""
+        server = self.server
+        if server._active_handshakes < server.max_concurrent_handshakes:
+            server._active_handshakes += 1
+            self._has_slot = True
+            return True
+        if len(server._waiting) >= server.max_pending_handshakes:
+            Metrics.count("shed_handshakes")
+            raise TlsAlert(SHED_ALERT, "過負荷のためハンドシェイクを断ります。")
+        # 届いたClientHelloはframerに残しておく
+        self.transport.pause_reading()
+        self._queued = True
+        server._waiting.append(self)
+        return False
+
+    def _release_slot(self) -> None:
+        """ハンドシェイクの枠を返して、空きを待っている接続があれば渡す。"""
+        if not self._has_slot:
+            return
+        self._has_slot = False
+        server = self.server
+        server._active_handshakes -= 1
+        if not server._waiting:
+            return
+        # 待っている間に切れた接続は、connection_lost()で取り除いてある
+        waiting = server._waiting.popleft()
+        waiting._queued = False
+        waiting._has_slot = True
+        server._active_handshakes += 1
+        waiting.transport.resume_reading()
+        # 並んでいる間にframerに届いていたClientHello
+        self.loop.call_soon(waiting._resume_handshake)
+
+    def _resume_handshake(self) -> None:
+        if not self.transport.is_closing():
+            self._receive()
+
+    def _start_crypto(self, step: Coroutine[None, None, None]) -> None:
+        # 鍵交換や署名が終わるまで、届いたレコードはソケットに残しておく
+        self.transport.pause_reading()
+        self._crypto = self.loop.create_task(step)
+
+    async def _exchange_keys(self) -> None:
+        connection = self.connection
+        try:
+            keys = await TlsHandshakeProcessor.exchange_keys_async(
+                connection.pending_handshake
+            )
+        except ValueError as e:
+            # 使えない公開鍵はクライアントの誤りなので、その場で計算したときと同じalert
+            logger.info("ハンドシェイクを中断します: %s", e)
+            Metrics.count("connection_errors")
+            connection.send_alert(
+                e.description
+                if isinstance(e, TlsAlert)
+                else AlertDescription.decode_error
+            )
+            self._flush()
+            self.transport.close()
+            return
+        except Exception:
+            logger.exception("鍵交換に失敗しました。")
+            connection.send_alert(AlertDescription.internal_error)
+            self._flush()
+            self.transport.close()
+            return
+        finally:
+            self._crypto = None
+        self.transport.resume_reading()
+        # 鍵交換している間にframerに届いていたレコードも続けて処理する
+        self._receive(keys)
+
+    async def _sign(self) -> None:
+        connection = self.connection
+        try:
+            signature = await TlsHandshakeProcessor.sign_flight_async(
+                connection.negotiated_flight
+            )
+        except Exception:
+            logger.exception("署名に失敗しました。")
+            connection.send_alert(AlertDescription.internal_error)
+            self._flush()
+            self.transport.close()
+            return
+        finally:
+            self._crypto = None
+        connection.finish_flight(signature)
+        self.server.handshake_count += 1
+        self._flush()
+        self.transport.resume_reading()
+        # 署名している間にframerに届いていたレコード
+        self._receive()
+
+    async def _run_handler(self) -> None:
+        handler = self.server.handler
+        # handlerがあるときだけ、readerとwriterを作ってこのタスクを動かす
+        assert handler is not None
+        assert self.reader is not None and self.writer is not None
+        try:
+            await handler(self.reader, self.writer)
+        except ConnectionError as e:
+            logger.info("handlerの途中で接続が切れました: %s", e)
+        except Exception:
+            logger.exception("handlerで例外が起きました。")
+            if not self.transport.is_closing():
+                self.connection.send_alert(AlertDescription.internal_error)
+                self._flush()
+                self.transport.close()
+        # handlerが閉じずに戻ったら、close_notifyを送って閉じる
+        self.close()
+
+    def _flush(self) -> None:
+        outgoing = self.connection.outgoing
+        # kTLSは同期サーバーでだけ使うので、ここではいつもSendQueue
+        assert isinstance(outgoing, SendQueue)
+        size = len(outgoing)
+        if not size or self.transport.is_closing():
+            outgoing.clear()
+            return
+        start = time.perf_counter()
+        # ソケットのtransportは、書き込み待ちがなければwritelines()を1回の
+        # sendmsg()にする。TCP_NODELAYはasyncioが接続ごとに付けている
+        # (transportからは補助データを付けて書けないので、kTLSは同期サーバーでだけ使う)
+        self.transport.writelines(outgoing.drain())
+        Metrics.observe("send", time.perf_counter() - start)
+        Metrics.count("bytes_sent", size)
+
+    def _check_timeout(self) -> None:
+        # 受信するたびにタイマーを作り直さないように、期限が来たら最後に
+        # 受信か送信をした時刻から数え直して、まだなら残りの時間でもう一度待つ
+        timeout = (
+            self.server.idle_timeout
+            if self.connection.state == ConnectionState.CONNECTED
+            else self.server.connection_timeout
+        )
+        remaining = self._last_activity + timeout - self.loop.time()
+        if remaining > 0:
+            self._timer = self.loop.call_later(remaining, self._check_timeout)
+            return
+        logger.info("タイムアウトしたので接続を切ります。")
+        Metrics.count("timeouts")
+        self._timer = None
+        if self.connection.state == ConnectionState.CONNECTED:
+            self.connection.send_alert(AlertDescription.close_notify)
+            self._flush()
+            self.transport.close()
+        else:
+            self.transport.abort()
+
+
+class AsyncTlsServer:
+    """asyncioのイベントループの上でTlsConnectionを動かすサーバー。
+
+    接続ごとのTlsServerProtocolがコールバックで受信を処理するので、
+    遅いクライアントやアイドルなクライアントが他の接続のハンドシェイクを
+    止めることはない。アイドルな接続が持つのはTlsConnectionとtransportだけで、
+    受信バッファは持たない。
+
+    ClientHelloからCONNECTEDまでのハンドシェイクは、署名をその場でするときも
+    スレッドプールに任せるときも、同時にmax_concurrent_handshakesまでにする。
+    空きを待つ接続がmax_pending_handshakesを超えたら、待たせずにalertを送って切る。
+    待ち行列が伸び続けると、どの接続もタイムアウトするまで待たされてしまうため。
+
+    handlerを渡すと、ハンドシェイクが終わった接続ごとにhandler(reader, writer)を
+    動かす(stream.py)。渡さなければハンドシェイクだけをして、受信した
+    application_dataは読み捨てる。
+    """
+
+    def __init__(
+        self,
+        ip: str = ServerConfig.IP,
+        port: int = ServerConfig.PORT,
+        max_concurrent_handshakes: int = ServerConfig.MAX_CONCURRENT_HANDSHAKES,
+        max_pending_handshakes: int = ServerConfig.MAX_PENDING_HANDSHAKES,
+        connection_timeout: float = ServerConfig.CONNECTION_TIMEOUT,
+        backlog: int = ServerConfig.ASYNC_BACKLOG,
+        reuse_port: bool = False,
+        admission: AdmissionFilter | None = None,
+        idle_timeout: float = ServerConfig.IDLE_TIMEOUT,
+        handler: Handler | None = None,
+    ):
+        self.ip = ip
+        self.port = port
+        self.connection_timeout = connection_timeout
+        self.idle_timeout = idle_timeout
+        self.backlog = backlog
+        # Trueにすると複数のプロセスが同じポートをSO_REUSEPORTでbindできる(prefork.py)
+        self.reuse_port = reuse_port
+        # ServerHelloまで返したハンドシェイクの数
+        self.handshake_count = 0
+        self.max_concurrent_handshakes = max_concurrent_handshakes
+        self.max_pending_handshakes = max_pending_handshakes
+        self.admission = admission or build_admission_filter()
+        self.handler = handler
+        # ClientHelloを受け取ってから、CONNECTEDになるか切れるまでの接続の数
+        self._active_handshakes = 0
+        # ハンドシェイクの枠の空きを待っている接続(受信を止めてある)
+        self._waiting: deque[TlsServerProtocol] = deque()
+
+    def overloaded(self) -> bool:
+        """ハンドシェイクの枠も、空きを待つ列もいっぱいか。"""
+        return (
+            self._active_handshakes >= self.max_concurrent_handshakes
+            and len(self._waiting) >= self.max_pending_handshakes
+        )
+
+    async def start(self) -> asyncio.Server:
+        return await asyncio.get_running_loop().create_server(
+            lambda: TlsServerProtocol(self),
+            self.ip,
+            self.port,
+            backlog=self.backlog,
+            reuse_port=self.reuse_port,
+        )
+
+    async def serve_forever(self) -> None:
+        server = await self.start()
+        async with server:
+            logger.info("サーバーがポート%dで起動しました。(asyncio)", self.port)
+            await server.serve_forever()
+
+
+def main() -> None:
+    configure_logging()
+    KeyService.start_key_pool(
+        ServerConfig.KEY_POOL_SIZE, ServerConfig.KEY_POOL_LOW_WATER
+    )
+    TlsHandshakeProcessor.enable_session_tickets(
+        ServerConfig.TICKET_LIFETIME,
+        ServerConfig.TICKET_KEY_ROTATION,
+        ServerConfig.TICKET_CACHE_SIZE,
+    )
+    TlsHandshakeProcessor.set_credentials(
+        load_credentials(), ServerConfig.SIGNING_THREADS
+    )
+    KeyService.configure_crypto_executor(
+        ServerConfig.CRYPTO_EXECUTOR, ServerConfig.CRYPTO_WORKERS
+    )
+    TlsConnection.configure_buffer_pool(
+        ServerConfig.RECV_BUFFER_SIZE, ServerConfig.RECV_BUFFER_POOL_SIZE
+    )
+    configure_capture()
+    Metrics.start_exporters(
+        ServerConfig.METRICS_PORT,
+        ServerConfig.METRICS_DUMP_PATH,
+        ServerConfig.METRICS_DUMP_INTERVAL,
+    )
+    asyncio.run(AsyncTlsServer().serve_forever())
+
+
+if __name__ == "__main__":
+    main()
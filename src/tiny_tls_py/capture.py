@@ -0,0 +1,548 @@
+"""送受信したTLSのレコードを、固定長のリングファイルに書き込むキャプチャ。
+
+本番で問題を調べるときに、復号前のバイト列をそのまま残すためのもの。
+ファイルはmmapして、1件ごとに(位置, 時刻, 接続ID, 種類, 長さ)の32バイトの
+ヘッダーとデータをコピーするだけなので、hex()やrichで整形して出すより
+はるかに軽い。ファイルの大きさは固定で、一杯になったら古いものから上書きする。
+
+WireCapture.configure()でリングを開いても、enabledにするまでは書かない。
+SIGUSR1(install_signal_handler())で実行中に切り替えられる。書くかどうかは
+接続ごとにsample_rateの確率で決め、決めた接続は送受信をすべて書く。
+
+リングは別のプロセスからも読める。pcapngに書き出すか、TlsRecordに戻して表示する。
+
+    python -m tiny_tls_py.capture replay capture.ring
+    python -m tiny_tls_py.capture export capture.ring capture.pcapng
+
+リングの中身:
+
+    ヘッダー(64バイト)  magic, version, capacity, head(これまでに書いた位置)
+    データ(capacity)    記録を8バイト境界にそろえて並べる。記録は端で折り返さず、
+                        入らなければ残りを詰め物にして先頭から書く
+
+記録のヘッダーには、その記録を書いた位置(何周目かを含む)を入れておく。
+読む側はhead - capacityから先で、位置が一致するヘッダーを探して読み始める
+(pcap.pyのresyncと同じ考え方)。書いている最中のリングを読むと、
+上書きされた古い記録は位置が合わなくなるので、そこで読むのをやめる。
+"""
+
+import argparse
+import ipaddress
+import itertools
+import logging
+import mmap
+import os
+import random
+import signal
+import struct
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from enum import IntEnum
+from pathlib import Path
+from typing import Final, Self
+
+from tiny_tls_py.models.enums import ContentType, HandshakeType
+from tiny_tls_py.models.tls_record_framer import RECORD_HEADER_LENGTH
+from tiny_tls_py.pcap import (
+    LINKTYPE_RAW,
+    PCAPNG_BYTE_ORDER_MAGIC,
+    PCAPNG_ENHANCED_PACKET,
+    PCAPNG_INTERFACE_DESCRIPTION,
+    PCAPNG_SECTION_HEADER,
+)
+from tiny_tls_py.wire.handshake import Handshake
+from tiny_tls_py.wire.tls_record import TlsRecord
+
+logger = logging.getLogger(__name__)
+
+RING_MAGIC: Final[bytes] = b"TTLSRING"
+RING_VERSION: Final[int] = 1
+RING_HEADER_LENGTH: Final[int] = 64
+# magic, version, 予約, capacity, head
+_RING_HEADER = struct.Struct("<8sIIQQ")
+_HEAD_OFFSET: Final[int] = 24
+# 位置, 時刻(ns), 接続ID, 種類, データの長さ
+_ENTRY_HEADER = struct.Struct("<QQQII")
+ENTRY_HEADER_LENGTH: Final[int] = _ENTRY_HEADER.size
+# リングの大きさの既定値
+DEFAULT_RING_SIZE: Final[int] = 64 * 2**20
+
+# pcapngに書き出すときの、サーバー側のアドレスとポート。Wiresharkが
+# TLSとして表示するように443にする
+EXPORT_SERVER_PORT: Final[int] = 443
+_EXPORT_SERVER_IPV4 = ipaddress.IPv4Address("192.0.2.1")
+_EXPORT_SERVER_IPV6 = ipaddress.IPv6Address("2001:db8::1")
+# 送信元がわからない接続のアドレス
+_EXPORT_UNKNOWN_CLIENT = ipaddress.IPv4Address("198.51.100.1")
+# 1つのパケットに入れるデータの上限(IPv4の全長は16ビット)
+_EXPORT_SEGMENT_LENGTH: Final[int] = 2**15
+_TCP_PSH_ACK: Final[int] = 0x18
+
+
+class CaptureKind(IntEnum):
+    # クライアントから受信したレコード(1件に1レコード)
+    inbound = 0
+    # クライアントに送るバイト列(1件に1つ以上のレコード)
+    outbound = 1
+    # 接続の最初の記録。データは送信元のIPアドレス
+    open = 2
+    # 接続を閉じた。データは空
+    close = 3
+    # リングの端の詰め物。読む側は次の周回の先頭に進む
+    padding = 4
+
+
+@dataclass(frozen=True, slots=True)
+class CapturedEntry:
+    timestamp_ns: int
+    connection_id: int
+    kind: CaptureKind
+    data: bytes
+
+
+class CaptureRing:
+    """リングファイルに記録を書き込む側。append()はスレッドセーフ。"""
+
+    def __init__(self, path: str | Path, size: int = DEFAULT_RING_SIZE):
+        # 記録は8バイト境界にそろえるので、大きさも8の倍数にする
+        self.capacity = size - size % 8
+        if self.capacity < 2**16:
+            raise ValueError("リングの大きさは64KiB以上である必要があります。")
+        self.path = Path(path)
+        with open(self.path, "w+b") as file:
+            file.truncate(RING_HEADER_LENGTH + self.capacity)
+            self._buffer = mmap.mmap(file.fileno(), RING_HEADER_LENGTH + self.capacity)
+        _RING_HEADER.pack_into(
+            self._buffer, 0, RING_MAGIC, RING_VERSION, 0, self.capacity, 0
+        )
+        self._head = 0
+        self._lock = threading.Lock()
+        # 大きすぎて書けなかった記録の数
+        self.dropped = 0
+
+    def append(
+        self,
+        connection_id: int,
+        kind: CaptureKind,
+        data: bytes | bytearray | memoryview = b"",
+        timestamp_ns: int | None = None,
+    ) -> None:
+        length = len(data)
+        size = ENTRY_HEADER_LENGTH + length
+        size += -size % 8
+        capacity = self.capacity
+        if size > capacity:
+            self.dropped += 1
+            return
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        buffer = self._buffer
+        with self._lock:
+            head = self._head
+            offset = head % capacity
+            if offset + size > capacity:
+                # 端で折り返さないように、残りを詰め物にして次の周回の先頭から書く
+                if capacity - offset >= ENTRY_HEADER_LENGTH:
+                    _ENTRY_HEADER.pack_into(
+                        buffer,
+                        RING_HEADER_LENGTH + offset,
+                        head,
+                        timestamp_ns,
+                        0,
+                        CaptureKind.padding,
+                        0,
+                    )
+                head += capacity - offset
+                offset = 0
+            start = RING_HEADER_LENGTH + offset
+            _ENTRY_HEADER.pack_into(
+                buffer, start, head, timestamp_ns, connection_id, kind, length
+            )
+            start += ENTRY_HEADER_LENGTH
+            buffer[start : start + length] = data
+            # データを書き終わってからheadを進める
+            self._head = head + size
+            struct.pack_into("<Q", buffer, _HEAD_OFFSET, self._head)
+
+    def close(self) -> None:
+        with self._lock:
+            self._buffer.flush()
+            self._buffer.close()
+
+
+class CaptureRingReader:
+    """リングファイルを読む側。書いている最中のファイルも読める。"""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < RING_HEADER_LENGTH:
+            raise ValueError(f"キャプチャのリングではありません: {self.path}")
+        magic, version, _, self.capacity, _ = _RING_HEADER.unpack_from(self.buffer)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            raise ValueError(f"キャプチャのリングではありません: {self.path}")
+        if len(self.buffer) < RING_HEADER_LENGTH + self.capacity:
+            raise ValueError(f"リングのファイルが途中で切れています: {self.path}")
+
+    def close(self) -> None:
+        self.buffer.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def head(self) -> int:
+        return struct.unpack_from("<Q", self.buffer, _HEAD_OFFSET)[0]
+
+    def entries(self) -> Iterator[CapturedEntry]:
+        """残っている記録を古いものから順に返す。"""
+        head = self.head
+        capacity = self.capacity
+        position = head - capacity
+        if position <= 0:
+            position = 0
+        else:
+            position = self._resync(position, head)
+        buffer = self.buffer
+        while position < head:
+            offset = position % capacity
+            if offset + ENTRY_HEADER_LENGTH > capacity:
+                position += capacity - offset
+                continue
+            start = RING_HEADER_LENGTH + offset
+            entry_position, timestamp_ns, connection_id, kind, length = (
+                _ENTRY_HEADER.unpack_from(buffer, start)
+            )
+            if entry_position != position:
+                # 読んでいる間に上書きされた
+                return
+            if kind == CaptureKind.padding:
+                position += capacity - offset
+                continue
+            start += ENTRY_HEADER_LENGTH
+            data = buffer[start : start + length]
+            # 新しい記録がこの記録のデータの途中から書かれると、ヘッダーは
+            # 残ったままデータだけが上書きされるので、headも確かめる
+            if (
+                self._entry_position(offset) != position
+                or self.head - capacity > position
+            ):
+                # データをコピーしている間に上書きされた
+                return
+            yield CapturedEntry(timestamp_ns, connection_id, CaptureKind(kind), data)
+            size = ENTRY_HEADER_LENGTH + length
+            position += size + -size % 8
+
+    def _entry_position(self, offset: int) -> int:
+        return struct.unpack_from("<Q", self.buffer, RING_HEADER_LENGTH + offset)[0]
+
+    def _resync(self, position: int, head: int) -> int:
+        """position以降で、最初に記録のヘッダーとして妥当な位置を返す。"""
+        position += -position % 8
+        # 周回の先頭は必ず記録の境界
+        lap_end = position + (-position % self.capacity)
+        for candidate in range(position, min(lap_end, head), 8):
+            offset = candidate % self.capacity
+            if offset + ENTRY_HEADER_LENGTH > self.capacity:
+                break
+            if self._entry_position(offset) == candidate:
+                return candidate
+        return lap_end
+
+
+class WireCapture:
+    """サーバー全体で1つのキャプチャ。TlsConnectionはsample()とrecord()だけを呼ぶ。"""
+
+    ring: CaptureRing | None = None
+    # Falseの間は何も書かない。SIGUSR1やset_enabled()で切り替える
+    enabled: bool = False
+    # キャプチャする接続の割合(0から1)
+    sample_rate: float = 1.0
+    # 接続ID。preforkのワーカーで重ならないように、上位ビットにpidを入れる
+    _connection_ids: Iterator[int] = itertools.count(1)
+
+    @classmethod
+    def configure(
+        cls,
+        path: str | Path | None,
+        size: int = DEFAULT_RING_SIZE,
+        sample_rate: float = 1.0,
+        enabled: bool = False,
+    ) -> CaptureRing | None:
+        """pathのリングを作り直す。pathがNoneならキャプチャしない。"""
+        if cls.ring is not None:
+            cls.ring.close()
+            cls.ring = None
+        cls.enabled = False
+        cls.sample_rate = sample_rate
+        cls._connection_ids = itertools.count((os.getpid() << 32) + 1)
+        if path is None:
+            return None
+        cls.ring = CaptureRing(path, size)
+        cls.set_enabled(enabled)
+        return cls.ring
+
+    @classmethod
+    def set_enabled(cls, enabled: bool) -> None:
+        if enabled and cls.ring is None:
+            logger.warning("キャプチャのリングが設定されていません。")
+            return
+        cls.enabled = enabled
+        logger.info(
+            "キャプチャを%sにしました。(%s)",
+            "有効" if enabled else "無効",
+            cls.ring.path if cls.ring else "-",
+        )
+
+    @classmethod
+    def toggle(cls, signum=None, frame=None) -> None:
+        """シグナルハンドラーとしても使える、有効/無効の切り替え。"""
+        cls.set_enabled(not cls.enabled)
+
+    @classmethod
+    def install_signal_handler(cls, signum: int = signal.SIGUSR1) -> None:
+        signal.signal(signum, cls.toggle)
+
+    @classmethod
+    def sample(cls) -> int:
+        """新しい接続をキャプチャするなら接続IDを、しないなら0を返す。"""
+        if not cls.enabled or (
+            cls.sample_rate < 1.0 and random.random() >= cls.sample_rate
+        ):
+            return 0
+        return next(cls._connection_ids)
+
+    @classmethod
+    def record(
+        cls,
+        connection_id: int,
+        kind: CaptureKind,
+        data: bytes | bytearray | memoryview = b"",
+    ) -> None:
+        ring = cls.ring
+        if cls.enabled and ring is not None:
+            ring.append(connection_id, kind, data)
+
+
+def iter_records(data: bytes) -> Iterator[bytes]:
+    """記録のデータに入っているTLSRecordを順に返す。最後の半端な分は返さない。"""
+    offset = 0
+    while offset + RECORD_HEADER_LENGTH <= len(data):
+        end = (
+            offset
+            + RECORD_HEADER_LENGTH
+            + int.from_bytes(data[offset + 3 : offset + 5], "big")
+        )
+        if end > len(data):
+            return
+        yield data[offset:end]
+        offset = end
+
+
+def replay(
+    entries: Iterator[CapturedEntry],
+) -> Iterator[tuple[CapturedEntry, TlsRecord | Exception]]:
+    """送受信した記録をTlsRecord.from_bytes()に通す。パースできなければその例外を返す。
+
+    キャプチャには壊れたClientHelloもそのまま入っているので、
+    fingerprint.pyと同じくIndexErrorとstruct.errorもパースの失敗として扱う。
+    """
+    for entry in entries:
+        if entry.kind not in (CaptureKind.inbound, CaptureKind.outbound):
+            continue
+        for record in iter_records(entry.data):
+            try:
+                yield entry, TlsRecord.from_bytes(record)
+            except (ValueError, IndexError, struct.error) as e:
+                yield entry, e
+
+
+def export_pcapng(entries: Iterator[CapturedEntry], path: str | Path) -> int:
+    """記録をIP/TCPのパケットに包んで、pcapngに書き出す。書いたパケットの数を返す。
+
+    TCPのハンドシェイクやACKは作らず、データを運ぶパケットだけを書く。
+    シーケンス番号は接続と向きごとにつなげるので、Wiresharkで
+    ストリームとして組み立て直せる。チェックサムは0のまま。
+    """
+    # 接続ID -> (クライアントのアドレス, ポート, [受信のシーケンス番号, 送信の])
+    flows: dict[
+        int, tuple[ipaddress.IPv4Address | ipaddress.IPv6Address, int, list]
+    ] = {}
+    packets = 0
+    with open(path, "wb") as file:
+        file.write(_pcapng_block(PCAPNG_SECTION_HEADER, _section_header_body()))
+        file.write(
+            _pcapng_block(
+                PCAPNG_INTERFACE_DESCRIPTION,
+                # リンクタイプ、予約、snaplen、if_tsresol(ナノ秒)
+                struct.pack("<HHI", LINKTYPE_RAW, 0, 0)
+                + struct.pack("<HHB3x", 9, 1, 9)
+                + bytes(4),
+            )
+        )
+        for entry in entries:
+            flow = flows.get(entry.connection_id)
+            if flow is None:
+                address: ipaddress.IPv4Address | ipaddress.IPv6Address = (
+                    _EXPORT_UNKNOWN_CLIENT
+                )
+                if entry.kind == CaptureKind.open:
+                    try:
+                        address = ipaddress.ip_address(entry.data.decode())
+                    except ValueError:
+                        pass
+                flow = (address, 49152 + entry.connection_id % 16384, [1, 1])
+                flows[entry.connection_id] = flow
+            if entry.kind not in (CaptureKind.inbound, CaptureKind.outbound):
+                continue
+            address, port, sequences = flow
+            inbound = entry.kind == CaptureKind.inbound
+            for start in range(0, len(entry.data), _EXPORT_SEGMENT_LENGTH):
+                payload = entry.data[start : start + _EXPORT_SEGMENT_LENGTH]
+                packet = _ip_packet(
+                    address, port, inbound, sequences[0], sequences[1], payload
+                )
+                if inbound:
+                    sequences[0] += len(payload)
+                else:
+                    sequences[1] += len(payload)
+                file.write(
+                    _pcapng_block(
+                        PCAPNG_ENHANCED_PACKET,
+                        struct.pack(
+                            "<IIIII",
+                            0,
+                            entry.timestamp_ns >> 32,
+                            entry.timestamp_ns & 0xFFFFFFFF,
+                            len(packet),
+                            len(packet),
+                        )
+                        + packet
+                        + bytes(-len(packet) % 4),
+                    )
+                )
+                packets += 1
+    return packets
+
+
+def _pcapng_block(block_type: int, body: bytes) -> bytes:
+    length = 12 + len(body)
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+
+def _section_header_body() -> bytes:
+    # byte-order magic, バージョン1.0, セクションの長さは不明(-1)
+    return struct.pack("<IHHq", PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1)
+
+
+def _ip_packet(
+    client: ipaddress.IPv4Address | ipaddress.IPv6Address,
+    client_port: int,
+    inbound: bool,
+    client_sequence: int,
+    server_sequence: int,
+    payload: bytes,
+) -> bytes:
+    if inbound:
+        ports = struct.pack("!HH", client_port, EXPORT_SERVER_PORT)
+        sequence, acknowledgment = client_sequence, server_sequence
+    else:
+        ports = struct.pack("!HH", EXPORT_SERVER_PORT, client_port)
+        sequence, acknowledgment = server_sequence, client_sequence
+    tcp = ports + struct.pack(
+        "!IIBBHHH",
+        sequence & 0xFFFFFFFF,
+        acknowledgment & 0xFFFFFFFF,
+        5 << 4,
+        _TCP_PSH_ACK,
+        0xFFFF,
+        0,
+        0,
+    )
+    if client.version == 6:
+        source, destination = client.packed, _EXPORT_SERVER_IPV6.packed
+        if not inbound:
+            source, destination = destination, source
+        # バージョン、ペイロード長、次のヘッダー(TCP)、ホップリミット
+        ipv6_header = struct.pack("!IHBB", 6 << 28, len(tcp) + len(payload), 6, 64)
+        return ipv6_header + source + destination + tcp + payload
+    source, destination = client.packed, _EXPORT_SERVER_IPV4.packed
+    if not inbound:
+        source, destination = destination, source
+    header = bytearray(
+        struct.pack("!BBHHHBBH", 0x45, 0, 20 + len(tcp) + len(payload), 0, 0, 64, 6, 0)
+        + source
+        + destination
+    )
+    struct.pack_into("!H", header, 10, _ipv4_checksum(header))
+    return bytes(header) + tcp + payload
+
+
+def _ipv4_checksum(header: bytes | bytearray) -> int:
+    total = sum(struct.unpack(f"!{len(header) // 2}H", header))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def _describe(tls_record: TlsRecord) -> str:
+    if isinstance(tls_record.fragment, Handshake):
+        return HandshakeType(tls_record.fragment.msg_type).name
+    return ContentType(tls_record.content_type).name
+
+
+def main(argv: list[str] | None = None, prog: str | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog=prog, description="キャプチャのリングを表示するか、pcapngに書き出す。"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser(
+        "replay", help="レコードをTlsRecordにパースして1行ずつ表示する"
+    )
+    replay_parser.add_argument("ring")
+    replay_parser.add_argument(
+        "--connection", type=int, help="この接続IDだけを表示する"
+    )
+    export_parser = commands.add_parser("export", help="pcapngに書き出す")
+    export_parser.add_argument("ring")
+    export_parser.add_argument("output")
+    args = parser.parse_args(argv)
+
+    with CaptureRingReader(args.ring) as reader:
+        if args.command == "export":
+            packets = export_pcapng(reader.entries(), args.output)
+            print(f"{packets}パケットを{args.output}に書き出しました。")
+            return
+        entries = reader.entries()
+        if args.connection is not None:
+            entries = (
+                entry for entry in entries if entry.connection_id == args.connection
+            )
+        errors = 0
+        for entry, tls_record in replay(entries):
+            timestamp = time.strftime(
+                "%H:%M:%S", time.localtime(entry.timestamp_ns // 10**9)
+            )
+            direction = "<-" if entry.kind == CaptureKind.inbound else "->"
+            if isinstance(tls_record, Exception):
+                errors += 1
+                description = f"パースできません: {tls_record}"
+            else:
+                description = f"{_describe(tls_record)} {tls_record.length}バイト"
+            print(
+                f"{timestamp}.{entry.timestamp_ns % 10**9 // 1000:06d}"
+                f" {entry.connection_id:#x} {direction} {description}"
+            )
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""tiny-tls-pyコマンド。
+
+    tiny-tls-py serve --config server.toml --port 8443 -o capture_path=/var/tmp/tls.ring
+    tiny-tls-py benchmark --port 8443 --connections 10000 --concurrency 200
+    tiny-tls-py inspect capture replay /var/tmp/tls.ring.0
+    tiny-tls-py inspect fingerprint capture.pcapng --top 10
+    tiny-tls-py inspect config --config server.toml
+
+サブコマンドの実装は選ばれてから読み込むので、--helpやinspectの起動では
+サーバーのモジュール(cryptographyのx509や暗号、asyncio)を読み込まない。
+serveは設定をServerConfigに入れてから、サーバーのモジュールを読み込む。
+benchmarkはclient.py、inspect capture/fingerprintはcapture.py/fingerprint.pyに、
+残りの引数をそのまま渡す。
+"""
+
+import argparse
+import importlib
+import json
+
+from tiny_tls_py.config import ServerConfig, load_config, parse_override
+
+# ServerConfig.SERVER -> main()を持つモジュール
+SERVERS: dict[str, str] = {
+    "sync": "tiny_tls_py.server",
+    "async": "tiny_tls_py.async_server",
+    "prefork": "tiny_tls_py.prefork",
+}
+# serveのオプション -> ServerConfigの属性
+_SERVE_OPTIONS: dict[str, str] = {
+    "server": "SERVER",
+    "ip": "IP",
+    "port": "PORT",
+    "workers": "WORKERS",
+    "threads": "WORKER_THREADS",
+    "log_level": "LOG_LEVEL",
+    "certificate": "CERTIFICATE_PATH",
+    "private_key": "PRIVATE_KEY_PATH",
+}
+
+
+def _add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--config", help="ServerConfigを上書きするTOMLのファイル")
+    parser.add_argument(
+        "-o",
+        "--option",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="ServerConfigの属性を上書きする(例: -o metrics_port=9100)。何度でも指定できる",
+    )
+
+
+def _apply_config(args: argparse.Namespace, options: dict[str, str]) -> None:
+    """--config、-o、個別のオプションの順に、後のものを優先してServerConfigに入れる。"""
+    try:
+        overrides = dict(parse_override(option) for option in args.option)
+        for option, name in options.items():
+            value = getattr(args, option)
+            if value is not None:
+                overrides[name] = value
+        load_config(args.config, overrides)
+    except (OSError, TypeError, ValueError) as e:
+        args.parser.error(str(e))
+
+
+def _serve(args: argparse.Namespace) -> None:
+    _apply_config(args, _SERVE_OPTIONS)
+    if ServerConfig.SERVER not in SERVERS:
+        args.parser.error(f"Unknown server: {ServerConfig.SERVER}")
+    importlib.import_module(SERVERS[ServerConfig.SERVER]).main()
+
+
+def _show_config(args: argparse.Namespace) -> None:
+    _apply_config(args, {})
+    for name, value in vars(ServerConfig).items():
+        if not name.isupper():
+            continue
+        if value is None:
+            # TOMLにはNoneがないので、書かなければ既定値のまま
+            print(f"# {name.lower()} = none")
+        else:
+            print(f"{name.lower()} = {json.dumps(value)}")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="tiny-tls-py", description="TLS 1.3サーバーとその道具。"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="サーバーを起動する")
+    _add_config_arguments(serve)
+    serve.add_argument("--server", choices=SERVERS, help="既定はprefork")
+    serve.add_argument("--ip")
+    serve.add_argument("--port", type=int)
+    serve.add_argument("--workers", type=int, help="preforkのワーカーの数")
+    serve.add_argument(
+        "--threads",
+        action="store_true",
+        default=None,
+        help="preforkのワーカーをスレッドで動かす",
+    )
+    serve.add_argument("--log-level")
+    serve.add_argument("--certificate", help="PEMの証明書チェーン")
+    serve.add_argument("--private-key", help="PEMの秘密鍵")
+    serve.set_defaults(run=_serve, parser=serve)
+
+    # 残りの引数はclient.pyなどがそれぞれ解釈するので、-hもそのまま渡す
+    benchmark = commands.add_parser(
+        "benchmark", help="サーバーに負荷をかける(client.py)", add_help=False
+    )
+    benchmark.set_defaults(module="tiny_tls_py.client", prog="tiny-tls-py benchmark")
+
+    inspect = commands.add_parser("inspect", help="キャプチャや設定を調べる")
+    inspect_commands = inspect.add_subparsers(dest="target", required=True)
+    for target, module, description in (
+        ("capture", "tiny_tls_py.capture", "キャプチャのリングを表示/書き出す"),
+        ("fingerprint", "tiny_tls_py.fingerprint", "pcapのJA3/JA4を集計する"),
+    ):
+        inspect_commands.add_parser(
+            target, help=description, add_help=False
+        ).set_defaults(module=module, prog=f"tiny-tls-py inspect {target}")
+    config = inspect_commands.add_parser(
+        "config", help="設定を読み込んだ後のServerConfigをTOMLで表示する"
+    )
+    _add_config_arguments(config)
+    config.set_defaults(run=_show_config, parser=config)
+
+    args, rest = parser.parse_known_args(argv)
+    if "module" in args:
+        importlib.import_module(args.module).main(rest, prog=args.prog)
+        return
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    args.run(args)
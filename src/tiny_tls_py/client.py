@@ -0,0 +1,370 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import resource
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Self
+
+from tiny_tls_py.config import ServerConfig, configure_logging
+from tiny_tls_py.models.enums import (
+    ContentType,
+    ExtensionType,
+    HandshakeType,
+    ProtocolVersion,
+)
+from tiny_tls_py.models.key_service import KeyPair, KeyService
+from tiny_tls_py.models.tls_record_framer import (
+    HANDSHAKE_HEADER_LENGTH,
+    RECORD_HEADER_LENGTH,
+    HandshakeReassembler,
+    TlsRecordFramer,
+)
+from tiny_tls_py.wire.client_hello import ClientHello
+from tiny_tls_py.wire.extension import (
+    X25519_GROUP,
+    Extension,
+    KeyShareEntry,
+    SupportedVersion,
+)
+from tiny_tls_py.wire.handshake import Handshake
+from tiny_tls_py.wire.tls_record import TlsRecord
+
+logger = logging.getLogger(__name__)
+
+# ClientHelloのレコードの中で、ClientHello本体が始まる位置
+_BODY_OFFSET = RECORD_HEADER_LENGTH + HANDSHAKE_HEADER_LENGTH
+
+
+@dataclass(frozen=True, slots=True)
+class ClientHelloTemplate:
+    """送信するClientHelloのレコード。接続ごとにrandomとx25519の鍵共有だけを差し替える。
+
+    キャプチャしたClientHello(benchmarks/corpus/*.hex)をそのまま使えるので、
+    ブラウザと同じ大きさ・拡張の並びのClientHelloで負荷をかけられる。
+    """
+
+    record: bytes
+    # record内のrandom(32バイト)とx25519のkey_exchange(32バイト)の位置
+    random_offset: int
+    key_share_offset: int
+
+    @classmethod
+    def from_records(cls, data: bytes) -> Self:
+        """ClientHelloのTLSRecord(複数のレコードに分かれていてもよい)から作る。"""
+        framer = TlsRecordFramer()
+        framer.feed(data)
+        reassembler = HandshakeReassembler()
+        messages = [
+            bytes(message)
+            for record in framer.records()
+            for message in reassembler.feed(record[RECORD_HEADER_LENGTH:])
+        ]
+        if len(messages) != 1 or messages[0][0] != HandshakeType.ClientHello:
+            raise ValueError("ClientHelloが1つだけ入っている必要があります。")
+        message = messages[0]
+        client_hello = ClientHello.from_bytes(memoryview(message)[4:])
+        # binderはClientHello全体にかかるので、randomを変えると使えなくなる
+        if ExtensionType.PreSharedKey in client_hello.extension_types:
+            raise ValueError(
+                "pre_shared_keyを含むClientHelloはテンプレートにできません。"
+            )
+        location = client_hello._extension_index.get(ExtensionType.KeyShare)
+        if location is None:
+            raise ValueError("key_share拡張がありません。")
+        offset, length = location
+        # 最初の2バイトはclient_sharesの長さ
+        entry_offset = offset + 2
+        while entry_offset < offset + length:
+            entry = KeyShareEntry.from_bytes(
+                client_hello._original_data[entry_offset : offset + length]
+            )
+            if entry.group == X25519_GROUP and entry.length == 32:
+                break
+            entry_offset += entry.encoded_size()
+        else:
+            raise ValueError("x25519の鍵共有がありません。")
+        return cls(
+            b"\x16\x03\x01" + len(message).to_bytes(2, "big") + message,
+            _BODY_OFFSET + 2,
+            _BODY_OFFSET + entry_offset + 4,
+        )
+
+    @classmethod
+    def from_hex_file(cls, path: str | Path) -> Self:
+        """capture_client_hello.pyで保存した16進数のファイルから作る。"""
+        return cls.from_records(bytes.fromhex(Path(path).read_text()))
+
+    @classmethod
+    def default(cls) -> Self:
+        """TLS_AES_256_GCM_SHA384とx25519だけを提示する最小のClientHello。"""
+        extensions = (
+            # supported_versions: TLS1.3
+            Extension(
+                ExtensionType.SupportedVersions, SupportedVersion(b"\x02\x03\x04")
+            ),
+            # supported_groups: x25519
+            Extension(ExtensionType(0x000A), b"\x00\x02" + X25519_GROUP),
+            # signature_algorithms: ed25519, ecdsa_secp256r1_sha256,
+            # ecdsa_secp384r1_sha384, rsa_pss_rsae_sha256
+            Extension(ExtensionType(0x000D), bytes.fromhex("0008 0807 0403 0503 0804")),
+            Extension(
+                ExtensionType.KeyShare,
+                b"\x00\x24" + KeyShareEntry(X25519_GROUP, 32, bytes(32)).bytes(),
+            ),
+        )
+        extensions_data = b"".join(extension.bytes() for extension in extensions)
+        body = (
+            ProtocolVersion.TLS_1_2.to_bytes(2, "big")
+            + bytes(32)
+            + b"\x20"
+            + os.urandom(32)
+            # cipher_suites: TLS_AES_256_GCM_SHA384
+            + b"\x00\x02\x13\x02"
+            # compression_methods: null
+            + b"\x01\x00"
+            + len(extensions_data).to_bytes(2, "big")
+            + extensions_data
+        )
+        handshake = Handshake(HandshakeType.ClientHello, len(body), body)
+        record = TlsRecord(
+            ContentType.handshake,
+            ProtocolVersion.TLS_1_0,
+            handshake.encoded_size(),
+            handshake,
+        )
+        return cls.from_records(record.bytes())
+
+    def render(self, raw_public_key: bytes) -> bytearray:
+        record = bytearray(self.record)
+        record[self.random_offset : self.random_offset + 32] = os.urandom(32)
+        record[self.key_share_offset : self.key_share_offset + 32] = raw_public_key
+        return record
+
+
+@dataclass(frozen=True, slots=True)
+class ServerHelloResult:
+    """クライアントが受け取ったServerHelloのうち、鍵交換に必要な部分。"""
+
+    session_id: bytes
+    cipher_suite: int
+    # psk_keで再開したときはkey_shareがない
+    key_share: KeyShareEntry | None
+    selected_identity: int | None
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        """ServerHelloのハンドシェイクメッセージ(ヘッダー込み)をパースする。"""
+        view = memoryview(data)
+        if view[0] != HandshakeType.ServerHello:
+            raise ValueError(f"ServerHelloではありません: {view[0]}")
+        body = view[4 : 4 + int.from_bytes(view[1:4], "big")]
+        session_id_end = 35 + body[34]
+        cipher_suite = int.from_bytes(body[session_id_end : session_id_end + 2], "big")
+        # cipher_suite(2) + compression_method(1)の後ろが拡張の長さ
+        extensions_start = session_id_end + 5
+        extensions_end = extensions_start + int.from_bytes(
+            body[session_id_end + 3 : extensions_start], "big"
+        )
+        index = ClientHello.index_extensions(body, extensions_start, extensions_end)
+        if ExtensionType.SupportedVersions not in index:
+            raise ValueError("supported_versionsがないServerHelloです。")
+        key_share = None
+        if ExtensionType.KeyShare in index:
+            offset, length = index[ExtensionType.KeyShare]
+            key_share = KeyShareEntry.from_bytes(body[offset : offset + length])
+        selected_identity = None
+        if ExtensionType.PreSharedKey in index:
+            offset, _ = index[ExtensionType.PreSharedKey]
+            selected_identity = int.from_bytes(body[offset : offset + 2], "big")
+        return cls(
+            bytes(body[35:session_id_end]), cipher_suite, key_share, selected_identity
+        )
+
+
+@dataclass
+class LoadReport:
+    connections: int = 0
+    elapsed: float = 0.0
+    # 成功したハンドシェイクごとの秒数
+    latencies: list[float] = field(default_factory=list)
+    # 例外の種類 -> 回数
+    errors: Counter[str] = field(default_factory=Counter)
+
+    @property
+    def handshake_rate(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def summary(self) -> str:
+        lines = [
+            (
+                f"接続: {self.connections}  成功: {len(self.latencies)}"
+                f"  失敗: {sum(self.errors.values())}  経過: {self.elapsed:.2f}秒"
+            ),
+            f"ハンドシェイク/秒: {self.handshake_rate:.1f}",
+            "レイテンシ(ms): "
+            + "  ".join(
+                f"p{percent}={self.percentile(percent) * 1000:.2f}"
+                for percent in (50, 90, 99, 99.9)
+            )
+            + f"  max={max(self.latencies, default=0.0) * 1000:.2f}",
+        ]
+        lines.extend(f"  {name}: {count}" for name, count in self.errors.most_common())
+        return "\n".join(lines)
+
+
+class TlsLoadClient:
+    """asyncioで多数の接続を張り、ClientHelloを送ってServerHelloを受け取るまでを測る。
+
+    rateを指定すると、接続を始める時刻を1/rate秒ごとに決めて(オープンループ)、
+    レイテンシはその予定時刻から測る。サーバーが詰まって接続の開始が遅れた分も
+    レイテンシに入るので、遅いサーバーほど結果が良く見える(coordinated omission)
+    ことがない。rateがNoneなら、concurrency本の接続で間を空けずに繰り返す。
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = ServerConfig.PORT,
+        template: ClientHelloTemplate | None = None,
+        connections: int = 1000,
+        concurrency: int = 100,
+        rate: float | None = None,
+        timeout: float = ServerConfig.CONNECTION_TIMEOUT,
+        key_pairs: int = 256,
+        verify_key_exchange: bool = False,
+    ):
+        self.host = host
+        self.port = port
+        self.template = template or ClientHelloTemplate.default()
+        self.connections = connections
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        # 鍵ペアの生成でクライアント側のCPUを使い切らないように、先に作って使い回す
+        self._key_pairs = itertools.cycle(
+            [KeyService.generate_X25519_KeyPair() for _ in range(key_pairs)]
+        )
+        # Trueにすると、受け取った鍵共有で共有鍵まで計算する
+        self.verify_key_exchange = verify_key_exchange
+
+    async def handshake(self, key_pair: KeyPair) -> ServerHelloResult:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(self.template.render(key_pair.raw_public_key))
+            header = await reader.readexactly(RECORD_HEADER_LENGTH)
+            fragment = await reader.readexactly(int.from_bytes(header[3:5], "big"))
+            if header[0] == ContentType.alert:
+                raise ConnectionError(f"alertを受信しました: {fragment.hex()}")
+            if header[0] != ContentType.handshake:
+                raise ValueError(f"ハンドシェイクではないレコードです: {header[0]}")
+            server_hello = ServerHelloResult.from_bytes(fragment)
+            if self.verify_key_exchange:
+                if server_hello.key_share is None:
+                    raise ValueError("key_shareがないServerHelloです。")
+                KeyService.generate_common_secret(
+                    key_pair.private_key,
+                    KeyService.load_X25519_publickey(
+                        server_hello.key_share.key_exchange
+                    ),
+                )
+            return server_hello
+        finally:
+            writer.close()
+
+    async def run(self) -> LoadReport:
+        report = LoadReport(connections=self.connections)
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks: set[asyncio.Task] = set()
+        start = time.perf_counter()
+        for number in range(self.connections):
+            scheduled = None
+            if self.rate is not None:
+                scheduled = start + number / self.rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await slots.acquire()
+            task = asyncio.create_task(self._measure(report, slots, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    async def _measure(
+        self, report: LoadReport, slots: asyncio.Semaphore, scheduled: float | None
+    ) -> None:
+        start = time.perf_counter() if scheduled is None else scheduled
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self.handshake(next(self._key_pairs))
+            report.latencies.append(time.perf_counter() - start)
+        except TimeoutError:
+            report.errors["timeout"] += 1
+        except (OSError, EOFError, ValueError) as e:
+            report.errors[type(e).__name__] += 1
+            logger.debug("ハンドシェイクに失敗しました: %r", e)
+        finally:
+            slots.release()
+
+
+def raise_open_files_limit() -> int:
+    """同時に開けるファイル数のソフトリミットをハードリミットまで上げる。"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def main(argv: list[str] | None = None, prog: str | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="TLS1.3のClientHelloを送ってServerHelloまでの負荷をかける。",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=ServerConfig.PORT)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--rate", type=float, help="1秒あたりに始める接続の数")
+    parser.add_argument(
+        "--timeout", type=float, default=ServerConfig.CONNECTION_TIMEOUT
+    )
+    parser.add_argument("--template", help="ClientHelloを記録した16進数のファイル")
+    parser.add_argument("--key-pairs", type=int, default=256)
+    parser.add_argument("--verify", action="store_true", help="共有鍵まで計算する")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    limit = raise_open_files_limit()
+    if args.concurrency > limit:
+        logger.warning("同時接続数がファイル数の上限(%d)を超えています。", limit)
+    template = (
+        ClientHelloTemplate.from_hex_file(args.template) if args.template else None
+    )
+    client = TlsLoadClient(
+        host=args.host,
+        port=args.port,
+        template=template,
+        connections=args.connections,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        timeout=args.timeout,
+        key_pairs=args.key_pairs,
+        verify_key_exchange=args.verify,
+    )
+    print(asyncio.run(client.run()).summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""ServerConfigと、それをTOMLのファイルやコマンドラインの値で上書きする関数。
+
+サーバーのモジュールを読み込む前に設定を決められるように、ここでは
+標準ライブラリ以外をほとんど読み込まない。ServerConfigの値を関数の引数の
+既定値にしているクラス(AsyncTlsServer、PreforkServerなど)は、読み込んだ
+時点の値を使うので、設定はそれらのモジュールを読み込む前に済ませておく。
+
+TOMLのキーはServerConfigの属性の名前(大文字と小文字は区別しない)。
+
+    port = 8443
+    workers = 4
+    certificate_path = "/etc/tiny-tls/chain.pem"
+    private_key_path = "/etc/tiny-tls/key.pem"
+"""
+
+import os
+from collections.abc import Mapping
+
+
+class ServerConfig:
+    """サーバーの設定。load_config()でTOMLのファイルやコマンドラインの値で上書きする。"""
+
+    # tiny-tls-py serveで起動するサーバー(sync, async, prefork)
+    SERVER = "prefork"
+    IP = "0.0.0.0"
+    PORT = 10003
+    # 受信バッファの大きさと、プールに残しておく数
+    # (buffer_pool.RECV_BUFFER_SIZEと同じ値。dataclassesなどを読み込まないように直接書く)
+    RECV_BUFFER_SIZE = 2**15
+    RECV_BUFFER_POOL_SIZE = 1024
+    # listenのbacklog。名前はasyncioサーバー用だが、同期サーバーもこの値を使う
+    ASYNC_BACKLOG = 4096
+    # 同時に処理するハンドシェイクの上限(asyncioサーバーのみ)。超えた接続は空きが出るまで待たせる
+    MAX_CONCURRENT_HANDSHAKES = 1024
+    # 空きを待てるハンドシェイクの数。これも超えたら過負荷としてalertを送って断る。
+    # 同期サーバーではacceptを待っている接続の数と比べる
+    MAX_PENDING_HANDSHAKES = 4096
+    # 受け付けたソケットにTCP_NODELAYを付ける。フライトは1回のsendmsg()で書くので、
+    # Nagleで待たせても後から足すデータはなく、NewSessionTicketやalertが遅れるだけ
+    TCP_NODELAY = True
+    # ハンドシェイクが終わったら、送信の暗号化をkTLSに任せる(同期サーバーのみ)。
+    # カーネルにtlsモジュールがなければユーザー空間で暗号化する
+    KERNEL_TLS = False
+    # ハンドシェイク中に1回の読み込み/書き込みを待つ秒数。超えたら接続を切る
+    CONNECTION_TIMEOUT = 10.0
+    # ハンドシェイクが終わった接続を、何も受信しないまま保っておく秒数
+    IDLE_TIMEOUT = 300.0
+    # ログのレベル。DEBUGにすると受信したTLSRecordをpydanticのモデルに変換して表示する
+    # (pydanticとrichはそのときだけ読み込む)
+    LOG_LEVEL = "INFO"
+    # 事前生成しておくX25519鍵ペアの数と、補充を始める残数(0なら空になったとき)
+    KEY_POOL_SIZE = 256
+    KEY_POOL_LOW_WATER = 64
+    # X25519の鍵生成と鍵交換を計算する先(inline, thread, process)と、
+    # thread/processのワーカーの数。0ならCPUの数
+    CRYPTO_EXECUTOR = "inline"
+    CRYPTO_WORKERS = 0
+    # prefork.py用の設定。WORKERSがNoneならCPUの数だけワーカーを起動する
+    WORKERS: int | None = None
+    # Trueならprefork.pyのワーカーをプロセスではなくスレッドで動かす。
+    # GILのないCPython(3.13t以降)で、1プロセスのままコアの数だけ並列に処理する
+    WORKER_THREADS = False
+    # SIGTERMを受けてから、処理中の接続が終わるのを待つ秒数
+    SHUTDOWN_TIMEOUT = 10.0
+    # ワーカーごとのハンドシェイク数を集計して表示する間隔(秒)
+    STATS_INTERVAL = 5.0
+    # セッションチケットの寿命(秒)と、チケットを暗号化する鍵を切り替える間隔(秒)
+    TICKET_LIFETIME = 2 * 60 * 60
+    TICKET_KEY_ROTATION = 60 * 60
+    # 復号済みのチケットを覚えておく数
+    TICKET_CACHE_SIZE = 4096
+    # メトリクスをPrometheusのテキスト形式で返すポート(127.0.0.1のみ)。Noneなら公開しない
+    METRICS_PORT: int | None = None
+    # メトリクスを定期的に書き出すファイルと間隔(秒)。Noneなら書き出さない
+    METRICS_DUMP_PATH: str | None = None
+    METRICS_DUMP_INTERVAL = 10.0
+    # PEMの証明書チェーンと秘密鍵。Noneなら起動時に自己署名証明書を作る
+    CERTIFICATE_PATH: str | None = None
+    PRIVATE_KEY_PATH: str | None = None
+    # 自己署名証明書の鍵のアルゴリズム(certificate.KEY_ALGORITHMS)と名前。
+    # ブラウザはEd25519の証明書に対応していないので、既定はECDSA P-256
+    SELF_SIGNED_ALGORITHM = "ecdsa-p256"
+    SELF_SIGNED_COMMON_NAME = "localhost"
+    # CertificateVerifyの署名に使うスレッドの数(asyncioサーバーのみ)。0ならその場で署名する
+    SIGNING_THREADS = 0
+    # これより長いClientHelloはモデルにする前に断る
+    MAX_CLIENT_HELLO_LENGTH = 2**14
+    # 送受信したレコードを書くキャプチャのリングファイル(capture.py)と大きさ(バイト)。
+    # Noneならキャプチャしない。preforkではワーカーごとに末尾に番号を付ける
+    CAPTURE_PATH: str | None = None
+    CAPTURE_SIZE = 64 * 2**20
+    # 起動したときからキャプチャするか。SIGUSR1を送るたびに有効/無効が切り替わる
+    CAPTURE_ENABLED = False
+    # キャプチャする接続の割合(0から1)
+    CAPTURE_SAMPLE_RATE = 1.0
+    # 送信元IPごとの1秒あたりの接続数とハンドシェイク数、まとめて許す数。
+    # Noneなら制限しない。NATの後ろの利用者をまとめて数えることに注意
+    CONNECTION_RATE_PER_IP: float | None = None
+    CONNECTION_BURST_PER_IP = 64
+    HANDSHAKE_RATE_PER_IP: float | None = None
+    HANDSHAKE_BURST_PER_IP = 64
+    # 制限のために覚えておく送信元IPの数
+    RATE_LIMIT_SOURCES = 65536
+
+
+# 既定値がNoneの属性 -> Noneでないときの型。既定値から型が分からないので、
+# ServerConfigにNoneの属性を足したらここにも足す
+_OPTIONAL_TYPES: dict[str, type] = {
+    "WORKERS": int,
+    "METRICS_PORT": int,
+    "METRICS_DUMP_PATH": str,
+    "CERTIFICATE_PATH": str,
+    "PRIVATE_KEY_PATH": str,
+    "CAPTURE_PATH": str,
+    "CONNECTION_RATE_PER_IP": float,
+    "HANDSHAKE_RATE_PER_IP": float,
+}
+
+
+def configure_logging(level: str | None = None) -> None:
+    """levelを省略すると、ServerConfig.LOG_LEVELを使う。"""
+    import logging
+
+    logging.basicConfig(
+        level=level or ServerConfig.LOG_LEVEL,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+def update_config(values: Mapping[str, object]) -> None:
+    """ServerConfigの属性をvaluesで上書きする。知らないキーはValueError、型の違う値はTypeError。
+
+    型は既定値の型で、既定値がNoneの属性は_OPTIONAL_TYPESの型。Noneを
+    入れられるのは既定値がNoneの属性だけ。intの属性にはintだけ、floatの
+    属性にはintかfloatを入れられる。
+    """
+    for key, value in values.items():
+        name = key.upper().replace("-", "_")
+        if name.startswith("_") or name not in vars(ServerConfig):
+            raise ValueError(f"Unknown config key: {key}")
+        current = getattr(ServerConfig, name)
+        expected = type(current) if current is not None else _OPTIONAL_TYPES[name]
+        if value is None:
+            if name not in _OPTIONAL_TYPES:
+                raise TypeError(f"{key}にはnoneを指定できません。")
+        elif type(value) is not expected and not (
+            expected is float and type(value) is int
+        ):
+            raise TypeError(
+                f"{key}には{expected.__name__}を指定してください: {value!r}"
+            )
+        if expected is float and type(value) is int:
+            value = float(value)
+        setattr(ServerConfig, name, value)
+
+
+def parse_override(option: str) -> tuple[str, object]:
+    """コマンドラインのKEY=VALUEを(KEY, 値)にする。
+
+    VALUEはTOMLの値として読めればその型(8443、1.5、true、"text")に、
+    読めなければ文字列にする。noneはNoneにする。
+    """
+    # tomllibは設定を読むときにだけ読み込む(起動を速くするため)
+    import tomllib
+
+    key, separator, text = option.partition("=")
+    if not separator or not key:
+        raise ValueError(f"KEY=VALUEの形で指定してください: {option}")
+    if text.lower() in ("none", "null"):
+        return key, None
+    try:
+        return key, tomllib.loads(f"value = {text}")["value"]
+    except tomllib.TOMLDecodeError:
+        return key, text
+
+
+def load_config(
+    path: str | os.PathLike[str] | None = None,
+    overrides: Mapping[str, object] | None = None,
+) -> None:
+    """pathのTOMLを読み込んでから、overridesで上書きする。"""
+    if path is not None:
+        import tomllib
+
+        with open(path, "rb") as file:
+            update_config(tomllib.load(file))
+    if overrides:
+        update_config(overrides)
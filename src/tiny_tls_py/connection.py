@@ -0,0 +1,594 @@
+"""サーバー側の1接続ぶんのTLS 1.3の状態機械。
+
+kTLSに鍵を入れるとき以外はソケットに触らないので(Sans-IO)、同期サーバー
+(server.py)とasyncioサーバー(async_server.py)の両方から使う。受信したバイト列は
+framerのバッファに直接読み込み、送るレコードはoutgoingに溜める。
+"""
+
+import hmac
+import logging
+import socket
+import time
+from collections.abc import Callable
+from enum import IntEnum
+from typing import Final
+
+from tiny_tls_py.admission import (
+    MAX_CLIENT_HELLO_LENGTH,
+    AdmissionFilter,
+    check_record_header,
+)
+from tiny_tls_py.capture import CaptureKind, WireCapture
+from tiny_tls_py.ktls import (
+    KernelTlsQueue,
+    crypto_info,
+    install_tx,
+    kernel_tls_available,
+)
+from tiny_tls_py.metrics import Metrics
+from tiny_tls_py.models.alert import TlsAlert, alert_record
+from tiny_tls_py.models.buffer_pool import RECV_BUFFER_SIZE, BufferPool
+from tiny_tls_py.models.enums import (
+    AlertDescription,
+    ContentType,
+    HandshakeType,
+    KeyUpdateRequest,
+)
+from tiny_tls_py.models.key_schedule import HASH_LENGTH, KeySchedule
+from tiny_tls_py.models.record_protection import (
+    MAX_PLAINTEXT_LENGTH,
+    RecordProtection,
+)
+from tiny_tls_py.models.record_sizer import IDLE_RESET, RAMP_UP_BYTES, RecordSizer
+from tiny_tls_py.models.send_queue import SendQueue
+from tiny_tls_py.models.server_flight import ServerFlight
+from tiny_tls_py.models.tls_handshake_processor import (
+    HandshakeKeys,
+    PendingHandshake,
+    TlsHandshakeProcessor,
+)
+from tiny_tls_py.models.tls_record_framer import (
+    HANDSHAKE_HEADER_LENGTH,
+    RECORD_HEADER_LENGTH,
+    HandshakeReassembler,
+    TlsRecordFramer,
+)
+from tiny_tls_py.wire.tls_record import TlsRecord
+
+logger = logging.getLogger(__name__)
+
+
+def _derived(secret: bytes | None) -> bytes:
+    """導出してあるはずのシークレット。まだなければ状態機械の誤りなのでalertにする。"""
+    if secret is None:
+        raise TlsAlert(
+            AlertDescription.internal_error, "シークレットがまだ導出されていません。"
+        )
+    return secret
+
+
+# クライアントのKeyUpdateに応えるときに送る、ハンドシェイクヘッダー込みのKeyUpdate
+KEY_UPDATE_NOT_REQUESTED: Final[bytes] = bytes(
+    (HandshakeType.KeyUpdate, 0, 0, 1, KeyUpdateRequest.update_not_requested)
+)
+# 互換のためのChangeCipherSpecの中身(RFC 8446 D.4)
+_CHANGE_CIPHER_SPEC: Final[bytes] = b"\x01"
+# ClientHelloのハンドシェイクヘッダー(4) + legacy_version(2) + random(32)の後ろ
+_SESSION_ID_OFFSET: Final[int] = HANDSHAKE_HEADER_LENGTH + 34
+# ServerHelloの直後に送る、ChangeCipherSpecのレコード
+CHANGE_CIPHER_SPEC_RECORD: Final[bytes] = (
+    bytes((ContentType.change_cipher_spec, 3, 3, 0, 1)) + _CHANGE_CIPHER_SPEC
+)
+
+
+class ConnectionState(IntEnum):
+    """RFC 8446 A.2のサーバーの状態のうち、このサーバーで使うもの。"""
+
+    # ClientHelloを待っている
+    START = 0
+    # ClientHelloを検証して、crypto_executorの鍵交換を待っている
+    KEY_EXCHANGE = 1
+    # ServerHelloを作って、CertificateVerifyの署名を待っている
+    NEGOTIATED = 2
+    # サーバーのFinishedまで送って、クライアントのFinishedを待っている
+    WAIT_FINISHED = 3
+    CONNECTED = 4
+    CLOSED = 5
+
+
+# receive_records()がレコードを処理せずに戻る状態
+_STOPPED_STATES: Final[tuple[ConnectionState, ...]] = (
+    ConnectionState.KEY_EXCHANGE,
+    ConnectionState.NEGOTIATED,
+    ConnectionState.CLOSED,
+)
+
+
+def log_tls_records(tls_records: list[TlsRecord]) -> None:
+    """DEBUGのときだけ、TlsRecordをpydanticのモデルにしてrichで整形して出す。"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    # richは開発用の依存なので、使うときにだけ読み込む
+    from rich.pretty import pretty_repr
+
+    logger.debug(pretty_repr([tls_record.to_model() for tls_record in tls_records]))
+
+
+class TlsConnection:
+    """1接続ぶんのハンドシェイクの状態と、transcript・鍵・受信バッファを持つ。
+
+        START --ClientHello--> (KEY_EXCHANGE --鍵交換-->) NEGOTIATED --署名-->
+              WAIT_FINISHED --クライアントのFinished--> CONNECTED
+
+    ハンドシェイクメッセージは(状態, HandshakeType)で処理する関数を選ぶ。
+    NEGOTIATEDになるとreceive_records()はそこで止まるので、呼び出し側が
+    flightを署名してfinish_flight()を呼び、もう一度receive_records()を呼ぶ。
+    署名をスレッドプールに任せても、その間に届いたレコードはframerに残る。
+    defer_key_exchangeなら、鍵交換の前のKEY_EXCHANGEでも同じように止まるので、
+    pending_handshakeの鍵交換をcrypto_executorで計算してfinish_key_exchange()を呼ぶ。
+
+    受信バッファはbuffer_poolから借りて、読み残しがなくなるたびに返すので、
+    アイドルな接続はバッファを持たない。
+
+    use_kernel_tlsのときは、CONNECTEDになってoutgoingを送りきった後に
+    offload_to_kernel()を呼ぶと、以降の送信はカーネルが暗号化する(ktls.py)。
+
+    send_application_data()はrecord_sizerで、接続の最初は小さいレコード、
+    その後は最大のレコードにする。受信したapplication_dataは
+    on_application_dataに渡す(Noneなら読み捨てる)。
+
+    WireCaptureが有効なときに作られ、sample()で選ばれた接続は、受信したレコードと
+    ユーザー空間で作った送信のレコードをキャプチャのリングに書く(capture.py)。
+    """
+
+    # 全接続で共有する受信バッファのプール
+    buffer_pool: BufferPool = BufferPool()
+    # ハンドシェイクが終わったら、送信をkTLSに任せる
+    use_kernel_tls: bool = False
+    # RecordSizerに渡す、小さいレコードで送るバイト数とやり直すまでの秒数
+    record_ramp_up_bytes: int = RAMP_UP_BYTES
+    record_idle_reset: float = IDLE_RESET
+
+    @classmethod
+    def configure_buffer_pool(
+        cls, buffer_size: int = RECV_BUFFER_SIZE, max_free: int = 1024
+    ) -> BufferPool:
+        cls.buffer_pool = BufferPool(buffer_size, max_free)
+        return cls.buffer_pool
+
+    @classmethod
+    def configure_kernel_tls(cls, enabled: bool) -> bool:
+        """kTLSを使うかを設定する。カーネルが対応していなければ使わずにFalseを返す。"""
+        cls.use_kernel_tls = enabled and kernel_tls_available()
+        if enabled and not cls.use_kernel_tls:
+            logger.warning(
+                "カーネルのtlsモジュールが使えないので、ユーザー空間で暗号化します。"
+            )
+        return cls.use_kernel_tls
+
+    @classmethod
+    def configure_record_sizing(
+        cls, ramp_up_bytes: int = RAMP_UP_BYTES, idle_reset: float = IDLE_RESET
+    ) -> None:
+        """ramp_up_bytesを0にすると、最初から最大のレコードで送る。"""
+        cls.record_ramp_up_bytes = ramp_up_bytes
+        cls.record_idle_reset = idle_reset
+
+    def __init__(self, source: str = "", admission: AdmissionFilter | None = None):
+        # 送信元のIPアドレス。admissionの送信元ごとの制限に使う
+        self.source = source
+        self.admission = admission
+        self.state = ConnectionState.START
+        self.framer = TlsRecordFramer(pool=self.buffer_pool)
+        self.reassembler = HandshakeReassembler(
+            admission.max_client_hello_length if admission else MAX_CLIENT_HELLO_LENGTH
+        )
+        self.key_schedule = KeySchedule()
+        # Trueなら、鍵交換をその場で計算せずにKEY_EXCHANGEで止まる(asyncioサーバー)
+        self.defer_key_exchange = False
+        # KEY_EXCHANGEの間だけ、鍵交換を待っているハンドシェイクを持つ
+        self._pending: PendingHandshake | None = None
+        # NEGOTIATEDの間だけ、署名を待っているフライトを持つ
+        self.flight: ServerFlight | None = None
+        self._read_protection: RecordProtection | None = None
+        self._write_protection: RecordProtection | None = None
+        self._record_version = 0
+        # ClientHelloにlegacy_session_idがあれば、ChangeCipherSpecを返す(RFC 8446 D.4)
+        self._middlebox_compatibility = False
+        # 送るレコード。呼び出し側がsend_all()やdrain()でソケットに書く
+        self.outgoing: SendQueue | KernelTlsQueue = SendQueue()
+        # offload_to_kernel()で送信をkTLSに任せたらTrue
+        self.offloaded = False
+        # 送るレコードの平文の最大長。クライアントのrecord_size_limitで小さくなる
+        self.max_fragment_length = MAX_PLAINTEXT_LENGTH
+        # CONNECTEDになってから、application_dataのレコードの大きさを決める
+        self.record_sizer: RecordSizer | None = None
+        # 復号したapplication_dataを受け取る関数。渡すmemoryviewはframerの
+        # バッファなので、receive_records()から戻った後も使うならコピーすること
+        self.on_application_data: Callable[[memoryview], None] | None = None
+        # WireCaptureの接続ID。0ならこの接続はキャプチャしない
+        self.capture_id = WireCapture.sample()
+        self._capture_opened = False
+
+    @property
+    def closed(self) -> bool:
+        return self.state == ConnectionState.CLOSED
+
+    @property
+    def pending_handshake(self) -> PendingHandshake:
+        """KEY_EXCHANGEの間の、鍵交換を待っているハンドシェイク。"""
+        if self.state != ConnectionState.KEY_EXCHANGE or self._pending is None:
+            raise ValueError("鍵交換を待っているハンドシェイクがありません。")
+        return self._pending
+
+    @property
+    def negotiated_flight(self) -> ServerFlight:
+        """NEGOTIATEDの間の、署名を待っているフライト。"""
+        if self.state != ConnectionState.NEGOTIATED or self.flight is None:
+            raise ValueError("署名を待っているフライトがありません。")
+        return self.flight
+
+    def receive_records(self) -> None:
+        """framerにたまった完全なレコードを順に処理する。
+
+        KEY_EXCHANGEかNEGOTIATEDになるか閉じたら、残りのレコードはframerに
+        置いたまま戻る。プロトコル違反はTlsAlertで知らせるので、呼び出し側で
+        send_alert()する。レコードを切り出すのにかかった時間は"framing"の
+        フェーズとして記録する(レコードを処理する時間は含めない)。
+        """
+        if self.state in _STOPPED_STATES:
+            return
+        framing = 0.0
+        records = self.framer.records()
+        while True:
+            start = time.perf_counter()
+            record = next(records, None)
+            framing += time.perf_counter() - start
+            if record is None:
+                break
+            self._receive_record(record)
+            if self.state in _STOPPED_STATES:
+                break
+        self.framer.release()
+        Metrics.observe("framing", framing)
+
+    def finish_key_exchange(self, keys: HandshakeKeys) -> None:
+        """鍵交換の結果でServerHelloを作って、署名かクライアントのFinishedを待つ。"""
+        pending = self.pending_handshake
+        self._pending = None
+        self._negotiated(*TlsHandshakeProcessor.complete_handshake(pending, keys))
+
+    def finish_flight(self, signature: bytes | None) -> None:
+        """署名したフライトを送るバイト列に加えて、クライアントのFinishedを待つ。"""
+        flight = self.negotiated_flight
+        response = memoryview(TlsHandshakeProcessor.finish_handshake(flight, signature))
+        # ServerHelloと暗号化したフライトは同じバッファにあるので、間に
+        # ChangeCipherSpecを挟むときもコピーせずにセグメントを分ける
+        self._send_server_hello(response[: flight.server_hello_length])
+        self._send(response[flight.server_hello_length :])
+        self.max_fragment_length = flight.max_fragment_length
+        self.flight = None
+        self._write_protection = RecordProtection.from_traffic_secret(
+            _derived(self.key_schedule.server_application_traffic_secret)
+        )
+        self._wait_finished()
+
+    def send_application_data(self, data: bytes | bytearray | memoryview) -> None:
+        """application_dataを送るレコードに加える。kTLSならdataをそのまま置く。
+
+        kTLSのときはコピーしないので、送り終わるまでdataを書き換えないこと。
+        """
+        sizer = self.record_sizer
+        protection = self._write_protection
+        if (
+            self.state != ConnectionState.CONNECTED
+            or sizer is None
+            or protection is None
+        ):
+            raise ValueError("ハンドシェイクが終わっていません。")
+        if self.offloaded:
+            self.outgoing.append(data)
+            return
+        # 小さいレコードの分と最大のレコードの分を、1つのバッファに続けて暗号化する
+        parts = sizer.split(len(data))
+        record = bytearray(
+            sum(RecordProtection.sealed_size(size, length) for size, length in parts)
+        )
+        view = memoryview(data)
+        offset = 0
+        for size, length in parts:
+            offset += protection.seal_into(
+                record, offset, view[:size], ContentType.application_data, length
+            )
+            view = view[size:]
+        self._send(record)
+
+    def offload_to_kernel(self, sock: socket.socket) -> bool:
+        """送信のトラフィック鍵をsockのkTLSに入れて、以降の暗号化をカーネルに任せる。
+
+        CONNECTEDで、outgoingを送りきっているときだけ入れる(ユーザー空間で
+        暗号化済みのレコードを、カーネルがもう一度暗号化しないように)。
+        カーネルは常に最大のレコードにするので、record_size_limitで上限を
+        小さくした接続も入れない。
+        入れられなければFalseを返し、そのままユーザー空間で暗号化を続ける。
+        """
+        protection = self._write_protection
+        if (
+            not self.use_kernel_tls
+            or self.offloaded
+            or self.state != ConnectionState.CONNECTED
+            or protection is None
+            or len(self.outgoing)
+            or self.max_fragment_length < MAX_PLAINTEXT_LENGTH
+        ):
+            return False
+        try:
+            install_tx(
+                sock,
+                crypto_info(
+                    protection.cipher_suite,
+                    _derived(self.key_schedule.server_application_traffic_secret),
+                    protection.sequence_number,
+                ),
+            )
+        except OSError as e:
+            logger.info("kTLSに鍵を入れられませんでした: %s", e)
+            Metrics.count("ktls_fallbacks")
+            return False
+        self.offloaded = True
+        self.outgoing = KernelTlsQueue()
+        Metrics.count("ktls_connections")
+        return True
+
+    def send_alert(self, description: AlertDescription) -> None:
+        """alertを送るバイト列に加えて、接続を閉じた状態にする。"""
+        if self.closed:
+            return
+        payload = alert_record(description)
+        if self._write_protection is None:
+            self._send(payload)
+        else:
+            self._seal(payload[RECORD_HEADER_LENGTH:], ContentType.alert)
+        Metrics.count("alerts_sent")
+        self.state = ConnectionState.CLOSED
+
+    def close(self) -> None:
+        """受信バッファをプールに返す。接続を閉じたら必ず呼ぶ。"""
+        self.framer.close()
+        self._pending = None
+        self.flight = None
+        self.state = ConnectionState.CLOSED
+        if self._capture_opened:
+            WireCapture.record(self.capture_id, CaptureKind.close)
+        self.capture_id = 0
+
+    def _receive_record(self, record: memoryview) -> None:
+        Metrics.count("records")
+        if self.capture_id:
+            self._capture(CaptureKind.inbound, record)
+        check_record_header(record)
+        content_type = record[0]
+        if content_type == ContentType.change_cipher_spec:
+            # RFC 8446 5: ClientHelloからFinishedまでのChangeCipherSpecは読み捨てる
+            if (
+                self.state != ConnectionState.WAIT_FINISHED
+                or record[RECORD_HEADER_LENGTH:] != _CHANGE_CIPHER_SPEC
+            ):
+                raise TlsAlert(
+                    AlertDescription.unexpected_message,
+                    "予期しないChangeCipherSpecを受信しました。",
+                )
+            return
+        if content_type == ContentType.application_data:
+            if self._read_protection is None:
+                raise TlsAlert(
+                    AlertDescription.unexpected_message,
+                    "鍵がないうちにapplication_dataを受信しました。",
+                )
+            try:
+                content_type, fragment = self._read_protection.open(record)
+            except ValueError as e:
+                raise TlsAlert(AlertDescription.bad_record_mac, str(e)) from e
+        elif self._read_protection is not None and content_type != ContentType.alert:
+            raise TlsAlert(
+                AlertDescription.unexpected_message,
+                f"暗号化されていないレコードを受信しました: {content_type}",
+            )
+        else:
+            self._record_version = (record[1] << 8) | record[2]
+            fragment = record[RECORD_HEADER_LENGTH:]
+
+        if content_type != ContentType.handshake and self.reassembler.has_pending:
+            raise TlsAlert(
+                AlertDescription.unexpected_message,
+                "ハンドシェイクメッセージの途中で別のレコードを受信しました。",
+            )
+        if content_type == ContentType.handshake:
+            for message in self.reassembler.feed(fragment):
+                self._receive_handshake(message)
+        elif content_type == ContentType.alert:
+            self._receive_alert(fragment)
+        elif (
+            content_type == ContentType.application_data
+            and self.state == ConnectionState.CONNECTED
+        ):
+            if self.on_application_data is None:
+                logger.debug(
+                    "application_dataを%dバイト読み捨てました。", len(fragment)
+                )
+            else:
+                self.on_application_data(fragment)
+        else:
+            raise TlsAlert(
+                AlertDescription.unexpected_message,
+                f"{self.state.name}で受け取れないレコードです: {content_type}",
+            )
+
+    def _receive_handshake(self, message: memoryview) -> None:
+        handler = self._HANDSHAKE_HANDLERS.get((self.state, message[0]))
+        if handler is None:
+            raise TlsAlert(
+                AlertDescription.unexpected_message,
+                f"{self.state.name}で受け取れないハンドシェイクメッセージです: "
+                f"{message[0]}",
+            )
+        handler(self, message)
+
+    def _receive_client_hello(self, message: memoryview) -> None:
+        if self.admission is not None:
+            # モデルにする前に、処理できるClientHelloかをバイト列で確かめる
+            self.admission.admit_client_hello(self.source, message)
+        start = time.perf_counter()
+        tls_record = TlsRecord.from_handshake_message(self._record_version, message)
+        Metrics.observe("handshake_parse", time.perf_counter() - start)
+        log_tls_records([tls_record])
+        pending = TlsHandshakeProcessor.negotiate(tls_record, self.key_schedule)
+        if pending is None:
+            raise TlsAlert(
+                AlertDescription.handshake_failure,
+                "x25519のkey_shareも使えるチケットもないClientHelloです。",
+            )
+        self._middlebox_compatibility = message[_SESSION_ID_OFFSET] > 0
+        if self.defer_key_exchange and pending.needs_key_exchange:
+            self._pending = pending
+            self.state = ConnectionState.KEY_EXCHANGE
+            return
+        self._negotiated(
+            *TlsHandshakeProcessor.complete_handshake(
+                pending, TlsHandshakeProcessor.exchange_keys(pending)
+            )
+        )
+
+    def _negotiated(self, response: bytearray, flight: ServerFlight | None) -> None:
+        if flight is None:
+            # 証明書がないときはServerHelloだけを返す
+            self._send_server_hello(response)
+            self._wait_finished()
+            return
+        self.flight = flight
+        self.state = ConnectionState.NEGOTIATED
+        if flight.signature_input is None:
+            # チケットで再開したときは署名がいらない
+            self.finish_flight(None)
+
+    def _receive_finished(self, message: memoryview) -> None:
+        key_schedule = self.key_schedule
+        expected = key_schedule.finished_verify_data(
+            _derived(key_schedule.client_handshake_traffic_secret)
+        )
+        if len(message) != HANDSHAKE_HEADER_LENGTH + HASH_LENGTH or not (
+            hmac.compare_digest(message[HANDSHAKE_HEADER_LENGTH:], expected)
+        ):
+            raise TlsAlert(
+                AlertDescription.decrypt_error, "クライアントのFinishedが一致しません。"
+            )
+        key_schedule.transcript.update(message)
+        key_schedule.derive_resumption_master_secret()
+        self._read_protection = RecordProtection.from_traffic_secret(
+            _derived(key_schedule.client_application_traffic_secret)
+        )
+        self.state = ConnectionState.CONNECTED
+        self.record_sizer = RecordSizer(
+            self.max_fragment_length,
+            ramp_up_bytes=self.record_ramp_up_bytes,
+            idle_reset=self.record_idle_reset,
+        )
+        Metrics.count("completed_handshakes")
+        ticket = TlsHandshakeProcessor.new_session_ticket(key_schedule)
+        if ticket is not None and self._write_protection is not None:
+            self._seal(ticket.bytes(), ContentType.handshake)
+
+    def _receive_key_update(self, message: memoryview) -> None:
+        if len(message) != HANDSHAKE_HEADER_LENGTH + 1 or message[4] not in (
+            KeyUpdateRequest.update_not_requested,
+            KeyUpdateRequest.update_requested,
+        ):
+            raise TlsAlert(AlertDescription.decode_error, "KeyUpdateが不正です。")
+        key_schedule = self.key_schedule
+        key_schedule.client_application_traffic_secret = (
+            KeySchedule.next_traffic_secret(
+                _derived(key_schedule.client_application_traffic_secret)
+            )
+        )
+        self._read_protection = RecordProtection.from_traffic_secret(
+            key_schedule.client_application_traffic_secret
+        )
+        if message[4] == KeyUpdateRequest.update_requested:
+            # RFC 8446 4.6.3: 今の鍵でKeyUpdateを送ってから、送信の鍵を更新する
+            self._seal(KEY_UPDATE_NOT_REQUESTED, ContentType.handshake)
+            key_schedule.server_application_traffic_secret = (
+                KeySchedule.next_traffic_secret(
+                    _derived(key_schedule.server_application_traffic_secret)
+                )
+            )
+            self._write_protection = RecordProtection.from_traffic_secret(
+                key_schedule.server_application_traffic_secret
+            )
+            if isinstance(self.outgoing, KernelTlsQueue):
+                # KeyUpdateを送った後で、カーネルの鍵も入れ替える
+                self.outgoing.append_rekey(
+                    crypto_info(
+                        self._write_protection.cipher_suite,
+                        key_schedule.server_application_traffic_secret,
+                        0,
+                    )
+                )
+
+    def _receive_alert(self, fragment: memoryview) -> None:
+        if len(fragment) != 2:
+            raise TlsAlert(AlertDescription.decode_error, "alertの長さが不正です。")
+        if fragment[1] == AlertDescription.close_notify:
+            logger.debug("クライアントからclose_notifyを受信しました。")
+            # close_notifyを返してから閉じる
+            self.send_alert(AlertDescription.close_notify)
+        else:
+            logger.info("クライアントからalertを受信しました: %d", fragment[1])
+        self.state = ConnectionState.CLOSED
+
+    def _wait_finished(self) -> None:
+        self._read_protection = RecordProtection.from_traffic_secret(
+            _derived(self.key_schedule.client_handshake_traffic_secret)
+        )
+        self.state = ConnectionState.WAIT_FINISHED
+
+    def _send_server_hello(self, server_hello: bytes | bytearray | memoryview) -> None:
+        self._send(server_hello)
+        if self._middlebox_compatibility:
+            self._send(CHANGE_CIPHER_SPEC_RECORD)
+
+    def _send(self, data: bytes | bytearray | memoryview) -> None:
+        """ユーザー空間で作ったレコードをoutgoingに加える(kTLSに渡す平文は通らない)。"""
+        if self.capture_id:
+            self._capture(CaptureKind.outbound, data)
+        self.outgoing.append(data)
+
+    def _capture(self, kind: CaptureKind, data: bytes | bytearray | memoryview) -> None:
+        if not self._capture_opened:
+            # 送信元は接続を受け付けた後で設定されるので、最初の記録の前に書く
+            self._capture_opened = True
+            WireCapture.record(self.capture_id, CaptureKind.open, self.source.encode())
+        WireCapture.record(self.capture_id, kind, data)
+
+    def _seal(self, plaintext: bytes | memoryview, content_type: ContentType) -> None:
+        if isinstance(self.outgoing, KernelTlsQueue):
+            # 暗号化はカーネルに任せて、content_typeだけ伝える
+            self.outgoing.append_record(content_type, bytes(plaintext))
+            return
+        # 呼び出し元が、送信の鍵を入れた後でだけ呼ぶ
+        assert self._write_protection is not None
+        record = bytearray(
+            RecordProtection.sealed_size(len(plaintext), self.max_fragment_length)
+        )
+        self._write_protection.seal_into(
+            record, 0, plaintext, content_type, self.max_fragment_length
+        )
+        self._send(record)
+
+    # (状態, HandshakeType) -> そのメッセージを処理するメソッド
+    _HANDSHAKE_HANDLERS: Final[
+        dict[tuple[ConnectionState, int], Callable[["TlsConnection", memoryview], None]]
+    ] = {
+        (ConnectionState.START, HandshakeType.ClientHello): _receive_client_hello,
+        (ConnectionState.WAIT_FINISHED, HandshakeType.Finished): _receive_finished,
+        (ConnectionState.CONNECTED, HandshakeType.KeyUpdate): _receive_key_update,
+    }
@@ -0,0 +1,365 @@
+"""キャプチャファイルのClientHelloからJA3/JA4のフィンガープリントを集計する。
+
+ClientHelloのパースにはサーバーと同じTlsRecordFramer、HandshakeReassembler、
+wire.ClientHelloを使うので、サーバーが受け付けない形のClientHelloは
+ここでもエラーとして数えられる。
+
+ファイルはmmapして、パケットの境界で区切った塊ごとにプロセスプールで処理する。
+
+    python -m tiny_tls_py.fingerprint capture.pcapng --workers 8 --top 20
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Self
+
+from tiny_tls_py.models.enums import ContentType, ExtensionType, HandshakeType
+from tiny_tls_py.models.tls_record_framer import (
+    HANDSHAKE_HEADER_LENGTH,
+    RECORD_HEADER_LENGTH,
+    HandshakeReassembler,
+    TlsRecordFramer,
+)
+from tiny_tls_py.pcap import CaptureFile, tcp_segment
+from tiny_tls_py.wire.client_hello import ClientHello
+
+# JA4で使う拡張の種類
+EXTENSION_SUPPORTED_GROUPS = 0x000A
+EXTENSION_EC_POINT_FORMATS = 0x000B
+EXTENSION_SIGNATURE_ALGORITHMS = 0x000D
+EXTENSION_ALPN = 0x0010
+# ClientHelloの途中で塊の終わりに来たとき、続きを探して読み進めるバイト数
+CHUNK_OVERRUN = 1 << 20
+# 複数のセグメントに分かれたClientHelloの続きを待つフローの数の上限
+MAX_PENDING_FLOWS = 65536
+_JA4_VERSIONS = {
+    0x0304: "13",
+    0x0303: "12",
+    0x0302: "11",
+    0x0301: "10",
+    0x0300: "s3",
+    0x0002: "s2",
+}
+_EMPTY_HASH = "000000000000"
+# RFC 8701のGREASEの値(0x0A0A, 0x1A1A, ..., 0xFAFA)
+_GREASE = frozenset(range(0x0A0A, 0x10000, 0x1010))
+# フィンガープリントに使う拡張
+_FINGERPRINT_EXTENSIONS = (
+    ExtensionType.SupportedVersions,
+    EXTENSION_SUPPORTED_GROUPS,
+    EXTENSION_EC_POINT_FORMATS,
+    EXTENSION_SIGNATURE_ALGORITHMS,
+    EXTENSION_ALPN,
+)
+# フィンガープリントに使う部分 -> (JA3, JA4)。同じクライアントは同じ値になるので
+# 2回目からはハッシュを取らずに済む
+_fingerprint_cache: dict[tuple, tuple[str, str]] = {}
+_FINGERPRINT_CACHE_SIZE = 65536
+
+
+def is_grease(value: int) -> bool:
+    return value in _GREASE
+
+
+def _uint16s(data: memoryview | bytes | None, length_size: int = 2) -> list[int]:
+    """先頭の長さ(length_sizeバイト)を飛ばして、GREASEを除いたuint16の並びを返す。"""
+    if data is None:
+        return []
+    count = (len(data) - length_size) // 2
+    return [
+        value
+        for value in struct.unpack_from(f"!{count}H", data, length_size)
+        if value not in _GREASE
+    ]
+
+
+def fingerprints(client_hello: ClientHello) -> tuple[str, str]:
+    """(JA3の文字列, JA4)。フィンガープリントに使う部分が同じならキャッシュを返す。"""
+    key = (
+        client_hello.cipher_suites,
+        client_hello.extension_types,
+        *(
+            None if data is None else bytes(data)
+            for data in map(client_hello.extension_data, _FINGERPRINT_EXTENSIONS)
+        ),
+    )
+    cached = _fingerprint_cache.get(key)
+    if cached is None:
+        if len(_fingerprint_cache) >= _FINGERPRINT_CACHE_SIZE:
+            _fingerprint_cache.clear()
+        cached = _fingerprint_cache[key] = (ja3(client_hello), ja4(client_hello))
+    return cached
+
+
+def ja3(client_hello: ClientHello) -> str:
+    """JA3の文字列(ハッシュを取る前のもの)。ハッシュはMD5の16進数。"""
+    point_formats = client_hello.extension_data(EXTENSION_EC_POINT_FORMATS)
+    return ",".join(
+        (
+            str(int(client_hello.protocol_version)),
+            "-".join(map(str, _uint16s(client_hello.cipher_suites, 0))),
+            "-".join(
+                str(extension_type)
+                for extension_type in client_hello.extension_types
+                if not is_grease(extension_type)
+            ),
+            "-".join(
+                map(
+                    str,
+                    _uint16s(client_hello.extension_data(EXTENSION_SUPPORTED_GROUPS)),
+                )
+            ),
+            "-".join(map(str, point_formats[1:])) if point_formats is not None else "",
+        )
+    )
+
+
+def ja4(client_hello: ClientHello, transport: str = "t") -> str:
+    """JA4(FoxIOの仕様)。"""
+    ciphers = _uint16s(client_hello.cipher_suites, 0)
+    extensions = [
+        extension_type
+        for extension_type in client_hello.extension_types
+        if not is_grease(extension_type)
+    ]
+    versions = _uint16s(
+        client_hello.extension_data(ExtensionType.SupportedVersions), 1
+    ) or [int(client_hello.protocol_version)]
+    alpn = "00"
+    alpn_data = client_hello.extension_data(EXTENSION_ALPN)
+    if alpn_data is not None and len(alpn_data) > 3 and alpn_data[2]:
+        first = bytes(alpn_data[3 : 3 + alpn_data[2]])
+        if first[:1].isalnum() and first[-1:].isalnum():
+            alpn = chr(first[0]) + chr(first[-1])
+        else:
+            alpn = first.hex()[0] + first.hex()[-1]
+    ja4_a = (
+        f"{transport}{_JA4_VERSIONS.get(max(versions), '00')}"
+        f"{'d' if ExtensionType.ServerName in extensions else 'i'}"
+        f"{min(len(ciphers), 99):02d}{min(len(extensions), 99):02d}{alpn}"
+    )
+    ja4_b = _truncated_sha256(",".join(f"{cipher:04x}" for cipher in sorted(ciphers)))
+    sorted_extensions = ",".join(
+        f"{extension_type:04x}"
+        for extension_type in sorted(extensions)
+        if extension_type not in (ExtensionType.ServerName, EXTENSION_ALPN)
+    )
+    signature_algorithms = ",".join(
+        f"{algorithm:04x}"
+        for algorithm in _uint16s(
+            client_hello.extension_data(EXTENSION_SIGNATURE_ALGORITHMS)
+        )
+    )
+    if signature_algorithms:
+        sorted_extensions += "_" + signature_algorithms
+    ja4_c = _truncated_sha256(sorted_extensions)
+    return f"{ja4_a}_{ja4_b}_{ja4_c}"
+
+
+def _truncated_sha256(value: str) -> str:
+    if not value:
+        return _EMPTY_HASH
+    return hashlib.sha256(value.encode()).hexdigest()[:12]
+
+
+@dataclass
+class FingerprintCounts:
+    packets: int = 0
+    client_hellos: int = 0
+    # ClientHelloらしいがパースできなかったもの
+    errors: int = 0
+    # JA3の文字列 -> 回数(ハッシュは集計の後で取る)
+    ja3: Counter[str] = field(default_factory=Counter)
+    ja4: Counter[str] = field(default_factory=Counter)
+
+    def __iadd__(self, other: "FingerprintCounts") -> Self:
+        self.packets += other.packets
+        self.client_hellos += other.client_hellos
+        self.errors += other.errors
+        self.ja3.update(other.ja3)
+        self.ja4.update(other.ja4)
+        return self
+
+    def add(self, message: bytes | memoryview) -> None:
+        """ヘッダー込みのClientHelloのハンドシェイクメッセージを数える。"""
+        try:
+            client_hello = ClientHello.from_bytes(
+                memoryview(message)[HANDSHAKE_HEADER_LENGTH:]
+            )
+            ja3_string, ja4_string = fingerprints(client_hello)
+        except (ValueError, IndexError, struct.error):
+            self.errors += 1
+            return
+        self.client_hellos += 1
+        self.ja3[ja3_string] += 1
+        self.ja4[ja4_string] += 1
+
+
+class _Flow:
+    """複数のTCPセグメントに分かれたClientHelloを組み立てている途中のフロー。"""
+
+    __slots__ = ("framer", "next_sequence", "reassembler")
+
+    def __init__(self, next_sequence: int):
+        self.next_sequence = next_sequence
+        self.framer = TlsRecordFramer()
+        self.reassembler = HandshakeReassembler()
+
+    def feed(self, data: bytes) -> bytes | None:
+        """ClientHelloがそろったらそのメッセージを返す。"""
+        self.framer.feed(data)
+        for record in self.framer.records():
+            if record[0] != ContentType.handshake:
+                raise ValueError("ClientHelloの前に別のレコードがあります。")
+            for message in self.reassembler.feed(record[RECORD_HEADER_LENGTH:]):
+                return bytes(message)
+        return None
+
+
+def fingerprint_chunk(path: str, start: int, end: int) -> FingerprintCounts:
+    """[start, end)で始まるパケットのClientHelloを数える。
+
+    endの前に始まったフローのClientHelloが塊をまたぐときは、CHUNK_OVERRUNバイトまで
+    続きを読む。塊の先頭より前に始まったフローの続きは、前の塊の担当なので無視する。
+    """
+    counts = FingerprintCounts()
+    pending: dict[bytes, _Flow] = {}
+    with CaptureFile(path) as capture:
+        buffer = capture.buffer
+        for block, linktype, data, length in capture.packets(start):
+            if block >= end:
+                if not pending or block >= end + CHUNK_OVERRUN:
+                    break
+            else:
+                counts.packets += 1
+            segment = tcp_segment(buffer, linktype, data, length)
+            if segment is None:
+                continue
+            key, sequence, payload, payload_end = segment
+            if payload == payload_end:
+                continue
+            flow = pending.get(key)
+            if flow is None:
+                # handshakeレコードで始まり、中身がClientHelloのものだけを見る
+                if (
+                    block >= end
+                    or payload_end - payload <= RECORD_HEADER_LENGTH
+                    or buffer[payload] != ContentType.handshake
+                    or buffer[payload + 1] != 0x03
+                    or buffer[payload + 5] != HandshakeType.ClientHello
+                ):
+                    continue
+                record_length = (buffer[payload + 3] << 8) | buffer[payload + 4]
+                message_end = (
+                    payload
+                    + RECORD_HEADER_LENGTH
+                    + HANDSHAKE_HEADER_LENGTH
+                    + int.from_bytes(buffer[payload + 6 : payload + 9], "big")
+                )
+                # ほとんどのClientHelloは1つのセグメントの1つのレコードに収まる
+                if (
+                    payload_end - payload
+                    >= RECORD_HEADER_LENGTH + HANDSHAKE_HEADER_LENGTH
+                    and message_end <= payload + RECORD_HEADER_LENGTH + record_length
+                    and message_end <= payload_end
+                ):
+                    counts.add(buffer[payload + RECORD_HEADER_LENGTH : message_end])
+                    continue
+                if len(pending) >= MAX_PENDING_FLOWS:
+                    del pending[next(iter(pending))]
+                flow = pending[key] = _Flow(sequence)
+            if sequence != flow.next_sequence:
+                # 再送や順番の入れ替わりは扱わない
+                continue
+            flow.next_sequence = (sequence + payload_end - payload) & 0xFFFFFFFF
+            try:
+                message = flow.feed(buffer[payload:payload_end])
+            except ValueError:
+                counts.errors += 1
+                del pending[key]
+                continue
+            if message is not None:
+                counts.add(message)
+                del pending[key]
+    return counts
+
+
+def fingerprint_files(
+    paths: list[str], workers: int, chunk_size: int
+) -> FingerprintCounts:
+    chunks: list[tuple[str, int, int]] = []
+    for path in paths:
+        with CaptureFile(path) as capture:
+            chunks.extend(
+                (path, start, end) for start, end in capture.chunks(chunk_size)
+            )
+    counts = FingerprintCounts()
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            counts += fingerprint_chunk(*chunk)
+        return counts
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_counts in executor.map(fingerprint_chunk, *zip(*chunks)):
+            counts += chunk_counts
+    return counts
+
+
+def main(argv: list[str] | None = None, prog: str | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog=prog, description="キャプチャファイルのClientHelloからJA3/JA4を集計する。"
+    )
+    parser.add_argument("paths", nargs="+", help="pcap/pcapngのファイル")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--chunk-size", type=int, default=64, help="1つのワーカーが読む塊(MiB)"
+    )
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", help="すべての集計を書き出すJSONファイル")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = fingerprint_files(args.paths, args.workers, args.chunk_size << 20)
+    elapsed = time.perf_counter() - start
+    print(
+        f"パケット: {counts.packets}  ClientHello: {counts.client_hellos}"
+        f"  エラー: {counts.errors}  経過: {elapsed:.2f}秒"
+        f" ({counts.client_hellos / elapsed * 60:.0f} ClientHello/分)"
+    )
+    print(f"\n{'JA4':<38} {'count':>10}")
+    for fingerprint, count in counts.ja4.most_common(args.top):
+        print(f"{fingerprint:<38} {count:>10}")
+    print(f"\n{'JA3':<34} {'count':>10}")
+    for ja3_string, count in counts.ja3.most_common(args.top):
+        print(f"{hashlib.md5(ja3_string.encode()).hexdigest():<34} {count:>10}")
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps(
+                {
+                    "packets": counts.packets,
+                    "client_hellos": counts.client_hellos,
+                    "errors": counts.errors,
+                    "ja4": dict(counts.ja4.most_common()),
+                    "ja3": {
+                        hashlib.md5(ja3_string.encode()).hexdigest(): {
+                            "string": ja3_string,
+                            "count": count,
+                        }
+                        for ja3_string, count in counts.ja3.most_common()
+                    },
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
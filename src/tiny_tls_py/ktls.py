@@ -0,0 +1,183 @@
+"""ハンドシェイクが終わった接続の送信側のレコード層を、Linuxのカーネル TLS(kTLS)に任せる。
+
+送信のトラフィック鍵をsetsockopt(SOL_TLS, TLS_TX)でソケットに入れると、以降に
+send()やos.sendfile()で書いた平文はカーネルがapplication_dataのレコードにして
+暗号化する。ファイルをユーザー空間に読み込まずに送れて、Pythonでの暗号化もなくなる。
+
+受信側(TLS_RX)はユーザー空間のまま。クライアントから届くのはKeyUpdateやalertのような
+小さいレコードが中心で、カーネルに任せると制御レコードごとにrecvmsg()の
+補助データを見る別の受信経路が要るのに比べて、得るものが少ないため。
+
+tlsモジュールがないカーネルや、鍵を入れられなかったソケットでは、何もせずに
+ユーザー空間のRecordProtectionで暗号化を続ける。
+"""
+
+import errno
+import logging
+import socket
+import struct
+from collections import deque
+from typing import Final
+
+from tiny_tls_py.models.enums import ContentType
+from tiny_tls_py.models.key_schedule import KeySchedule
+from tiny_tls_py.models.record_protection import CIPHER_SUITES, NONCE_LENGTH
+from tiny_tls_py.models.send_queue import IOV_MAX
+
+logger = logging.getLogger(__name__)
+
+# linux/tls.hの定数。socketモジュールにはまだない
+SOL_TLS: Final[int] = 282
+TLS_TX: Final[int] = 1
+TLS_SET_RECORD_TYPE: Final[int] = 1
+TLS_1_3_VERSION: Final[int] = 0x0304
+# 暗号スイート -> (cipher_type, salt(IVのうちレコードごとに変わらない部分)の長さ)
+CIPHER_TYPES: Final[dict[int, tuple[int, int]]] = {
+    0x1301: (51, 4),  # TLS_CIPHER_AES_GCM_128
+    0x1302: (52, 4),  # TLS_CIPHER_AES_GCM_256
+    0x1303: (54, 0),  # TLS_CIPHER_CHACHA20_POLY1305
+}
+# struct tls_crypto_infoのversionとcipher_type(ホストのバイトオーダー)
+_CRYPTO_INFO_HEADER = struct.Struct("=HH")
+# KernelTlsQueueで、送信の鍵を入れ直す位置の印
+_REKEY: Final[int] = -1
+
+_available: bool | None = None
+
+
+def crypto_info(
+    cipher_suite: int, traffic_secret: bytes, sequence_number: int
+) -> bytes:
+    """TLS_TXに渡すstruct tls12_crypto_info_*を作る。
+
+    TLS 1.3のnonceはIV(12バイト)とシーケンス番号のXORだが、カーネルは
+    IVをsalt(先頭)とiv(残り)に分けて受け取る。ChaCha20-Poly1305はsaltなし。
+    """
+    cipher_type, salt_length = CIPHER_TYPES[cipher_suite]
+    _, key_length = CIPHER_SUITES[cipher_suite]
+    key, iv = KeySchedule.traffic_keys(traffic_secret, key_length=key_length)
+    assert len(iv) == NONCE_LENGTH
+    return (
+        _CRYPTO_INFO_HEADER.pack(TLS_1_3_VERSION, cipher_type)
+        + iv[salt_length:]
+        + key
+        + iv[:salt_length]
+        + sequence_number.to_bytes(8, "big")
+    )
+
+
+def install_tx(sock: socket.socket, info: bytes) -> None:
+    """ソケットにtlsのULPを付けて、送信の鍵を入れる。失敗したらOSError。"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_ULP, b"tls")
+    sock.setsockopt(SOL_TLS, TLS_TX, info)
+
+
+def kernel_tls_available() -> bool:
+    """このカーネルでkTLSを使えるか。ループバックの接続で1回だけ確かめる。"""
+    global _available
+    if _available is not None:
+        return _available
+    if not hasattr(socket, "TCP_ULP"):
+        # Linux以外
+        _available = False
+        return _available
+    with (
+        socket.create_server(("127.0.0.1", 0)) as listener,
+        socket.create_connection(listener.getsockname()) as client,
+        listener.accept()[0],
+    ):
+        try:
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_ULP, b"tls")
+            _available = True
+        except OSError as e:
+            # ENOENT: tlsモジュールがない。ENOPROTOOPT: TCP_ULPがない
+            if e.errno not in (errno.ENOENT, errno.ENOPROTOOPT):
+                logger.info("kTLSを確かめられませんでした: %s", e)
+            _available = False
+    return _available
+
+
+class KernelTlsQueue:
+    """TLS_TXを入れたソケット用の送信キュー。
+
+    application_dataは平文のセグメントのまま、連続する分を1回のsendmsg()で書く
+    (カーネルがレコードに分けて暗号化する)。alertやKeyUpdateのような
+    それ以外のレコードは、TLS_SET_RECORD_TYPEの補助データを付けて1つずつ書く。
+    補助データはtransport.writelines()では付けられないので、SendQueueと違って
+    drain()はなく、ソケットに直接send()/send_all()で書く。
+    """
+
+    def __init__(self):
+        # 送るセグメントと種類: (セグメント, content_typeか鍵の入れ替えの_REKEY)
+        self._segments: deque[tuple[memoryview, int]] = deque()
+        self._size = 0
+
+    def __len__(self) -> int:
+        """まだ送っていないバイト数。"""
+        return self._size
+
+    def append(self, data: bytes | bytearray | memoryview) -> None:
+        """application_dataの平文を加える。送り終わるまで書き換えないこと。"""
+        if data:
+            self._segments.append((memoryview(data), ContentType.application_data))
+            self._size += len(data)
+
+    def append_record(self, content_type: ContentType, data: bytes) -> None:
+        view = memoryview(data)
+        self._segments.append((view, content_type))
+        self._size += len(view)
+
+    def append_rekey(self, info: bytes) -> None:
+        """ここまでを送ったら、送信の鍵をinfoに入れ替える(KeyUpdateの後)。"""
+        self._segments.append((memoryview(info), _REKEY))
+
+    def send(self, sock: socket.socket) -> int:
+        """次のレコードか、連続するapplication_dataを書いて、送れたバイト数を返す。"""
+        segments = self._segments
+        view, content_type = segments[0]
+        if content_type == _REKEY:
+            segments.popleft()
+            sock.setsockopt(SOL_TLS, TLS_TX, view)
+            return 0
+        if content_type != ContentType.application_data:
+            segments.popleft()
+            ancillary = [(SOL_TLS, TLS_SET_RECORD_TYPE, bytes((content_type,)))]
+            # 小さいレコードなのでふつうは1回で書ける。途中までしか書けなかったら、
+            # 残りを次のレコードにせず、同じレコードの続きとしてここで書ききる
+            sent = 0
+            while sent < len(view):
+                sent += sock.sendmsg([view[sent:]], ancillary)
+            self._size -= sent
+            return sent
+        # 次のapplication_data以外のレコードの手前までをまとめて書く
+        buffers: list[memoryview] = []
+        for view, content_type in segments:
+            if content_type != ContentType.application_data or len(buffers) == IOV_MAX:
+                break
+            buffers.append(view)
+        sent = sock.sendmsg(buffers)
+        self._consume(sent)
+        return sent
+
+    def send_all(self, sock: socket.socket) -> int:
+        """ブロッキングのソケットに全部送って、send()を呼んだ回数を返す。"""
+        calls = 0
+        while self._segments:
+            self.send(sock)
+            calls += 1
+        return calls
+
+    def clear(self) -> None:
+        self._segments.clear()
+        self._size = 0
+
+    def _consume(self, size: int) -> None:
+        self._size -= size
+        segments = self._segments
+        while size:
+            view, content_type = segments[0]
+            if len(view) > size:
+                segments[0] = (view[size:], content_type)
+                return
+            size -= len(view)
+            segments.popleft()
@@ -0,0 +1,243 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import ClassVar, Final
+
+logger = logging.getLogger(__name__)
+
+# フェーズの時間(秒)のヒストグラムのバケット。10µsから10秒まで
+PHASE_BUCKETS: Final[tuple[float, ...]] = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# カウンターの名前 -> HELPに出す説明
+COUNTERS: Final[dict[str, str]] = {
+    "connections": "受け付けた接続の数",
+    "records": "受信したTLSRecordの数",
+    "bytes_received": "受信したバイト数",
+    "bytes_sent": "送信したバイト数",
+    "handshakes": "ServerHelloまで返したハンドシェイクの数",
+    "completed_handshakes": "クライアントのFinishedまで検証したハンドシェイクの数",
+    "resumed_handshakes": "チケットで再開したハンドシェイクの数",
+    "connection_errors": "エラーで切断した接続の数",
+    "timeouts": "タイムアウトで切断した接続の数",
+    "rejected_client_hellos": "モデルにする前のチェックで断ったClientHelloの数",
+    "rate_limited_connections": "送信元IPごとの接続数の制限で断った接続の数",
+    "rate_limited_handshakes": "送信元IPごとのハンドシェイク数の制限で断った接続の数",
+    "shed_handshakes": "過負荷で処理待ちが溢れたので断ったハンドシェイクの数",
+    "alerts_sent": "alertを送って切断した接続の数",
+    "ktls_connections": "送信の暗号化をkTLSに任せた接続の数",
+    "ktls_fallbacks": "kTLSに鍵を入れられず、ユーザー空間で暗号化を続けた接続の数",
+}
+
+PROMETHEUS_CONTENT_TYPE: Final[str] = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Prometheusのhistogramと同じ形の、固定バケットのヒストグラム。
+
+    observe()はバケットを二分探索して数を1つ増やすだけなので、
+    ハンドシェイクごとに何回呼んでもほとんどコストにならない。
+    ThreadedServerのスレッドが同時に足しても取りこぼさないように、
+    3つの値はロックを取って一緒に更新する。
+    """
+
+    __slots__ = ("_lock", "buckets", "count", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...] = PHASE_BUCKETS):
+        self.buckets = buckets
+        # 最後の要素は+Infのバケット
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+
+class Metrics:
+    """プロセスごとのカウンターと、ハンドシェイクのフェーズごとのヒストグラム。
+
+    フェーズの時間はtime.perf_counter()の差で測って observe() に渡す。
+    counters[name] += valueは読んでから書くまでの間に別のスレッドが割り込めるので
+    (GILがあっても)、ThreadedServerで取りこぼさないようにロックを取って足す。
+    書き出すときはロックを取らないので、書き出し中に更新されると少しずれた値が
+    出ることはあるが、ハンドシェイクの処理を止めることはない。
+    """
+
+    counters: ClassVar[dict[str, int]] = dict.fromkeys(COUNTERS, 0)
+    phases: ClassVar[dict[str, Histogram]] = {}
+    _lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def count(cls, name: str, value: int = 1) -> None:
+        with cls._lock:
+            cls.counters[name] += value
+
+    @classmethod
+    def observe(cls, phase: str, seconds: float) -> None:
+        histogram = cls.phases.get(phase)
+        if histogram is None:
+            # 別のスレッドが先に作っていたら、そちらを使う
+            histogram = cls.phases.setdefault(phase, Histogram())
+        histogram.observe(seconds)
+
+    @classmethod
+    def reset(cls) -> None:
+        """fork直後のワーカーのように、親の値を引き継ぎたくないときに呼ぶ。"""
+        cls.counters = dict.fromkeys(COUNTERS, 0)
+        cls.phases = {}
+        # forkしたときに親の別のスレッドが持っていたロックは、子では外れない
+        cls._lock = threading.Lock()
+
+    @classmethod
+    def render(cls) -> str:
+        """Prometheusのテキスト形式で書き出す。"""
+        lines = [
+            "# HELP tiny_tls_phase_seconds ハンドシェイクの各フェーズにかかった時間",
+            "# TYPE tiny_tls_phase_seconds histogram",
+        ]
+        for phase, histogram in list(cls.phases.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'tiny_tls_phase_seconds_bucket{{phase="{phase}",le="{bound}"}}'
+                    f" {cumulative}"
+                )
+            lines.append(
+                f'tiny_tls_phase_seconds_bucket{{phase="{phase}",le="+Inf"}}'
+                f" {histogram.count}"
+            )
+            lines.append(
+                f'tiny_tls_phase_seconds_sum{{phase="{phase}"}} {histogram.sum}'
+            )
+            lines.append(
+                f'tiny_tls_phase_seconds_count{{phase="{phase}"}} {histogram.count}'
+            )
+        for name, value in list(cls.counters.items()):
+            lines.append(f"# HELP tiny_tls_{name}_total {COUNTERS[name]}")
+            lines.append(f"# TYPE tiny_tls_{name}_total counter")
+            lines.append(f"tiny_tls_{name}_total {value}")
+        lines.extend(cls._library_stats())
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def _library_stats(cls) -> list[str]:
+        # KeyServiceやTlsHandshakeProcessorはこのモジュールを使うので、ここで読み込む
+        from tiny_tls_py.connection import TlsConnection
+        from tiny_tls_py.models.key_service import KeyService
+        from tiny_tls_py.models.tls_handshake_processor import TlsHandshakeProcessor
+
+        lines = []
+        if KeyService.key_pool is not None:
+            stats = KeyService.key_pool.stats
+            lines += [
+                "# TYPE tiny_tls_key_pool_hits_total counter",
+                f"tiny_tls_key_pool_hits_total {stats.hits}",
+                "# TYPE tiny_tls_key_pool_misses_total counter",
+                f"tiny_tls_key_pool_misses_total {stats.misses}",
+                "# TYPE tiny_tls_key_pool_depth gauge",
+                f"tiny_tls_key_pool_depth {stats.depth}",
+            ]
+        buffer_stats = TlsConnection.buffer_pool.stats
+        for name in ("allocated", "in_use", "free"):
+            lines += [
+                f"# TYPE tiny_tls_recv_buffers_{name} gauge",
+                f"tiny_tls_recv_buffers_{name} {getattr(buffer_stats, name)}",
+            ]
+        if TlsHandshakeProcessor.session_tickets is not None:
+            ticket_stats = TlsHandshakeProcessor.session_tickets.stats()
+            for name in ("issued", "cache_hits", "cache_misses", "rejected"):
+                lines += [
+                    f"# TYPE tiny_tls_tickets_{name}_total counter",
+                    f"tiny_tls_tickets_{name}_total {getattr(ticket_stats, name)}",
+                ]
+        return lines
+
+    @classmethod
+    def dump(cls, path: str) -> None:
+        """pathにrender()の結果を書く。読む側が途中までの内容を見ないように置き換える。"""
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(cls.render())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def start_exporters(
+        cls, port: int | None, dump_path: str | None, dump_interval: float
+    ) -> None:
+        """portを指定すると/metricsをHTTPで返し、dump_pathを指定すると定期的に書き出す。"""
+        if port is not None:
+            # http.serverは読み込みが重いので、公開するときにだけ読み込む
+            from http.server import ThreadingHTTPServer
+
+            server = ThreadingHTTPServer(("127.0.0.1", port), _metrics_handler())
+            threading.Thread(
+                target=server.serve_forever, name="metrics-http", daemon=True
+            ).start()
+            logger.info("メトリクスを http://127.0.0.1:%d/metrics で公開します。", port)
+        if dump_path is not None:
+            threading.Thread(
+                target=cls._dump_forever,
+                args=(dump_path, dump_interval),
+                name="metrics-dump",
+                daemon=True,
+            ).start()
+
+    @classmethod
+    def _dump_forever(cls, path: str, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                cls.dump(path)
+            except OSError as e:
+                logger.warning("メトリクスを書き出せませんでした: %s", e)
+
+
+def _metrics_handler() -> type:
+    """/metricsを返すBaseHTTPRequestHandlerのクラス。"""
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = Metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # スクレイプのたびにアクセスログを出さない
+            pass
+
+    return _MetricsHandler
@@ -0,0 +1,36 @@
+from functools import cache
+
+from tiny_tls_py.models.enums import (
+    AlertDescription,
+    AlertLevel,
+    ContentType,
+    ProtocolVersion,
+)
+
+
+class TlsAlert(ValueError):
+    """ハンドシェイクを中断して、descriptionのalertを送るべきエラー。
+
+    これまでのValueErrorを捕まえているところでもそのまま扱えるように、
+    ValueErrorのサブクラスにしてある。
+    """
+
+    def __init__(self, description: AlertDescription, message: str):
+        super().__init__(message)
+        self.description = description
+
+
+@cache
+def alert_record(
+    description: AlertDescription, level: AlertLevel = AlertLevel.fatal
+) -> bytes:
+    """平文のalertレコード(RFC 8446 6)。種類は少ないので作ったものは使い回す。
+
+    ハンドシェイクの鍵ができる前にしか使えない。
+    """
+    return (
+        ContentType.alert.to_bytes(1, "big")
+        + ProtocolVersion.TLS_1_2.to_bytes(2, "big")
+        + b"\x00\x02"
+        + bytes((level, description))
+    )
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from typing import Final
+
+# 最大のTLSRecord(ヘッダー込みで2^14 + 256 + 5バイト)が1つ入り、
+# 小さいレコードならいくつかまとめて読める大きさ
+RECV_BUFFER_SIZE: Final[int] = 2**15
+
+
+@dataclass(frozen=True)
+class BufferPoolStats:
+    # これまでに確保したバッファの数
+    allocated: int
+    # 接続が使っているバッファの数
+    in_use: int
+    # プールに戻っていて、次のacquire()で使い回せるバッファの数
+    free: int
+
+
+class BufferPool:
+    """接続の受信に使う、同じ大きさのbytearrayのプール。
+
+    受信バッファは読み残しがある間だけ接続が持ち、空になったら(または
+    接続を閉じたら)プールに返す。アイドルな接続はバッファを持たないので、
+    接続の数が増えてもメモリは同時にデータを受信している接続の分しか使わない。
+
+    ロックは取らない。list.pop()とappend()はそれぞれアトミックなので、
+    ThreadedServerのように複数のスレッドから使ってもバッファを二重に
+    貸すことはないが、statsの数は少しずれることがある。
+    """
+
+    def __init__(self, buffer_size: int = RECV_BUFFER_SIZE, max_free: int = 1024):
+        self.buffer_size = buffer_size
+        # プールに残しておくバッファの上限。超えた分は捨ててGCに任せる
+        self.max_free = max_free
+        self._free: list[bytearray] = []
+        self._allocated = 0
+        self._in_use = 0
+
+    def acquire(self) -> bytearray:
+        self._in_use += 1
+        try:
+            # 空かを確かめてからpop()すると、その間に別のスレッドが取ることがある
+            return self._free.pop()
+        except IndexError:
+            pass
+        self._allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray) -> None:
+        self._in_use -= 1
+        if len(self._free) < self.max_free:
+            self._free.append(buffer)
+
+    @property
+    def stats(self) -> BufferPoolStats:
+        return BufferPoolStats(self._allocated, self._in_use, len(self._free))
@@ -0,0 +1,224 @@
+import datetime
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Final, Self
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, padding, rsa
+from cryptography.x509.oid import NameOID
+
+from tiny_tls_py.models.enums import HandshakeType
+
+# RFC 8446 4.4.3: 署名する内容は64個の空白 + コンテキスト文字列 + 0x00 + Transcript-Hash
+SERVER_SIGNATURE_CONTEXT: Final[bytes] = (
+    b" " * 64 + b"TLS 1.3, server CertificateVerify" + b"\x00"
+)
+
+# SignatureScheme(RFC 8446 4.2.3)
+ECDSA_SECP256R1_SHA256: Final[int] = 0x0403
+ECDSA_SECP384R1_SHA384: Final[int] = 0x0503
+ECDSA_SECP521R1_SHA512: Final[int] = 0x0603
+RSA_PSS_RSAE_SHA256: Final[int] = 0x0804
+ED25519: Final[int] = 0x0807
+ED448: Final[int] = 0x0808
+
+# 曲線の名前 -> (SignatureScheme, ハッシュ)
+_ECDSA_SCHEMES: Final[dict[str, tuple[int, type[hashes.HashAlgorithm]]]] = {
+    "secp256r1": (ECDSA_SECP256R1_SHA256, hashes.SHA256),
+    "secp384r1": (ECDSA_SECP384R1_SHA384, hashes.SHA384),
+    "secp521r1": (ECDSA_SECP521R1_SHA512, hashes.SHA512),
+}
+
+PrivateKey = (
+    ed25519.Ed25519PrivateKey
+    | ed448.Ed448PrivateKey
+    | ec.EllipticCurvePrivateKey
+    | rsa.RSAPrivateKey
+)
+
+# generate_self_signed()で選べるアルゴリズム
+KEY_ALGORITHMS: Final[tuple[str, ...]] = (
+    "ed25519",
+    "ed448",
+    "ecdsa-p256",
+    "ecdsa-p384",
+    "rsa-2048",
+    "rsa-3072",
+    "rsa-4096",
+)
+
+
+def signature_scheme(private_key: PrivateKey) -> int:
+    """秘密鍵の種類から、CertificateVerifyで使うSignatureSchemeを決める。"""
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return ED25519
+    if isinstance(private_key, ed448.Ed448PrivateKey):
+        return ED448
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        if private_key.curve.name not in _ECDSA_SCHEMES:
+            raise ValueError(f"Unsupported curve: {private_key.curve.name}")
+        return _ECDSA_SCHEMES[private_key.curve.name][0]
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        # TLS 1.3のCertificateVerifyではPKCS#1 v1.5は使えない
+        return RSA_PSS_RSAE_SHA256
+    raise TypeError(f"Unsupported private key: {type(private_key).__name__}")
+
+
+def generate_private_key(algorithm: str) -> PrivateKey:
+    match algorithm:
+        case "ed25519":
+            return ed25519.Ed25519PrivateKey.generate()
+        case "ed448":
+            return ed448.Ed448PrivateKey.generate()
+        case "ecdsa-p256":
+            return ec.generate_private_key(ec.SECP256R1())
+        case "ecdsa-p384":
+            return ec.generate_private_key(ec.SECP384R1())
+        case "rsa-2048" | "rsa-3072" | "rsa-4096":
+            return rsa.generate_private_key(65537, int(algorithm.split("-")[1]))
+        case _:
+            raise ValueError(f"Unsupported key algorithm: {algorithm}")
+
+
+@dataclass(frozen=True, slots=True)
+class ServerCredentials:
+    """サーバーの証明書チェーンと秘密鍵。起動時に1回だけ作る。
+
+    Certificateのハンドシェイクメッセージは証明書が変わらない限り同じなので、
+    作るときに1回だけエンコードしておき、接続ごとにはCertificateVerifyの
+    署名だけを計算する。
+    """
+
+    # DERの証明書。先頭がサーバーの証明書で、その後ろが中間CA
+    chain: tuple[bytes, ...]
+    private_key: PrivateKey
+    signature_scheme: int
+    # ハンドシェイクヘッダー込みのCertificateメッセージ
+    certificate_message: bytes
+
+    @classmethod
+    def from_chain(cls, chain: list[x509.Certificate], private_key: PrivateKey) -> Self:
+        if not chain:
+            raise ValueError("証明書がありません。")
+        if chain[0].public_key().public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ) != private_key.public_key().public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ):
+            raise ValueError("秘密鍵がサーバーの証明書と対応していません。")
+        der_chain = tuple(
+            certificate.public_bytes(serialization.Encoding.DER)
+            for certificate in chain
+        )
+        return cls(
+            der_chain,
+            private_key,
+            signature_scheme(private_key),
+            cls.encode_certificate(der_chain),
+        )
+
+    @classmethod
+    def from_files(
+        cls,
+        certificate_path: str | Path,
+        key_path: str | Path,
+        password: bytes | None = None,
+    ) -> Self:
+        """PEMの証明書チェーンと秘密鍵を読み込む。"""
+        chain = x509.load_pem_x509_certificates(Path(certificate_path).read_bytes())
+        private_key = serialization.load_pem_private_key(
+            Path(key_path).read_bytes(), password
+        )
+        if not isinstance(private_key, PrivateKey):
+            raise TypeError(f"Unsupported private key: {type(private_key).__name__}")
+        return cls.from_chain(chain, private_key)
+
+    @classmethod
+    def generate_self_signed(
+        cls, algorithm: str = "ed25519", common_name: str = "localhost"
+    ) -> Self:
+        """開発やベンチマーク用の自己署名証明書を作る。"""
+        private_key = generate_private_key(algorithm)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+        now = datetime.datetime.now(datetime.UTC)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(private_key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=30))
+            .add_extension(
+                x509.SubjectAlternativeName([x509.DNSName(common_name)]),
+                critical=False,
+            )
+            .sign(
+                private_key,
+                None
+                if isinstance(
+                    private_key, (ed25519.Ed25519PrivateKey, ed448.Ed448PrivateKey)
+                )
+                else hashes.SHA256(),
+            )
+        )
+        return cls.from_chain([certificate], private_key)
+
+    @staticmethod
+    def encode_certificate(chain: tuple[bytes, ...]) -> bytes:
+        """Certificateのハンドシェイクメッセージ(RFC 8446 4.4.2)を作る。
+
+        struct {
+            opaque cert_data<1..2^24-1>;
+            Extension extensions<0..2^16-1>;
+        } CertificateEntry;
+
+        struct {
+            opaque certificate_request_context<0..2^8-1>;
+            CertificateEntry certificate_list<0..2^24-1>;
+        } Certificate;
+        """
+        certificate_list = b"".join(
+            len(certificate).to_bytes(3, "big") + certificate + b"\x00\x00"
+            for certificate in chain
+        )
+        body = b"\x00" + len(certificate_list).to_bytes(3, "big") + certificate_list
+        return (
+            HandshakeType.Certificate.to_bytes(1, "big")
+            + len(body).to_bytes(3, "big")
+            + body
+        )
+
+    def sign(self, transcript_hash: bytes) -> bytes:
+        """Certificateまでのtranscriptに対するCertificateVerifyの署名。"""
+        content = SERVER_SIGNATURE_CONTEXT + transcript_hash
+        private_key = self.private_key
+        if isinstance(private_key, (ed25519.Ed25519PrivateKey, ed448.Ed448PrivateKey)):
+            return private_key.sign(content)
+        if isinstance(private_key, ec.EllipticCurvePrivateKey):
+            _, hash_class = _ECDSA_SCHEMES[private_key.curve.name]
+            return private_key.sign(content, ec.ECDSA(hash_class()))
+        return private_key.sign(
+            content,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=hashes.SHA256.digest_size,
+            ),
+            hashes.SHA256(),
+        )
+
+    def certificate_verify_message(self, signature: bytes) -> bytes:
+        """署名からCertificateVerifyのハンドシェイクメッセージを作る。"""
+        body = (
+            self.signature_scheme.to_bytes(2, "big")
+            + len(signature).to_bytes(2, "big")
+            + signature
+        )
+        return (
+            HandshakeType.CertificateVerify.to_bytes(1, "big")
+            + len(body).to_bytes(3, "big")
+            + body
+        )
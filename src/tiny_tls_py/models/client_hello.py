@@ -1,6 +1,6 @@
-from enum import Enum, IntEnum
+from enum import IntEnum
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from tiny_tls_py.models.extension import (
     Extension,
@@ -22,20 +22,22 @@ class ClientHello(BaseModel):
     extensions: list[Extension]
     # _originalはTranscript-Hashの導出に使うらしい
     # クラス内でしか使わない気がするからアンダースコアをつけた
-    _original_data: bytes
+    _original_data: bytes = PrivateAttr()
 
     @classmethod
-    def from_bytes(cls, data: bytes) -> "ClientHello":
-        if int.from_bytes(data[:2], "big") not in ProtocolVersion:
-            raise ValueError(f"Unsupported protocol version: {data[:2]}")
-        protocol_version = ProtocolVersion(int.from_bytes(data[:2]))
+    def from_bytes(cls, data: bytes | memoryview) -> "ClientHello":
+        # 各フィールドはmemoryviewのオフセットで読み、モデルに入れるときだけbytesにする
+        view = memoryview(data)
+        if int.from_bytes(view[:2], "big") not in ProtocolVersion:
+            raise ValueError(f"Unsupported protocol version: {bytes(view[:2])}")
+        protocol_version = ProtocolVersion(int.from_bytes(view[:2], "big"))
 
-        random = data[2:34]
-        session_id_length = data[34]
-        session_id = data[35 : 35 + session_id_length]
+        random = bytes(view[2:34])
+        session_id_length = view[34]
+        session_id = bytes(view[35 : 35 + session_id_length])
         cipher_suites_length_start_index = 35 + session_id_length
         cipher_suites_length = int.from_bytes(
-            data[
+            view[
                 cipher_suites_length_start_index : cipher_suites_length_start_index + 2
             ],
             "big",
@@ -43,38 +45,41 @@ class ClientHello(BaseModel):
         cipher_suites_end_index = (
             cipher_suites_length_start_index + 2 + cipher_suites_length
         )
-        cipher_suites = data[
-            cipher_suites_length_start_index + 2 : cipher_suites_end_index
-        ]
+        cipher_suites = bytes(
+            view[cipher_suites_length_start_index + 2 : cipher_suites_end_index]
+        )
         # NOTE:
         extensions_length_start_index = cipher_suites_end_index + 2
         extensions_length = int.from_bytes(
-            data[extensions_length_start_index : extensions_length_start_index + 2],
+            view[extensions_length_start_index : extensions_length_start_index + 2],
             "big",
         )
         extensions_start_index = extensions_length_start_index + 2
-        extensions = data[
+        extensions = view[
             extensions_start_index : extensions_start_index + extensions_length
         ]
-        return cls(
+        client_hello = cls(
             protocol_version=protocol_version,
             session_id=session_id,
             random=random,
             cipher_suites=cipher_suites,
             extensions=cls.parse_extensions(extensions),
-            _original_data=data,
         )
+        # プライベート属性はコンストラクタでは渡せないので後から入れる
+        client_hello._original_data = bytes(view)
+        return client_hello
 
     @classmethod
-    def parse_extensions(cls, data: bytes) -> list[Extension]:
+    def parse_extensions(cls, data: bytes | memoryview) -> list[Extension]:
+        view = memoryview(data)
         extensions: list[Extension] = []
         offset = 0
-        while offset < len(data):
+        while offset < len(view):
             extension_type = ExtensionType(
-                int.from_bytes(data[offset : offset + 2], "big")
+                int.from_bytes(view[offset : offset + 2], "big")
             )
-            length = int.from_bytes(data[offset + 2 : offset + 4], "big")
-            extension_data = data[offset + 4 : offset + 4 + length]
+            length = int.from_bytes(view[offset + 2 : offset + 4], "big")
+            extension_data = view[offset + 4 : offset + 4 + length]
             if extension_type == ExtensionType.SupportedVersions:
                 extension = Extension(
                     extension_type=extension_type,
@@ -88,11 +93,17 @@ class ClientHello(BaseModel):
             else:
                 extension = Extension(
                     extension_type=extension_type,
-                    data=extension_data,
+                    data=bytes(extension_data),
                 )
             offset += 4 + length
             extensions.append(extension)
         return extensions
 
+    def extension(self, extension_type: ExtensionType) -> Extension | None:
+        # wire.client_hello.ClientHelloと同じAPI。こちらは全部デコード済みなので線形に探す
+        return next(
+            (x for x in self.extensions if x.extension_type == extension_type), None
+        )
+
     def bytes(self) -> bytes:
         return self._original_data
@@ -0,0 +1,113 @@
+"""ハンドシェイクの重い計算を任せる先(CryptoExecutor)。KeyServiceの鍵交換はここを通る。
+
+    inline   呼んだスレッドでその場で計算する(デフォルト)
+    thread   スレッドプールで計算する。cryptographyがGILを外して計算する処理なら、
+             呼び出し元と並列に走る
+    process  プロセスプールで計算する。GILがあっても並列に走るが、引数と戻り値は
+             pickleしてプロセス間で受け渡すので、1回ごとに往復のコストがかかる
+
+processではX25519の秘密鍵をワーカーから持ち帰らない(読み込み直すと生成より
+重いため)。KeyService.key_exchange()は鍵生成と鍵交換とHKDF-Extractをワーカーで
+一度に済ませて、公開鍵と導出したシークレットだけを受け取る。
+
+asyncioサーバーはsubmit()のFutureを待つ間、その接続の受信を止めて
+ほかの接続を処理する。同期サーバーはrun()で終わるまで待つ。
+"""
+
+import os
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Final, TypeVar
+
+T = TypeVar("T")
+
+
+class CryptoExecutor:
+    """その場で計算するCryptoExecutor。ほかのバックエンドはこれを継承する。"""
+
+    name = "inline"
+    # 呼び出し元とメモリを共有するか。Falseなら関数と引数はpickleできるものだけ
+    shares_memory = True
+    # submit()が計算をほかのスレッドやプロセスに任せて、すぐに戻るか
+    offloads = False
+
+    def __init__(self, workers: int = 0):
+        # その場で計算するので、workersは使わない
+        pass
+
+    def run(self, function: Callable[..., T], *args) -> T:
+        """function(*args)を計算して、終わるまで待って結果を返す。"""
+        return function(*args)
+
+    def submit(self, function: Callable[..., T], *args) -> Future:
+        """function(*args)のFuture。asyncioからはasyncio.wrap_future()で待つ。"""
+        future: Future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:  # noqa: BLE001 呼び出し元がresult()で受け取る
+            future.set_exception(e)
+        return future
+
+    def close(self) -> None:
+        pass
+
+
+class ThreadPoolCryptoExecutor(CryptoExecutor):
+    name = "thread"
+    offloads = True
+
+    def __init__(self, workers: int):
+        self._executor: Executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="crypto"
+        )
+
+    def run(self, function: Callable[..., T], *args) -> T:
+        return self._executor.submit(function, *args).result()
+
+    def submit(self, function: Callable[..., T], *args) -> Future:
+        return self._executor.submit(function, *args)
+
+    def close(self) -> None:
+        # 計算は短いので、終わるのを待ってもすぐ戻る
+        self._executor.shutdown(cancel_futures=True)
+
+
+class ProcessPoolCryptoExecutor(ThreadPoolCryptoExecutor):
+    name = "process"
+    shares_memory = False
+
+    def __init__(self, workers: int):
+        # multiprocessingは読み込みが重いので、processを選んだときにだけ読み込む
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # 鍵プールやメトリクスのスレッドがあるプロセスからforkしないように、
+        # forkserverがあればそこからワーカーを起動する
+        methods = multiprocessing.get_all_start_methods()
+        self._executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            ),
+        )
+
+
+# ServerConfig.CRYPTO_EXECUTORに書く名前 -> クラス
+CRYPTO_EXECUTORS: Final[dict[str, type[CryptoExecutor]]] = {
+    executor.name: executor
+    for executor in (
+        CryptoExecutor,
+        ThreadPoolCryptoExecutor,
+        ProcessPoolCryptoExecutor,
+    )
+}
+
+
+def create_crypto_executor(name: str, workers: int = 0) -> CryptoExecutor:
+    """workersが0ならCPUの数だけのプールにする(inlineでは使わない)。"""
+    executor_class = CRYPTO_EXECUTORS.get(name)
+    if executor_class is None:
+        raise ValueError(f"Unknown crypto executor: {name}")
+    if executor_class is CryptoExecutor:
+        return CryptoExecutor()
+    return executor_class(workers or os.cpu_count() or 1)
@@ -0,0 +1,78 @@
+from enum import IntEnum
+
+
+class ContentType(IntEnum):
+    invalid = 0
+    change_cipher_spec = 20
+    alert = 21
+    handshake = 22
+    application_data = 23
+
+
+class ProtocolVersion(IntEnum):
+    TLS_1_0 = 0x0301
+    TLS_1_1 = 0x0302
+    TLS_1_2 = 0x0303
+    TLS_1_3 = 0x0304
+
+
+class HandshakeType(IntEnum):
+    ClientHello = 1
+    ServerHello = 2
+    NewSessionTicket = 4
+    EndOfEarlyData = 5
+    EncryptedExtensions = 8
+    Certificate = 11
+    CertificateRequest = 13
+    CertificateVerify = 15
+    Finished = 20
+    KeyUpdate = 24
+    MessageHash = 254
+
+
+class AlertLevel(IntEnum):
+    warning = 1
+    fatal = 2
+
+
+class AlertDescription(IntEnum):
+    close_notify = 0
+    unexpected_message = 10
+    bad_record_mac = 20
+    record_overflow = 22
+    handshake_failure = 40
+    illegal_parameter = 47
+    decode_error = 50
+    decrypt_error = 51
+    protocol_version = 70
+    internal_error = 80
+    missing_extension = 109
+
+
+class KeyUpdateRequest(IntEnum):
+    update_not_requested = 0
+    update_requested = 1
+
+
+class PskKeyExchangeMode(IntEnum):
+    # PSKだけで鍵を決める。ECDHEをしないのでforward secrecyはない
+    psk_ke = 0
+    # PSKとECDHEを組み合わせる
+    psk_dhe_ke = 1
+
+
+class ExtensionType(IntEnum):
+    ServerName = 0x0000
+    RecordSizeLimit = 0x001C
+    PreSharedKey = 0x0029
+    SupportedVersions = 0x002B
+    PskKeyExchangeModes = 0x002D
+    KeyShare = 0x0033
+
+    @classmethod
+    def _missing_(cls, value):
+        # 未定義値でもそのままインスタンス化
+        obj = int.__new__(cls, value)
+        obj._name_ = None  # 名前は存在しない
+        obj._value_ = value
+        return obj
@@ -1,23 +1,9 @@
 from dataclasses import dataclass
-from enum import IntEnum
 from typing import Final, Self, Union, final
 
 from pydantic import BaseModel
 
-
-class ExtensionType(IntEnum):
-    ServerName = 0x0000
-    PreSharedKey = 0x0029
-    SupportedVersions = 0x002B
-    KeyShare = 0x0033
-
-    @classmethod
-    def _missing_(cls, value):
-        # 未定義値でもそのままインスタンス化
-        obj = int.__new__(cls, value)
-        obj._name_ = None  # 名前は存在しない
-        obj._value_ = value
-        return obj
+from tiny_tls_py.models.enums import ExtensionType
 
 
 class Extension(BaseModel):
@@ -25,10 +11,11 @@ class Extension(BaseModel):
     data: Union[bytes, "SupportedVersion", "KeyShare"]
 
     @classmethod
-    def from_bytes(cls, data: bytes) -> Self:
-        extension_type = ExtensionType(int.from_bytes(data[:2], "big"))
-        length = int.from_bytes(data[2:4], "big")
-        raw_extension_data = data[4 : 4 + length]
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        extension_type = ExtensionType(int.from_bytes(view[:2], "big"))
+        length = int.from_bytes(view[2:4], "big")
+        raw_extension_data = view[4 : 4 + length]
         match extension_type:
             case ExtensionType.SupportedVersions:
                 return cls(
@@ -58,8 +45,8 @@ class SupportedVersion(BaseModel):
     version: bytes
 
     @classmethod
-    def from_bytes(cls, data: bytes) -> Self:
-        return cls(version=data)
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        return cls(version=bytes(data))
 
     def bytes(self) -> bytes:
         return self.version
@@ -70,19 +57,19 @@ class KeyShare(BaseModel):
     entries: list["KeyShareEntry"]
 
     @classmethod
-    def from_bytes(cls, data: bytes) -> Self:
-        length = int.from_bytes(data[0:2], "big")
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        length = int.from_bytes(view[0:2], "big")
         entries: list[KeyShareEntry] = []
         offset: int = 2
 
         # 最初の2バイトが長さ
         # length以外はデータ
-        while offset < len(data[offset:]):
+        while offset < len(view):
             # 本来は2バイトでx25519, secp256r1などのグループを識別するが、
             # tiny-tls-pyではed25519のみをサポート
-            group = data[offset : offset + 2]
-            entry_length = int.from_bytes(data[offset + 2 : offset + 4], "big")
-            entry = KeyShareEntry.from_bytes(data[offset : offset + 4 + entry_length])
+            entry_length = int.from_bytes(view[offset + 2 : offset + 4], "big")
+            entry = KeyShareEntry.from_bytes(view[offset : offset + 4 + entry_length])
             entries.append(entry)
             offset += 4 + entry_length
         return cls(length=length, entries=entries)
@@ -111,14 +98,15 @@ class KeyShareEntry(BaseModel):
     key_exchange: bytes
 
     @classmethod
-    def from_bytes(cls, data: bytes) -> Self:
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
         # 最初の2バイトがグループ
-        group = data[:2]
+        group = bytes(view[:2])
         # 次の2バイトが長さ
         # const length = data.readUInt16BE(2);
-        length = int.from_bytes(data[2:4], "big")
+        length = int.from_bytes(view[2:4], "big")
         # 次のlengthバイトがkeyExchange
-        key_exchange = data[4 : 4 + length]
+        key_exchange = bytes(view[4 : 4 + length])
         return cls(group=group, length=length, key_exchange=key_exchange)
 
     def bytes(self) -> bytes:
@@ -0,0 +1,281 @@
+import hashlib
+import hmac
+from dataclasses import dataclass
+from functools import cache
+from typing import Final, Self
+
+# TLS_AES_256_GCM_SHA384(ServerHelloで選んでいる暗号スイート)のハッシュ
+HASH_NAME: Final[str] = "sha384"
+HASH_LENGTH: Final[int] = 48
+# TLS_AES_256_GCM_SHA384の鍵とIVの長さ
+KEY_LENGTH: Final[int] = 32
+IV_LENGTH: Final[int] = 12
+
+ZERO_SECRET: Final[bytes] = bytes(HASH_LENGTH)
+# Transcript-Hash("")
+EMPTY_TRANSCRIPT_HASH: Final[bytes] = hashlib.new(HASH_NAME, b"").digest()
+
+
+def hkdf_extract(salt: bytes, ikm: bytes) -> bytes:
+    # RFC 5869: HKDF-Extract(salt, IKM) = HMAC-Hash(salt, IKM)
+    return hmac.digest(salt, ikm, HASH_NAME)
+
+
+@cache
+def hkdf_label_prefix(label: bytes, length: int) -> bytes:
+    """HkdfLabelのうち、コンテキストより前の部分。ラベルと長さごとに1回だけ作る。
+
+    struct {
+        uint16 length = Length;
+        opaque label<7..255> = "tls13 " + Label;
+        opaque context<0..255> = Context;
+    } HkdfLabel;
+    """
+    full_label = b"tls13 " + label
+    return length.to_bytes(2, "big") + len(full_label).to_bytes(1, "big") + full_label
+
+
+def hkdf_expand_label(
+    secret: bytes, label: bytes, context: bytes, length: int
+) -> bytes:
+    info = hkdf_label_prefix(label, length) + len(context).to_bytes(1, "big") + context
+    # RFC 5869: T(i) = HMAC-Hash(PRK, T(i-1) | info | i)
+    output = b""
+    block = b""
+    counter = 1
+    while len(output) < length:
+        block = hmac.digest(secret, block + info + bytes([counter]), HASH_NAME)
+        output += block
+        counter += 1
+    return output[:length]
+
+
+def derive_secret(secret: bytes, label: bytes, transcript_hash: bytes) -> bytes:
+    return hkdf_expand_label(secret, label, transcript_hash, HASH_LENGTH)
+
+
+def extract_handshake_secrets(
+    handshake_salt: bytes, shared_secret: bytes
+) -> tuple[bytes, bytes]:
+    """(Handshake Secret, Master Secret)を返す。
+
+    transcriptを使わないので、鍵交換と一緒にcrypto_executorのスレッドや
+    プロセスで計算できる(KeyService.key_exchange())。
+    """
+    handshake_secret = hkdf_extract(handshake_salt, shared_secret)
+    master_secret = hkdf_extract(
+        derive_secret(handshake_secret, b"derived", EMPTY_TRANSCRIPT_HASH),
+        ZERO_SECRET,
+    )
+    return handshake_secret, master_secret
+
+
+# PSKを使わないときのEarly Secretと、そこから導出するsaltは毎回同じなので
+# プロセスで1回だけ計算しておく
+EARLY_SECRET_WITHOUT_PSK: Final[bytes] = hkdf_extract(ZERO_SECRET, ZERO_SECRET)
+HANDSHAKE_SALT_WITHOUT_PSK: Final[bytes] = derive_secret(
+    EARLY_SECRET_WITHOUT_PSK, b"derived", EMPTY_TRANSCRIPT_HASH
+)
+
+# よく使うラベルのHkdfLabelの前半部分を先に作っておく
+for _label, _length in (
+    (b"derived", HASH_LENGTH),
+    (b"c hs traffic", HASH_LENGTH),
+    (b"s hs traffic", HASH_LENGTH),
+    (b"c ap traffic", HASH_LENGTH),
+    (b"s ap traffic", HASH_LENGTH),
+    (b"exp master", HASH_LENGTH),
+    (b"res master", HASH_LENGTH),
+    (b"res binder", HASH_LENGTH),
+    (b"resumption", HASH_LENGTH),
+    (b"finished", HASH_LENGTH),
+    (b"traffic upd", HASH_LENGTH),
+    (b"key", KEY_LENGTH),
+    (b"iv", IV_LENGTH),
+):
+    hkdf_label_prefix(_label, _length)
+
+
+@dataclass(frozen=True, slots=True)
+class PskSecrets:
+    """PSKだけで決まる鍵スケジュールの値。
+
+    同じチケットで何度再開しても同じなので、チケットごとに1回だけ計算して
+    SessionStateと一緒にキャッシュしておく。
+    """
+
+    early_secret: bytes
+    # binder_key(res binder)から導出したfinished_key
+    binder_finished_key: bytes
+    # Derive-Secret(Early Secret, "derived", "")
+    handshake_salt: bytes
+
+    @classmethod
+    def from_psk(cls, psk: bytes) -> Self:
+        early_secret = hkdf_extract(ZERO_SECRET, psk)
+        binder_key = derive_secret(early_secret, b"res binder", EMPTY_TRANSCRIPT_HASH)
+        return cls(
+            early_secret,
+            hkdf_expand_label(binder_key, b"finished", b"", HASH_LENGTH),
+            derive_secret(early_secret, b"derived", EMPTY_TRANSCRIPT_HASH),
+        )
+
+
+class TranscriptHash:
+    """1接続につき1つ持つTranscript-Hash。
+
+    送受信したハンドシェイクメッセージを順にupdate()するだけで、
+    各段階で連結したトランスクリプト全体をハッシュし直すことはしない。
+    """
+
+    def __init__(self):
+        self._hash = hashlib.new(HASH_NAME)
+
+    def update(self, handshake_message: bytes | memoryview) -> None:
+        self._hash.update(handshake_message)
+
+    def digest(self) -> bytes:
+        # hashlibのdigest()は内部状態を壊さないので、その後もupdate()できる
+        return self._hash.digest()
+
+
+class KeySchedule:
+    """TLS 1.3の鍵スケジュール(RFC 8446 7.1)。
+
+              0
+              |
+              v
+    PSK ->  HKDF-Extract = Early Secret
+              |
+              v
+    Derive-Secret(., "derived", "")
+              |
+              v
+    (EC)DHE -> HKDF-Extract = Handshake Secret
+              |
+              +-----> Derive-Secret(., "c hs traffic", ClientHello...ServerHello)
+              +-----> Derive-Secret(., "s hs traffic", ClientHello...ServerHello)
+              v
+    Derive-Secret(., "derived", "")
+              |
+              v
+    0 -> HKDF-Extract = Master Secret
+              |
+              +-----> Derive-Secret(., "c ap traffic", ClientHello...server Finished)
+              +-----> Derive-Secret(., "s ap traffic", ClientHello...server Finished)
+              +-----> Derive-Secret(., "exp master", ClientHello...server Finished)
+              +-----> Derive-Secret(., "res master", ClientHello...client Finished)
+    """
+
+    def __init__(self, psk: bytes | None = None):
+        self.transcript = TranscriptHash()
+        self.early_secret = EARLY_SECRET_WITHOUT_PSK
+        self.handshake_salt = HANDSHAKE_SALT_WITHOUT_PSK
+        self._binder_finished_key: bytes | None = None
+        self.handshake_secret: bytes | None = None
+        self.master_secret: bytes | None = None
+        self.client_handshake_traffic_secret: bytes | None = None
+        self.server_handshake_traffic_secret: bytes | None = None
+        self.client_application_traffic_secret: bytes | None = None
+        self.server_application_traffic_secret: bytes | None = None
+        self.exporter_master_secret: bytes | None = None
+        self.resumption_master_secret: bytes | None = None
+        if psk is not None:
+            self.set_psk(PskSecrets.from_psk(psk))
+
+    def set_psk(self, psk_secrets: "PskSecrets") -> None:
+        """受け入れたPSKのEarly Secretに切り替える。derive_handshake_secrets()より前に呼ぶ。"""
+        if self.handshake_secret is not None:
+            raise ValueError("Handshake Secretを導出した後にPSKは変えられません。")
+        self.early_secret = psk_secrets.early_secret
+        self.handshake_salt = psk_secrets.handshake_salt
+        self._binder_finished_key = psk_secrets.binder_finished_key
+
+    def psk_binder(self, truncated_client_hello: bytes | memoryview) -> bytes:
+        """チケット由来のPSKのbinder(RFC 8446 4.2.11.2)。
+
+        truncated_client_helloはハンドシェイクヘッダー込みのClientHelloを
+        bindersの直前で切ったもの。
+        """
+        if self._binder_finished_key is None:
+            raise ValueError("先にset_psk()を呼ぶ必要があります。")
+        transcript_hash = hashlib.new(HASH_NAME, truncated_client_hello).digest()
+        return hmac.digest(self._binder_finished_key, transcript_hash, HASH_NAME)
+
+    def derive_handshake_secrets(self, shared_secret: bytes) -> None:
+        """ServerHelloまでをtranscriptに入れてから呼ぶ。
+
+        psk_keでECDHEをしないときは、shared_secretにZERO_SECRETを渡す。
+        """
+        self.set_handshake_secrets(
+            *extract_handshake_secrets(self.handshake_salt, shared_secret)
+        )
+
+    def set_handshake_secrets(
+        self, handshake_secret: bytes, master_secret: bytes
+    ) -> None:
+        """extract_handshake_secrets()を別に計算したときに、derive_handshake_secrets()の
+        代わりに呼ぶ。ServerHelloまでをtranscriptに入れてから呼ぶ。
+        """
+        self.handshake_secret = handshake_secret
+        self.master_secret = master_secret
+        transcript_hash = self.transcript.digest()
+        self.client_handshake_traffic_secret = derive_secret(
+            handshake_secret, b"c hs traffic", transcript_hash
+        )
+        self.server_handshake_traffic_secret = derive_secret(
+            handshake_secret, b"s hs traffic", transcript_hash
+        )
+
+    def derive_application_secrets(self) -> None:
+        """サーバーのFinishedまでをtranscriptに入れてから呼ぶ。"""
+        if self.master_secret is None:
+            raise ValueError("先にderive_handshake_secrets()を呼ぶ必要があります。")
+        transcript_hash = self.transcript.digest()
+        self.client_application_traffic_secret = derive_secret(
+            self.master_secret, b"c ap traffic", transcript_hash
+        )
+        self.server_application_traffic_secret = derive_secret(
+            self.master_secret, b"s ap traffic", transcript_hash
+        )
+        self.exporter_master_secret = derive_secret(
+            self.master_secret, b"exp master", transcript_hash
+        )
+
+    def derive_resumption_master_secret(self) -> None:
+        """クライアントのFinishedまでをtranscriptに入れてから呼ぶ。"""
+        if self.master_secret is None:
+            raise ValueError("先にderive_handshake_secrets()を呼ぶ必要があります。")
+        self.resumption_master_secret = derive_secret(
+            self.master_secret, b"res master", self.transcript.digest()
+        )
+
+    def resumption_psk(self, ticket_nonce: bytes) -> bytes:
+        """NewSessionTicketのticket_nonceに対応するPSK(RFC 8446 4.6.1)。"""
+        if self.resumption_master_secret is None:
+            raise ValueError(
+                "先にderive_resumption_master_secret()を呼ぶ必要があります。"
+            )
+        return hkdf_expand_label(
+            self.resumption_master_secret, b"resumption", ticket_nonce, HASH_LENGTH
+        )
+
+    def finished_verify_data(self, base_key: bytes) -> bytes:
+        """今のtranscriptに対するFinishedのverify_data(RFC 8446 4.4.4)。"""
+        finished_key = hkdf_expand_label(base_key, b"finished", b"", HASH_LENGTH)
+        return hmac.digest(finished_key, self.transcript.digest(), HASH_NAME)
+
+    @staticmethod
+    def next_traffic_secret(traffic_secret: bytes) -> bytes:
+        """KeyUpdateの後に使うapplication_traffic_secret_N+1(RFC 8446 7.2)。"""
+        return hkdf_expand_label(traffic_secret, b"traffic upd", b"", HASH_LENGTH)
+
+    @staticmethod
+    def traffic_keys(
+        traffic_secret: bytes, key_length: int = KEY_LENGTH, iv_length: int = IV_LENGTH
+    ) -> tuple[bytes, bytes]:
+        """トラフィックシークレットからレコード保護用の(key, iv)を導出する(RFC 8446 7.3)。"""
+        return (
+            hkdf_expand_label(traffic_secret, b"key", b"", key_length),
+            hkdf_expand_label(traffic_secret, b"iv", b"", iv_length),
+        )
@@ -1,29 +1,141 @@
+import threading
+from collections import deque
 from dataclasses import dataclass
 from typing import Final
 
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric.x25519 import (
     X25519PrivateKey,
     X25519PublicKey,
 )
-from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.hazmat.primitives.serialization import load_der_public_key
+
+from tiny_tls_py.models.crypto_executor import CryptoExecutor, create_crypto_executor
+from tiny_tls_py.models.key_schedule import extract_handshake_secrets
 
 
 @dataclass
 class KeyPair:
     private_key: X25519PrivateKey
     public_key: X25519PublicKey
+    # 生の公開鍵(32バイト)。ServerHelloのkey_shareにそのまま入れる
+    raw_public_key: bytes
+
+
+@dataclass(frozen=True)
+class KeyPoolStats:
+    # プールから取り出せた回数
+    hits: int
+    # プールが空でその場で生成した回数
+    misses: int
+    # 今プールに入っている鍵ペアの数
+    depth: int
+
+
+def x25519_key_exchange(
+    raw_peer_public_key: bytes, handshake_salt: bytes
+) -> tuple[bytes, bytes, bytes]:
+    """使い捨ての鍵ペアを作って鍵交換し、(生の公開鍵, Handshake Secret, Master Secret)を返す。
+
+    秘密鍵も共通鍵も外に出さないので、プロセスプールのワーカーでもそのまま動かせる。
+    """
+    private_key = X25519PrivateKey.generate()
+    shared_secret = private_key.exchange(
+        X25519PublicKey.from_public_bytes(raw_peer_public_key)
+    )
+    return (
+        private_key.public_key().public_bytes_raw(),
+        *extract_handshake_secrets(handshake_salt, shared_secret),
+    )
 
 
 class KeyService:
+    # start_key_pool()を呼ぶまではNoneで、毎回その場で鍵ペアを生成する
+    key_pool: "X25519KeyPool | None" = None
+    # key_exchange()の計算を任せる先。configure_crypto_executor()で切り替える
+    crypto_executor: CryptoExecutor = CryptoExecutor()
+
+    @classmethod
+    def configure_crypto_executor(cls, name: str, workers: int = 0) -> CryptoExecutor:
+        """nameはcrypto_executor.CRYPTO_EXECUTORSの名前(inline, thread, process)。"""
+        cls.crypto_executor.close()
+        cls.crypto_executor = create_crypto_executor(name, workers)
+        return cls.crypto_executor
+
+    @classmethod
+    def key_exchange(
+        cls, raw_peer_public_key: bytes, handshake_salt: bytes
+    ) -> tuple[bytes, bytes, bytes]:
+        """ServerHelloのkey_shareに入れる生の公開鍵と、x25519の共通鍵から導出した
+        Handshake SecretとMaster Secretを返す。
+
+        crypto_executorがメモリを共有していれば、鍵ペアは鍵プールから取り出す。
+        プロセスプールなら、鍵生成もワーカーで一緒に計算する。
+        どちらもHKDF-Extractまではワーカーで計算する。
+        """
+        executor = cls.crypto_executor
+        if executor.shares_memory:
+            return executor.run(
+                cls._pooled_key_exchange, raw_peer_public_key, handshake_salt
+            )
+        return executor.run(x25519_key_exchange, raw_peer_public_key, handshake_salt)
+
+    @classmethod
+    async def key_exchange_async(
+        cls, raw_peer_public_key: bytes, handshake_salt: bytes
+    ) -> tuple[bytes, bytes, bytes]:
+        """key_exchange()と同じだが、crypto_executorで計算している間はイベントループを止めない。"""
+        # 同期サーバーはasyncioを使わないので、ここで読み込む
+        import asyncio
+
+        executor = cls.crypto_executor
+        if executor.shares_memory:
+            future = executor.submit(
+                cls._pooled_key_exchange, raw_peer_public_key, handshake_salt
+            )
+        else:
+            future = executor.submit(
+                x25519_key_exchange, raw_peer_public_key, handshake_salt
+            )
+        return await asyncio.wrap_future(future)
+
+    @classmethod
+    def _pooled_key_exchange(
+        cls, raw_peer_public_key: bytes, handshake_salt: bytes
+    ) -> tuple[bytes, bytes, bytes]:
+        key_pair = cls.acquire_X25519_KeyPair()
+        shared_secret = cls.generate_common_secret(
+            key_pair.private_key, cls.load_X25519_publickey(raw_peer_public_key)
+        )
+        return (
+            key_pair.raw_public_key,
+            *extract_handshake_secrets(handshake_salt, shared_secret),
+        )
+
     @classmethod
     def generate_X25519_KeyPair(cls) -> KeyPair:
         # generate keypair
         private_key = X25519PrivateKey.generate()
         public_key = private_key.public_key()
-        return KeyPair(private_key=private_key, public_key=public_key)
+        return KeyPair(
+            private_key=private_key,
+            public_key=public_key,
+            raw_public_key=public_key.public_bytes_raw(),
+        )
+
+    @classmethod
+    def start_key_pool(cls, capacity: int, low_water: int) -> "X25519KeyPool":
+        """事前生成した鍵ペアのプールを起動して、acquire_X25519_KeyPair()で使うようにする。"""
+        if cls.key_pool is not None:
+            cls.key_pool.close()
+        cls.key_pool = X25519KeyPool(capacity=capacity, low_water=low_water)
+        cls.key_pool.start()
+        return cls.key_pool
+
+    @classmethod
+    def acquire_X25519_KeyPair(cls) -> KeyPair:
+        """ハンドシェイク用の使い捨ての鍵ペアを返す。プールがあればそこから取り出す。"""
+        if cls.key_pool is None:
+            return cls.generate_X25519_KeyPair()
+        return cls.key_pool.acquire()
 
     @classmethod
     def generate_common_secret(
@@ -33,6 +145,11 @@ class KeyService:
         shared_key = private_key.exchange(public_key)
         return shared_key
 
+    @classmethod
+    def load_X25519_publickey(cls, publickey_bytes: bytes) -> X25519PublicKey:
+        """key_shareに入っている生の公開鍵(32バイト)を、DERを経由せずに読み込む。"""
+        return X25519PublicKey.from_public_bytes(publickey_bytes)
+
     @classmethod
     def extract_rawkey_from_DerFormat(
         cls, key: X25519PrivateKey | X25519PublicKey
@@ -48,6 +165,9 @@ class KeyService:
         Returns:
             bytes: _description_
         """
+        # serializationは読み込みが重いので、DERを扱うときにだけ読み込む
+        from cryptography.hazmat.primitives import serialization
+
         if isinstance(key, X25519PrivateKey):
             der_bytes = key.private_bytes(
                 encoding=serialization.Encoding.DER,
@@ -84,7 +204,83 @@ class KeyService:
             + bytes.fromhex("032100")
             + publickey_bytes
         )
+        from cryptography.hazmat.primitives.serialization import load_der_public_key
+
         public_key = load_der_public_key(subject_publickey_info)
         if not isinstance(public_key, X25519PublicKey):
             raise TypeError("Loaded key is not an X25519PublicKey")
         return public_key
+
+
+class X25519KeyPool:
+    """事前に生成したX25519の鍵ペアを貯めておくスレッドセーフなプール。
+
+    鍵ペアは1回のハンドシェイクでしか使わないので、取り出したら返さない。
+    start()するとバックグラウンドのスレッドがまずcapacityまで生成し、その後は
+    残りがlow_water以下になるたびにcapacityまで補充する(low_water=0なら
+    空になったときだけ補充する)。
+    デプロイ直後の再接続の嵐のようなバーストでも、鍵生成をハンドシェイクの
+    レイテンシから外せる。
+    """
+
+    def __init__(self, capacity: int = 256, low_water: int = 64):
+        if not 0 <= low_water < capacity:
+            raise ValueError("low_waterは0以上capacity未満である必要があります。")
+        self.capacity = capacity
+        self.low_water = low_water
+        self._key_pairs: deque[KeyPair] = deque()
+        self._condition = threading.Condition()
+        self._hits = 0
+        self._misses = 0
+        self._closed = False
+        self._worker = threading.Thread(
+            target=self._refill_forever, name="x25519-key-pool", daemon=True
+        )
+
+    def start(self) -> None:
+        self._worker.start()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._worker.is_alive():
+            self._worker.join()
+
+    def acquire(self) -> KeyPair:
+        with self._condition:
+            if self._key_pairs:
+                self._hits += 1
+                key_pair = self._key_pairs.popleft()
+                if len(self._key_pairs) <= self.low_water:
+                    self._condition.notify()
+                return key_pair
+            self._misses += 1
+            self._condition.notify()
+        # プールが空なら待たずにその場で生成する
+        return KeyService.generate_X25519_KeyPair()
+
+    @property
+    def stats(self) -> KeyPoolStats:
+        with self._condition:
+            return KeyPoolStats(
+                hits=self._hits, misses=self._misses, depth=len(self._key_pairs)
+            )
+
+    def _refill_forever(self) -> None:
+        # 最初は待たずにcapacityまで生成する
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                shortage = self.capacity - len(self._key_pairs)
+            # 生成中はロックを持たないので、acquire()は待たされない
+            for _ in range(shortage):
+                key_pair = KeyService.generate_X25519_KeyPair()
+                with self._condition:
+                    if self._closed:
+                        return
+                    self._key_pairs.append(key_pair)
+            with self._condition:
+                while not self._closed and len(self._key_pairs) > self.low_water:
+                    self._condition.wait()
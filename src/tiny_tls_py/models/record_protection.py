@@ -0,0 +1,162 @@
+from typing import Final
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+from tiny_tls_py.models.enums import ContentType, ProtocolVersion
+from tiny_tls_py.models.key_schedule import KeySchedule
+
+# content_type(1) + legacy_record_version(2) + length(2)
+RECORD_HEADER_LENGTH: Final[int] = 5
+# RFC 8446 5.1: TLSPlaintext.lengthは2^14を超えてはいけない
+MAX_PLAINTEXT_LENGTH: Final[int] = 2**14
+TAG_LENGTH: Final[int] = 16
+NONCE_LENGTH: Final[int] = 12
+# TLSInnerPlaintextの末尾に付くcontent_type(1バイト)とタグの分だけ長くなる
+RECORD_OVERHEAD: Final[int] = RECORD_HEADER_LENGTH + 1 + TAG_LENGTH
+
+# 暗号スイート -> (AEADのクラス, 鍵の長さ)
+CIPHER_SUITES: Final[dict[int, tuple[type[AESGCM] | type[ChaCha20Poly1305], int]]] = {
+    0x1301: (AESGCM, 16),  # TLS_AES_128_GCM_SHA256
+    0x1302: (AESGCM, 32),  # TLS_AES_256_GCM_SHA384
+    0x1303: (ChaCha20Poly1305, 32),  # TLS_CHACHA20_POLY1305_SHA256
+}
+
+# encrypt_into/decrypt_intoはcryptography 47から。古い版ではencrypt/decryptの結果をコピーする
+_HAS_INTO: Final[bool] = hasattr(AESGCM, "encrypt_into")
+
+_APPLICATION_DATA_HEADER: Final[bytes] = ContentType.application_data.to_bytes(
+    1, "big"
+) + ProtocolVersion.TLS_1_2.to_bytes(2, "big")
+
+
+class RecordProtection:
+    """1接続の片方向(送信か受信)ぶんのレコード保護(RFC 8446 5.2)。
+
+    AEADのコンテキストは作ったものを使い回し、レコードごとのnonceは
+    事前に整数にしておいたIVとシーケンス番号のXORで作る。
+    """
+
+    def __init__(self, key: bytes, iv: bytes, cipher_suite: int = 0x1302):
+        if cipher_suite not in CIPHER_SUITES:
+            raise ValueError(f"Unsupported cipher suite: {cipher_suite:#06x}")
+        aead_class, key_length = CIPHER_SUITES[cipher_suite]
+        if len(key) != key_length or len(iv) != NONCE_LENGTH:
+            raise ValueError("鍵またはIVの長さが暗号スイートと合いません。")
+        self.cipher_suite = cipher_suite
+        self.sequence_number = 0
+        self._aead = aead_class(key)
+        self._iv = int.from_bytes(iv, "big")
+
+    @classmethod
+    def from_traffic_secret(
+        cls, traffic_secret: bytes, cipher_suite: int = 0x1302
+    ) -> "RecordProtection":
+        _, key_length = CIPHER_SUITES[cipher_suite]
+        key, iv = KeySchedule.traffic_keys(traffic_secret, key_length=key_length)
+        return cls(key, iv, cipher_suite)
+
+    @staticmethod
+    def sealed_size(
+        plaintext_length: int, max_fragment_length: int = MAX_PLAINTEXT_LENGTH
+    ) -> int:
+        """plaintext_lengthバイトを暗号化したレコード列の合計バイト数。"""
+        records = max(1, -(-plaintext_length // max_fragment_length))
+        return plaintext_length + records * RECORD_OVERHEAD
+
+    def seal(
+        self,
+        plaintext: bytes | memoryview,
+        content_type: ContentType = ContentType.application_data,
+        max_fragment_length: int = MAX_PLAINTEXT_LENGTH,
+    ) -> bytearray:
+        """plaintextを最大max_fragment_lengthバイトずつのレコードに分けて暗号化する。"""
+        output = bytearray(self.sealed_size(len(plaintext), max_fragment_length))
+        self.seal_into(output, 0, plaintext, content_type, max_fragment_length)
+        return output
+
+    def seal_into(
+        self,
+        buffer: bytearray | memoryview,
+        offset: int,
+        plaintext: bytes | bytearray | memoryview,
+        content_type: ContentType = ContentType.application_data,
+        max_fragment_length: int = MAX_PLAINTEXT_LENGTH,
+    ) -> int:
+        """plaintextを暗号化したレコード列をbuffer[offset:]に書き込み、書いたバイト数を返す。
+
+        bufferにはsealed_size()以上の空きが必要。各レコードは平文をbufferに
+        置いてからその場で暗号化するので、レコードごとの中間バッファは作らない。
+        """
+        if not 0 < max_fragment_length <= MAX_PLAINTEXT_LENGTH:
+            raise ValueError(f"Invalid max_fragment_length: {max_fragment_length}")
+        plaintext = memoryview(plaintext)
+        output = memoryview(buffer)
+        position = offset
+        start = 0
+        while True:
+            chunk = plaintext[start : start + max_fragment_length]
+            inner_length = len(chunk) + 1
+            encrypted_length = inner_length + TAG_LENGTH
+            # 外側のヘッダーは常にapplication_data / TLS1.2で、これがAADになる
+            header = _APPLICATION_DATA_HEADER + encrypted_length.to_bytes(2, "big")
+            output[position : position + RECORD_HEADER_LENGTH] = header
+            body_start = position + RECORD_HEADER_LENGTH
+            # TLSInnerPlaintext = content || content_type (パディングなし)
+            output[body_start : body_start + len(chunk)] = chunk
+            output[body_start + len(chunk)] = content_type
+            self._encrypt(
+                output[body_start : body_start + inner_length],
+                header,
+                output[body_start : body_start + encrypted_length],
+            )
+            position = body_start + encrypted_length
+            start += max_fragment_length
+            if start >= len(plaintext):
+                return position - offset
+
+    def open(self, record: bytearray | memoryview) -> tuple[ContentType, memoryview]:
+        """暗号化されたレコード(ヘッダー込み)をその場で復号し、(content_type, 中身)を返す。
+
+        返すmemoryviewはrecordの一部なので、recordを使い回すまでに読み終えること。
+        """
+        view = memoryview(record)
+        if view[0] != ContentType.application_data:
+            raise ValueError(f"暗号化されていないレコードです: {view[0]}")
+        length = int.from_bytes(view[3:5], "big")
+        if length < 1 + TAG_LENGTH or len(view) < RECORD_HEADER_LENGTH + length:
+            raise ValueError("暗号化されたレコードの長さが不正です。")
+        ciphertext = view[RECORD_HEADER_LENGTH : RECORD_HEADER_LENGTH + length]
+        inner = ciphertext[: length - TAG_LENGTH]
+        try:
+            self._decrypt(ciphertext, view[:RECORD_HEADER_LENGTH], inner)
+        except InvalidTag as e:
+            raise ValueError("レコードの復号に失敗しました(bad_record_mac)。") from e
+        # 末尾のゼロパディングを飛ばした最後の0でないバイトが本当のcontent_type
+        end = len(inner) - 1
+        while end >= 0 and inner[end] == 0:
+            end -= 1
+        if end < 0:
+            raise ValueError("TLSInnerPlaintextにcontent_typeがありません。")
+        return ContentType(inner[end]), inner[:end]
+
+    def _next_nonce(self) -> bytes:
+        if self.sequence_number >= 2**64 - 1:
+            # RFC 8446 5.3: シーケンス番号は折り返してはいけない
+            raise OverflowError("シーケンス番号を使い切りました。鍵の更新が必要です。")
+        nonce = (self._iv ^ self.sequence_number).to_bytes(NONCE_LENGTH, "big")
+        self.sequence_number += 1
+        return nonce
+
+    def _encrypt(self, data: memoryview, aad: bytes, out: memoryview) -> None:
+        # dataとoutは同じ領域を指していてよい(OpenSSLのAEADはin-placeに対応している)
+        if _HAS_INTO:
+            self._aead.encrypt_into(self._next_nonce(), data, aad, out)
+        else:
+            out[:] = self._aead.encrypt(self._next_nonce(), bytes(data), aad)
+
+    def _decrypt(self, data: memoryview, aad: memoryview, out: memoryview) -> None:
+        if _HAS_INTO:
+            self._aead.decrypt_into(self._next_nonce(), data, bytes(aad), out)
+        else:
+            out[:] = self._aead.decrypt(self._next_nonce(), bytes(data), bytes(aad))
@@ -0,0 +1,55 @@
+import time
+from typing import Final
+
+from tiny_tls_py.models.record_protection import MAX_PLAINTEXT_LENGTH, RECORD_OVERHEAD
+
+# 1つのTCPセグメント(MSS 1460からTCPタイムスタンプの12バイトを除いた1448バイト)に
+# 収まるレコードの平文の長さ
+SMALL_RECORD_LENGTH: Final[int] = 1448 - RECORD_OVERHEAD
+# 小さいレコードで送るバイト数。初期ウィンドウ(10セグメント)がスロースタートで
+# 3往復ほど倍になる間に送れる分
+RAMP_UP_BYTES: Final[int] = 2**17
+# これより長く送っていなかったら、小さいレコードからやり直す
+IDLE_RESET: Final[float] = 1.0
+
+
+class RecordSizer:
+    """application_dataのレコードの大きさを決める。
+
+    レコードは全部届くまで復号できないので、接続の最初に16KiBのレコードを送ると、
+    輻輳ウィンドウが小さいうちはクライアントが最初のバイトを読めるまでに何往復も
+    かかる。そこで最初のramp_up_bytesまでは1セグメントに収まる小さいレコードにして、
+    その後はオーバーヘッドの少ない最大のレコードにする。idle_reset秒以上
+    送らなかったら、TCPのスロースタートと同じように小さいレコードに戻す。
+    """
+
+    def __init__(
+        self,
+        max_fragment_length: int = MAX_PLAINTEXT_LENGTH,
+        small_length: int = SMALL_RECORD_LENGTH,
+        ramp_up_bytes: int = RAMP_UP_BYTES,
+        idle_reset: float = IDLE_RESET,
+    ):
+        # 相手のrecord_size_limitから決まる上限
+        self.max_fragment_length = max_fragment_length
+        self.small_length = min(small_length, max_fragment_length)
+        self.ramp_up_bytes = ramp_up_bytes
+        self.idle_reset = idle_reset
+        self._sent = 0
+        self._last_sent = 0.0
+
+    def split(self, length: int, now: float | None = None) -> list[tuple[int, int]]:
+        """lengthバイトを送るときの、(バイト数, レコードの平文の最大長)の並び。"""
+        if now is None:
+            now = time.monotonic()
+        if now - self._last_sent > self.idle_reset:
+            self._sent = 0
+        self._last_sent = now
+        small = min(length, max(0, self.ramp_up_bytes - self._sent))
+        self._sent += length
+        parts = []
+        if small:
+            parts.append((small, self.small_length))
+        if length > small or not parts:
+            parts.append((length - small, self.max_fragment_length))
+        return parts
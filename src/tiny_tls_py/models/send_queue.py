@@ -0,0 +1,84 @@
+import os
+import socket
+from collections import deque
+
+# 1回のsendmsg()に渡せるバッファの数(Linuxでは1024)
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+
+class SendQueue:
+    """送るTLSRecordを、つなげずにセグメントのまま溜めておくキュー。
+
+    ServerHello、ChangeCipherSpec、暗号化したフライトのように別々のバッファに
+    あるレコードを1つのbytesにコピーせず、send()で1回のsendmsg()(writev)に
+    まとめて渡す。1回で送りきれなかった分は、送れたところから先を残しておく。
+
+    TlsRecordFramerと同じくソケットは引数で受け取るだけなので、asyncioでは
+    drain()で取り出したセグメントをtransport.writelines()に渡せばよい。
+    """
+
+    def __init__(self):
+        self._segments: deque[memoryview] = deque()
+        self._size = 0
+
+    def __len__(self) -> int:
+        """まだ送っていないバイト数。"""
+        return self._size
+
+    def append(self, data: bytes | bytearray | memoryview) -> None:
+        """dataはコピーしないので、送り終わるまで書き換えないこと。"""
+        if data:
+            self._segments.append(memoryview(data))
+            self._size += len(data)
+
+    def drain(self) -> list[memoryview]:
+        """溜まっているセグメントを全部取り出す。"""
+        segments = list(self._segments)
+        self._segments.clear()
+        self._size = 0
+        return segments
+
+    def send(self, sock: socket.socket) -> int:
+        """溜まっているセグメントを1回のsendmsg()で送って、送れたバイト数を返す。"""
+        if len(self._segments) <= IOV_MAX:
+            sent = sock.sendmsg(self._segments)
+        else:
+            sent = sock.sendmsg(list(self._segments)[:IOV_MAX])
+        self._consume(sent)
+        return sent
+
+    def send_all(self, sock: socket.socket) -> int:
+        """ブロッキングのソケットに全部送って、sendmsg()を呼んだ回数を返す。
+
+        ふつうは1回で送りきれる。送信バッファが一杯で何回かに分かれるときは
+        TCP_CORKで栓をして、途中の小さな端数を1つのセグメントで先に出さない
+        ようにする(TCP_NODELAYのソケットでは、書いた分がすぐに送られるため)。
+        """
+        calls = 0
+        corked = False
+        try:
+            while self._size:
+                self.send(sock)
+                calls += 1
+                if self._size and not corked and hasattr(socket, "TCP_CORK"):
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+                    corked = True
+        finally:
+            if corked:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        return calls
+
+    def clear(self) -> None:
+        self._segments.clear()
+        self._size = 0
+
+    def _consume(self, size: int) -> None:
+        self._size -= size
+        segments = self._segments
+        while size:
+            segment = segments[0]
+            if len(segment) > size:
+                segments[0] = segment[size:]
+                return
+            size -= len(segment)
+            segments.popleft()
@@ -0,0 +1,123 @@
+from typing import Final
+
+from tiny_tls_py.models.certificate import ServerCredentials
+from tiny_tls_py.models.enums import ContentType, ExtensionType, HandshakeType
+from tiny_tls_py.models.key_schedule import KeySchedule
+from tiny_tls_py.models.record_protection import (
+    MAX_PLAINTEXT_LENGTH,
+    RecordProtection,
+)
+
+# 受け取れる保護済みレコードの平文の最大長(RFC 8449)。content_typeの1バイトを含む
+RECORD_SIZE_LIMIT: Final[int] = MAX_PLAINTEXT_LENGTH + 1
+# RFC 8449 4: これより小さいrecord_size_limitはillegal_parameter
+MIN_RECORD_SIZE_LIMIT: Final[int] = 64
+
+# 拡張のないEncryptedExtensions。どの接続でも同じバイト列になる
+ENCRYPTED_EXTENSIONS: Final[bytes] = (
+    HandshakeType.EncryptedExtensions.to_bytes(1, "big") + b"\x00\x00\x02\x00\x00"
+)
+# クライアントがrecord_size_limitを送ってきたときに、こちらの上限を返すもの
+ENCRYPTED_EXTENSIONS_WITH_RECORD_SIZE_LIMIT: Final[bytes] = (
+    HandshakeType.EncryptedExtensions.to_bytes(1, "big")
+    + b"\x00\x00\x08\x00\x06"
+    + ExtensionType.RecordSizeLimit.to_bytes(2, "big")
+    + b"\x00\x02"
+    + RECORD_SIZE_LIMIT.to_bytes(2, "big")
+)
+
+
+class ServerFlight:
+    """ServerHelloの後ろに続く、暗号化したサーバーのフライト(RFC 8446 2)。
+
+        EncryptedExtensions
+        Certificate*          <- ServerCredentialsでエンコード済みのものを使う
+        CertificateVerify*    <- 接続ごとに署名する
+        Finished
+
+    *はチケットで再開したときには送らない。署名は時間がかかるので、
+    signature_inputをスレッドプールなどで署名してからfinish()に渡せるように
+    2段階に分けてある。
+    """
+
+    def __init__(
+        self,
+        server_hello_record: bytearray,
+        key_schedule: KeySchedule,
+        credentials: ServerCredentials | None,
+        cipher_suite: int = 0x1302,
+        record_size_limit: int | None = None,
+    ):
+        """key_scheduleはderive_handshake_secrets()まで済ませておくこと。
+
+        credentialsがNoneならCertificateとCertificateVerifyを送らない(PSKでの再開)。
+        record_size_limitはクライアントのrecord_size_limit拡張の値で、
+        渡すとEncryptedExtensionsでこちらの上限を返し、フライトもその大きさに分ける。
+        """
+        if key_schedule.server_handshake_traffic_secret is None:
+            raise ValueError("先にderive_handshake_secrets()を呼ぶ必要があります。")
+        self.response = server_hello_record
+        # responseのうち、ServerHelloのレコードの長さ。finish()はこの後ろに暗号化する
+        self.server_hello_length = len(server_hello_record)
+        self.key_schedule = key_schedule
+        self.credentials = credentials
+        self.cipher_suite = cipher_suite
+        # このフライトと、この接続でこの後に送るレコードの平文の最大長
+        self.max_fragment_length = MAX_PLAINTEXT_LENGTH
+        encrypted_extensions = ENCRYPTED_EXTENSIONS
+        if record_size_limit is not None:
+            self.max_fragment_length = min(MAX_PLAINTEXT_LENGTH, record_size_limit - 1)
+            encrypted_extensions = ENCRYPTED_EXTENSIONS_WITH_RECORD_SIZE_LIMIT
+        self._plaintext = bytearray(encrypted_extensions)
+        key_schedule.transcript.update(encrypted_extensions)
+        # CertificateVerifyで署名するTranscript-Hash。署名しないときはNone
+        self.signature_input: bytes | None = None
+        if credentials is not None:
+            self._plaintext += credentials.certificate_message
+            key_schedule.transcript.update(credentials.certificate_message)
+            self.signature_input = key_schedule.transcript.digest()
+
+    def sign(self) -> bytes | None:
+        """その場で署名する。スレッドプールを使わないときはこれをfinish()に渡す。"""
+        if self.credentials is None or self.signature_input is None:
+            return None
+        return self.credentials.sign(self.signature_input)
+
+    def finish(self, signature: bytes | None = None) -> bytearray:
+        """ServerHelloの後ろに暗号化したフライトを付けたものを返す。
+
+        key_scheduleはアプリケーションのトラフィックシークレットまで導出する。
+        """
+        key_schedule = self.key_schedule
+        if self.credentials is not None:
+            if signature is None:
+                raise ValueError("CertificateVerifyの署名がありません。")
+            certificate_verify = self.credentials.certificate_verify_message(signature)
+            self._plaintext += certificate_verify
+            key_schedule.transcript.update(certificate_verify)
+        secret = key_schedule.server_handshake_traffic_secret
+        if secret is None:
+            raise ValueError("ハンドシェイクのシークレットがまだ導出されていません。")
+        verify_data = key_schedule.finished_verify_data(secret)
+        finished = (
+            HandshakeType.Finished.to_bytes(1, "big")
+            + len(verify_data).to_bytes(3, "big")
+            + verify_data
+        )
+        self._plaintext += finished
+        key_schedule.transcript.update(finished)
+        protection = RecordProtection.from_traffic_secret(secret, self.cipher_suite)
+        # ServerHelloのバッファを伸ばして、その後ろに直接暗号化する
+        offset = len(self.response)
+        self.response += bytes(
+            RecordProtection.sealed_size(len(self._plaintext), self.max_fragment_length)
+        )
+        protection.seal_into(
+            self.response,
+            offset,
+            self._plaintext,
+            ContentType.handshake,
+            self.max_fragment_length,
+        )
+        key_schedule.derive_application_secrets()
+        return self.response
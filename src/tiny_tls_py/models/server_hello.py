@@ -1,14 +1,15 @@
+import struct
 from dataclasses import dataclass
 from enum import Enum
 
-from tiny_tls_py.models.extension import (
+from tiny_tls_py.models.enums import ExtensionType
+from tiny_tls_py.wire.encoding import serialize, write_bytes
+from tiny_tls_py.wire.extension import (
     Extension,
-    ExtensionType,
     KeyShare,
     KeyShareEntry,
     SupportedVersion,
 )
-from tiny_tls_py.models.key_service import KeyPair, KeyService
 
 
 class ProtocolVersion(Enum):
@@ -22,11 +23,20 @@ class ServerHello:
     session_id: bytes
     cipher_suite: int
     compression_method: bytes
-    extension_length: bytes
-    extensions: bytes
+    extensions: tuple[Extension, ...]
 
     @classmethod
-    def from_bytes(cls, client_sessionid: bytes, key_pair: KeyPair) -> "ServerHello":
+    def from_bytes(
+        cls,
+        client_sessionid: bytes,
+        raw_public_key: bytes | None,
+        selected_identity: int | None = None,
+    ) -> "ServerHello":
+        """raw_public_keyはx25519の生の公開鍵。Noneならkey_shareを付けない
+        (psk_keでのセッション再開)。
+
+        selected_identityには、受け入れたpre_shared_keyのidentityの番号を渡す。
+        """
         import os
         from datetime import datetime
         from math import floor
@@ -41,39 +51,65 @@ class ServerHello:
             extension_type=ExtensionType.SupportedVersions,
             data=SupportedVersion(version=bytes([0x03, 0x04])),
         )
-        raw_key = KeyService.extract_rawkey_from_DerFormat(key_pair.public_key)
-        key_share_entry = KeyShareEntry(
-            group=b"\x00\x1d",  # x25519
-            length=32,
-            key_exchange=raw_key,
-        )
-        key_share = Extension(
-            extension_type=ExtensionType.KeyShare,
-            data=KeyShare(length=34, entries=[key_share_entry]),
-        )
-        extensions = supported_version.bytes() + key_share.bytes()
-        extension_length = len(extensions).to_bytes(2, "big")
+        extensions = [supported_version]
+        if raw_public_key is not None:
+            key_share_entry = KeyShareEntry(
+                group=b"\x00\x1d",  # x25519
+                length=32,
+                key_exchange=raw_public_key,
+            )
+            extensions.append(
+                Extension(
+                    extension_type=ExtensionType.KeyShare,
+                    data=KeyShare(length=34, entries=(key_share_entry,)),
+                )
+            )
+        if selected_identity is not None:
+            # ServerHelloのpre_shared_keyはuint16のselected_identityだけ
+            extensions.append(
+                Extension(
+                    extension_type=ExtensionType.PreSharedKey,
+                    data=selected_identity.to_bytes(2, "big"),
+                )
+            )
         return ServerHello(
             protocol_version=protocol_version,
             random=random,
             session_id=client_sessionid,
             cipher_suite=cipher_suite,
             compression_method=compression_method,
-            extension_length=extension_length,
-            extensions=extensions,
+            extensions=tuple(extensions),
         )
 
-    def bytes(self) -> bytes:
-        protocol_version_buffer = self.protocol_version.value
-        session_id_length_buffer = 0x20
-        cipher_suite_buffer = self.cipher_suite.to_bytes(2, "big")
+    def extensions_size(self) -> int:
+        return sum(extension.encoded_size() for extension in self.extensions)
+
+    def encoded_size(self) -> int:
+        # legacy_version(2) + random(32) + session_id(1 + n)
+        # + cipher_suite(2) + compression_method(1) + extensions(2 + n)
         return (
-            protocol_version_buffer
-            + self.random
-            + bytes.fromhex("20")
-            + self.session_id
-            + cipher_suite_buffer
-            + self.compression_method
-            + self.extension_length
-            + self.extensions
+            2
+            + len(self.random)
+            + 1
+            + len(self.session_id)
+            + 2
+            + len(self.compression_method)
+            + 2
+            + self.extensions_size()
         )
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        offset = write_bytes(buffer, offset, self.protocol_version.value)
+        offset = write_bytes(buffer, offset, self.random)
+        buffer[offset] = len(self.session_id)
+        offset = write_bytes(buffer, offset + 1, self.session_id)
+        struct.pack_into("!H", buffer, offset, self.cipher_suite)
+        offset = write_bytes(buffer, offset + 2, self.compression_method)
+        struct.pack_into("!H", buffer, offset, self.extensions_size())
+        offset += 2
+        for extension in self.extensions:
+            offset = extension.write_into(buffer, offset)
+        return offset
+
+    def bytes(self) -> bytes:
+        return serialize(self)
@@ -0,0 +1,274 @@
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Final, Self
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from tiny_tls_py.models.key_schedule import (
+    KeySchedule,
+    PskSecrets,
+    hkdf_expand_label,
+)
+from tiny_tls_py.wire.extension import PskIdentity
+from tiny_tls_py.wire.new_session_ticket import NewSessionTicket
+
+# RFC 8446 4.6.1: チケットの寿命は7日を超えてはいけない
+MAX_TICKET_LIFETIME: Final[int] = 7 * 24 * 60 * 60
+# チケット = 鍵の世代(8) + nonce(12) + AES-256-GCM(SessionState)
+TICKET_KEY_NAME_LENGTH: Final[int] = 8
+TICKET_NONCE_LENGTH: Final[int] = 12
+
+# cipher_suite(2) + issued_at(8) + ticket_age_add(4) + lifetime(4)、その後ろにPSK
+_SESSION_STATE = struct.Struct("!HQII")
+
+
+@dataclass(frozen=True, slots=True)
+class SessionState:
+    """チケットに暗号化して入れておく、セッション再開に必要な情報。"""
+
+    psk: bytes
+    cipher_suite: int
+    # 発行した時刻(UNIX時間のミリ秒)
+    issued_at: int
+    ticket_age_add: int
+    # チケットの寿命(秒)
+    lifetime: int
+    # PSKから導出する値。チケットには入れず、復号したときに1回だけ計算する
+    psk_secrets: PskSecrets = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "psk_secrets", PskSecrets.from_psk(self.psk))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Self:
+        cipher_suite, issued_at, ticket_age_add, lifetime = _SESSION_STATE.unpack_from(
+            data
+        )
+        return cls(
+            data[_SESSION_STATE.size :],
+            cipher_suite,
+            issued_at,
+            ticket_age_add,
+            lifetime,
+        )
+
+    def bytes(self) -> bytes:
+        return (
+            _SESSION_STATE.pack(
+                self.cipher_suite, self.issued_at, self.ticket_age_add, self.lifetime
+            )
+            + self.psk
+        )
+
+    def expired(self, now_ms: int) -> bool:
+        return now_ms - self.issued_at > self.lifetime * 1000
+
+
+@dataclass(frozen=True)
+class SessionTicketStats:
+    # 発行したチケットの数
+    issued: int
+    # キャッシュにあった(復号しなかった)チケットの数
+    cache_hits: int
+    # 復号してキャッシュに入れたチケットの数
+    cache_misses: int
+    # 復号できない、または期限切れで断ったチケットの数
+    rejected: int
+
+
+class TicketKeyRing:
+    """チケットを暗号化する鍵を、rotation_intervalごとに新しい世代に切り替える。
+
+    各世代の鍵は起動時に作った秘密からHKDFで導出するので、prefork.pyのように
+    fork前に作っておけば、どのワーカーが発行したチケットも別のワーカーで開ける。
+    秘密はメモリにしか置かないので、プロセスを再起動するとチケットは無効になる。
+    """
+
+    def __init__(
+        self,
+        rotation_interval: int,
+        lifetime: int,
+        secret: bytes | None = None,
+    ):
+        self.rotation_interval = rotation_interval
+        # チケットの寿命の間に鍵が何世代進むか。それより古い鍵のチケットは開けない
+        self.max_key_age = -(-lifetime // rotation_interval)
+        self._secret = secret or os.urandom(32)
+        self._keys: dict[int, AESGCM] = {}
+
+    def seal(self, plaintext: bytes) -> bytes:
+        generation = self._generation()
+        key_name = generation.to_bytes(TICKET_KEY_NAME_LENGTH, "big")
+        nonce = os.urandom(TICKET_NONCE_LENGTH)
+        return (
+            key_name + nonce + self._key(generation).encrypt(nonce, plaintext, key_name)
+        )
+
+    def open(self, ticket: bytes) -> bytes | None:
+        """チケットを復号する。知らない世代の鍵や改ざんされたチケットならNone。"""
+        nonce_end = TICKET_KEY_NAME_LENGTH + TICKET_NONCE_LENGTH
+        if len(ticket) <= nonce_end:
+            return None
+        key_name = ticket[:TICKET_KEY_NAME_LENGTH]
+        generation = int.from_bytes(key_name, "big")
+        current = self._generation()
+        if not current - self.max_key_age <= generation <= current:
+            return None
+        try:
+            return self._key(generation).decrypt(
+                ticket[TICKET_KEY_NAME_LENGTH:nonce_end], ticket[nonce_end:], key_name
+            )
+        except InvalidTag:
+            return None
+
+    def _generation(self) -> int:
+        return int(time.time()) // self.rotation_interval
+
+    def _key(self, generation: int) -> AESGCM:
+        key = self._keys.get(generation)
+        if key is None:
+            key = AESGCM(
+                hkdf_expand_label(
+                    self._secret,
+                    b"ticket key",
+                    generation.to_bytes(TICKET_KEY_NAME_LENGTH, "big"),
+                    32,
+                )
+            )
+            # 使わなくなった古い世代の鍵を捨てる。ThreadedServerでは別のスレッドも
+            # 同時に捨てることがあるので、dictは写してから見てpop()で消す
+            oldest = generation - self.max_key_age
+            for old_generation in [g for g in list(self._keys) if g < oldest]:
+                self._keys.pop(old_generation, None)
+            self._keys[generation] = key
+        return key
+
+
+class TicketCache:
+    """復号済みのSessionStateを、チケットのバイト列をキーにして持つLRUキャッシュ。
+
+    頻繁に再接続するクライアントは同じチケットを何度も出してくるので、
+    そのたびにAEADで復号しなくて済む。期限切れのエントリは参照時に捨てる。
+
+    参照するたびに並べ替えるので、ThreadedServerのスレッドから同時に
+    使っても壊れないようにロックを取る。
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[bytes, SessionState] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, ticket: bytes, now_ms: int) -> SessionState | None:
+        with self._lock:
+            state = self._entries.get(ticket)
+            if state is None:
+                return None
+            if state.expired(now_ms):
+                del self._entries[ticket]
+                return None
+            self._entries.move_to_end(ticket)
+            return state
+
+    def put(self, ticket: bytes, state: SessionState) -> None:
+        with self._lock:
+            self._entries[ticket] = state
+            self._entries.move_to_end(ticket)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SessionTickets:
+    """NewSessionTicketの発行と、ClientHelloで提示されたチケットの検証をまとめたもの。"""
+
+    def __init__(
+        self,
+        lifetime: int,
+        rotation_interval: int,
+        cache_size: int,
+        cipher_suite: int = 0x1302,
+    ):
+        if not 0 < lifetime <= MAX_TICKET_LIFETIME:
+            raise ValueError(f"Invalid ticket lifetime: {lifetime}")
+        self.lifetime = lifetime
+        self.cipher_suite = cipher_suite
+        self.key_ring = TicketKeyRing(rotation_interval, lifetime)
+        self.cache = TicketCache(cache_size)
+        self._issued = 0
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._rejected = 0
+
+    def issue(self, key_schedule: KeySchedule, ticket_nonce: bytes) -> NewSessionTicket:
+        """クライアントのFinishedまで終えたkey_scheduleからチケットを発行する。
+
+        ticket_nonceは同じ接続で発行するチケットごとに変えること。
+        """
+        state = SessionState(
+            psk=key_schedule.resumption_psk(ticket_nonce),
+            cipher_suite=self.cipher_suite,
+            issued_at=time.time_ns() // 1_000_000,
+            ticket_age_add=secrets.randbits(32),
+            lifetime=self.lifetime,
+        )
+        ticket = self.key_ring.seal(state.bytes())
+        # 発行したチケットで戻ってきたクライアントは、復号せずにキャッシュから引ける
+        self.cache.put(ticket, state)
+        self._issued += 1
+        return NewSessionTicket(
+            ticket_lifetime=self.lifetime,
+            ticket_age_add=state.ticket_age_add,
+            ticket_nonce=ticket_nonce,
+            ticket=ticket,
+        )
+
+    def resume(self, identity: PskIdentity) -> SessionState | None:
+        """pre_shared_keyのidentityからSessionStateを取り出す。使えなければNone。
+
+        binderの検証は呼び出し側(TlsHandshakeProcessor)で行う。
+        """
+        now_ms = time.time_ns() // 1_000_000
+        state = self.cache.get(identity.identity, now_ms)
+        if state is not None:
+            self._cache_hits += 1
+        else:
+            plaintext = self.key_ring.open(identity.identity)
+            if plaintext is None:
+                self._rejected += 1
+                return None
+            state = SessionState.from_bytes(plaintext)
+            if state.expired(now_ms):
+                self._rejected += 1
+                return None
+            self.cache.put(identity.identity, state)
+            self._cache_misses += 1
+        # RFC 8446 4.2.11.1: クライアントから見たチケットの経過時間(ミリ秒)
+        ticket_age = (identity.obfuscated_ticket_age - state.ticket_age_add) % 2**32
+        if (
+            ticket_age > state.lifetime * 1000
+            or state.cipher_suite != self.cipher_suite
+        ):
+            self._rejected += 1
+            return None
+        return state
+
+    def stats(self) -> SessionTicketStats:
+        return SessionTicketStats(
+            issued=self._issued,
+            cache_hits=self._cache_hits,
+            cache_misses=self._cache_misses,
+            rejected=self._rejected,
+        )
@@ -1,56 +1,466 @@
+import hmac
+import logging
 import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Final
 
-from tiny_tls_py.models.client_hello import ClientHello
-from tiny_tls_py.models.extension import Extension, ExtensionType, KeyShare
-from tiny_tls_py.models.handshake import Handshake, HandshakeType
+from tiny_tls_py.metrics import Metrics
+from tiny_tls_py.models.alert import TlsAlert
+from tiny_tls_py.models.certificate import ServerCredentials
+from tiny_tls_py.models.enums import (
+    AlertDescription,
+    ContentType,
+    ExtensionType,
+    HandshakeType,
+    ProtocolVersion,
+    PskKeyExchangeMode,
+)
+from tiny_tls_py.models.key_schedule import (
+    ZERO_SECRET,
+    KeySchedule,
+    extract_handshake_secrets,
+)
 from tiny_tls_py.models.key_service import KeyService
+from tiny_tls_py.models.server_flight import MIN_RECORD_SIZE_LIMIT, ServerFlight
 from tiny_tls_py.models.server_hello import ServerHello
-from tiny_tls_py.models.tls_record import ContentType, ProtocolVersion, TlsRecord
+from tiny_tls_py.models.session_ticket import SessionTickets
+from tiny_tls_py.wire.client_hello import ClientHello
+from tiny_tls_py.wire.extension import (
+    KeyShare,
+    PreSharedKey,
+    PskKeyExchangeModes,
+    RecordSizeLimit,
+)
+from tiny_tls_py.wire.handshake import Handshake
+from tiny_tls_py.wire.tls_record import TlsRecord
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_SIGNATURE_ALGORITHMS: Final[int] = 0x000D
+
+
+@dataclass
+class PendingHandshake:
+    """negotiate()で、鍵交換の手前まで進めたハンドシェイク。"""
+
+    client_hello_message: Handshake
+    client_hello: ClientHello
+    key_schedule: KeySchedule | None
+    # 鍵交換するクライアントのx25519の公開鍵。psk_keで(EC)DHEをしないときはNone
+    raw_client_pubkey: bytes | None
+    # 受け入れたチケットのidentityの番号。フルハンドシェイクならNone
+    selected_identity: int | None
+    # フルハンドシェイクで使う証明書。Noneならフライトを送らない
+    credentials: ServerCredentials | None
+
+    @property
+    def needs_key_exchange(self) -> bool:
+        """crypto_executorで計算する鍵交換があるか。"""
+        return self.key_schedule is not None and self.raw_client_pubkey is not None
+
+
+@dataclass(frozen=True)
+class HandshakeKeys:
+    """exchange_keys()の結果。"""
+
+    # ServerHelloのkey_shareに入れる生の公開鍵。psk_keならNone
+    raw_public_key: bytes | None
+    # (Handshake Secret, Master Secret)。key_scheduleがなければ導出しないのでNone
+    secrets: tuple[bytes, bytes] | None = None
 
 
 class TlsHandshakeProcessor:
+    # enable_session_tickets()を呼ぶまではNoneで、チケットの発行も再開もしない
+    session_tickets: SessionTickets | None = None
+    # set_credentials()を呼ぶまではNoneで、ServerHelloだけを返す
+    credentials: ServerCredentials | None = None
+    # CertificateVerifyの署名を任せるスレッドプール。Noneならその場で署名する
+    signing_executor: ThreadPoolExecutor | None = None
+
+    @classmethod
+    def set_credentials(
+        cls, credentials: ServerCredentials, signing_threads: int = 0
+    ) -> None:
+        """証明書を設定して、ServerHelloの後ろにサーバーのFinishedまでを送るようにする。
+
+        signing_threadsが1以上なら、asyncioサーバーはCertificateVerifyの署名を
+        その数のスレッドのプールで計算し、その間も他の接続を処理する。
+        """
+        cls.credentials = credentials
+        if cls.signing_executor is not None:
+            cls.signing_executor.shutdown(wait=False)
+        cls.signing_executor = (
+            ThreadPoolExecutor(signing_threads, thread_name_prefix="signing")
+            if signing_threads > 0
+            else None
+        )
+
+    @classmethod
+    def enable_session_tickets(
+        cls, lifetime: int, rotation_interval: int, cache_size: int
+    ) -> SessionTickets:
+        """チケットによるセッション再開(RFC 8446 2.2)を有効にする。"""
+        cls.session_tickets = SessionTickets(
+            lifetime=lifetime,
+            rotation_interval=rotation_interval,
+            cache_size=cache_size,
+        )
+        return cls.session_tickets
+
+    @classmethod
+    def new_session_ticket(
+        cls, key_schedule: KeySchedule, ticket_nonce: bytes = b"\x00"
+    ) -> Handshake | None:
+        """クライアントのFinishedの後に送るNewSessionTicketを作る。
+
+        key_scheduleはderive_resumption_master_secret()まで済ませておくこと。
+        送るときはサーバーのapplication_traffic_secretで暗号化する。
+        """
+        if cls.session_tickets is None:
+            return None
+        ticket = cls.session_tickets.issue(key_schedule, ticket_nonce)
+        return Handshake(
+            msg_type=HandshakeType.NewSessionTicket,
+            length=ticket.encoded_size(),
+            body=ticket,
+        )
+
+    @classmethod
+    def process(
+        cls,
+        tls_record: TlsRecord,
+        socket: socket.socket,
+        key_schedule: KeySchedule | None = None,
+    ):
+        response = cls.build_response(tls_record, key_schedule)
+        if response is None:
+            return
+        start = time.perf_counter()
+        socket.sendall(response)
+        Metrics.observe("send", time.perf_counter() - start)
+        Metrics.count("bytes_sent", len(response))
+        logger.debug("ServerHelloを送信しました。")
+
+    @classmethod
+    def build_response(
+        cls, tls_record: TlsRecord, key_schedule: KeySchedule | None = None
+    ) -> bytearray | None:
+        """ClientHelloを処理して、送信すべきServerHelloのTLSRecordを返す。
+
+        ソケットには触らないので、同期サーバーとasyncioサーバーの両方から使える。
+        key_scheduleを渡すと、ClientHelloとServerHelloをtranscriptに入れて
+        ハンドシェイクのトラフィックシークレットまで導出する。証明書が設定されて
+        いれば(またはチケットで再開したら)、サーバーのFinishedまでの暗号化した
+        フライトも付ける。CertificateVerifyの署名はその場で計算する。
+        """
+        started = cls.begin_handshake(tls_record, key_schedule)
+        if started is None:
+            return None
+        response, flight = started
+        if flight is None:
+            return response
+        return cls.finish_handshake(flight, cls.sign_flight(flight))
+
+    @classmethod
+    async def build_response_async(
+        cls, tls_record: TlsRecord, key_schedule: KeySchedule
+    ) -> bytearray | None:
+        """build_response()と同じだが、鍵交換はcrypto_executorで、署名は
+        signing_executorで計算して、その間はイベントループを止めない。
+        """
+        pending = cls.negotiate(tls_record, key_schedule)
+        if pending is None:
+            return None
+        response, flight = cls.complete_handshake(
+            pending, await cls.exchange_keys_async(pending)
+        )
+        if flight is None:
+            return response
+        return cls.finish_handshake(flight, await cls.sign_flight_async(flight))
+
+    @classmethod
+    def sign_flight(cls, flight: ServerFlight) -> bytes | None:
+        """CertificateVerifyの署名をその場で計算する。"""
+        start = time.perf_counter()
+        signature = flight.sign()
+        if signature is not None:
+            Metrics.observe("certificate_verify", time.perf_counter() - start)
+        return signature
+
+    @classmethod
+    async def sign_flight_async(cls, flight: ServerFlight) -> bytes | None:
+        """sign_flight()と同じだが、signing_executorがあればそこで計算する。"""
+        if cls.signing_executor is None or flight.signature_input is None:
+            return cls.sign_flight(flight)
+        # 同期サーバーはasyncioを使わないので、ここで読み込む
+        import asyncio
+
+        start = time.perf_counter()
+        signature = await asyncio.get_running_loop().run_in_executor(
+            cls.signing_executor, flight.sign
+        )
+        Metrics.observe("certificate_verify", time.perf_counter() - start)
+        return signature
+
+    @classmethod
+    def finish_handshake(
+        cls, flight: ServerFlight, signature: bytes | None
+    ) -> bytearray:
+        start = time.perf_counter()
+        response = flight.finish(signature)
+        Metrics.observe("server_flight", time.perf_counter() - start)
+        return response
+
     @classmethod
-    def process(self, tls_record: TlsRecord, socket: socket.socket):
-        print("ハンドシェイク処理を開始")
-        # HandShakeかつClientHelloではならValueError
+    def begin_handshake(
+        cls, tls_record: TlsRecord, key_schedule: KeySchedule | None = None
+    ) -> tuple[bytearray, ServerFlight | None] | None:
+        """ServerHelloのTLSRecordと、その後ろに続けるフライト(送らないならNone)を返す。
+
+        フライトはCertificateまでをtranscriptに入れた状態で返すので、
+        署名してからfinish_handshake()に渡す。鍵交換はcrypto_executorで計算して
+        終わるまで待つ。待つ間に他の接続を処理するなら、negotiate()、
+        exchange_keys_async()、complete_handshake()を順に呼ぶ。
+        """
+        pending = cls.negotiate(tls_record, key_schedule)
+        if pending is None:
+            return None
+        return cls.complete_handshake(pending, cls.exchange_keys(pending))
+
+    @classmethod
+    def negotiate(
+        cls, tls_record: TlsRecord, key_schedule: KeySchedule | None = None
+    ) -> PendingHandshake | None:
+        """ClientHelloを検証して、チケットと証明書を選ぶ。鍵交換はまだしない。
+
+        x25519のkey_shareも使えるチケットもなければNoneを返す。
+        """
+        # HandShakeかつClientHelloではならTlsAlert(ValueError)
         if not (
             isinstance(tls_record.fragment, Handshake)
             and isinstance(tls_record.fragment.body, ClientHello)
         ):
-            raise ValueError("tls_record.fragment must be ClientHello")
+            raise TlsAlert(
+                AlertDescription.unexpected_message,
+                "tls_record.fragment must be ClientHello",
+            )
         client_hello: Final[ClientHello] = tls_record.fragment.body
-        client_key_shares: Final[list[Extension]] = list(
-            filter(
-                lambda x: x.extension_type == ExtensionType.KeyShare,
-                client_hello.extensions,
+        client_key_share = client_hello.extension(ExtensionType.KeyShare)
+        raw_client_pubkey = None
+        if client_key_share is not None:
+            if isinstance(client_key_share.data, KeyShare):
+                raw_client_pubkey = client_key_share.data.x2559Key()
+                if raw_client_pubkey is None:
+                    logger.debug("x25519のkey_shareがありません。")
+                elif logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("x25519 key: %s", raw_client_pubkey.hex())
+            else:
+                logger.warning("client_key_share.data is not a KeyShare instance")
+        resumption = None
+        if key_schedule is not None:
+            resumption = cls.resume_session(
+                tls_record.fragment,
+                client_hello,
+                raw_client_pubkey is not None,
+                key_schedule,
             )
+        if resumption is None and raw_client_pubkey is None:
+            return None
+        credentials = None
+        if resumption is None and key_schedule is not None:
+            credentials = cls.credentials
+            if credentials is not None and not cls.accepts_signature_scheme(
+                client_hello, credentials.signature_scheme
+            ):
+                raise TlsAlert(
+                    AlertDescription.handshake_failure,
+                    "クライアントが証明書の署名アルゴリズムに対応していません。",
+                )
+        selected_identity = None
+        if resumption is not None:
+            selected_identity, mode = resumption
+            logger.debug("チケットでセッションを再開します(%s)", mode.name)
+            Metrics.count("resumed_handshakes")
+            if mode == PskKeyExchangeMode.psk_ke:
+                # psk_ke: ECDHEをしない
+                raw_client_pubkey = None
+        return PendingHandshake(
+            client_hello_message=tls_record.fragment,
+            client_hello=client_hello,
+            key_schedule=key_schedule,
+            raw_client_pubkey=raw_client_pubkey,
+            selected_identity=selected_identity,
+            credentials=credentials,
         )
-        if not client_key_shares:
-            return
-        client_key_share = client_key_shares[0]
-        raw_client_pubkey = None
-        if isinstance(client_key_share.data, KeyShare):
-            raw_client_pubkey = client_key_share.data.x2559Key()
-            print(f"x25519 key: {raw_client_pubkey.hex()}")
+
+    @classmethod
+    def exchange_keys(cls, pending: PendingHandshake) -> HandshakeKeys:
+        """鍵交換をcrypto_executorで計算して、終わるまで待つ。"""
+        start = time.perf_counter()
+        key_schedule = pending.key_schedule
+        if key_schedule is None:
+            # 鍵を導出しないので、公開鍵だけあればよい
+            keys = HandshakeKeys(KeyService.acquire_X25519_KeyPair().raw_public_key)
+        elif pending.raw_client_pubkey is None:
+            # psk_ke: ECDHEをしないので(EC)DHEの入力は0
+            keys = HandshakeKeys(
+                None,
+                extract_handshake_secrets(key_schedule.handshake_salt, ZERO_SECRET),
+            )
         else:
-            print("client_key_share.data is not a KeyShare instance")
-        key_pair = KeyService.generate_X25519_KeyPair()
+            raw_public_key, handshake_secret, master_secret = KeyService.key_exchange(
+                pending.raw_client_pubkey, key_schedule.handshake_salt
+            )
+            keys = HandshakeKeys(raw_public_key, (handshake_secret, master_secret))
+        Metrics.observe("key_exchange", time.perf_counter() - start)
+        return keys
+
+    @classmethod
+    async def exchange_keys_async(cls, pending: PendingHandshake) -> HandshakeKeys:
+        """exchange_keys()と同じだが、crypto_executorで計算する間はイベントループを止めない。"""
+        key_schedule = pending.key_schedule
+        if key_schedule is None or pending.raw_client_pubkey is None:
+            return cls.exchange_keys(pending)
+        start = time.perf_counter()
+        (
+            raw_public_key,
+            handshake_secret,
+            master_secret,
+        ) = await KeyService.key_exchange_async(
+            pending.raw_client_pubkey, key_schedule.handshake_salt
+        )
+        Metrics.observe("key_exchange", time.perf_counter() - start)
+        return HandshakeKeys(raw_public_key, (handshake_secret, master_secret))
+
+    @classmethod
+    def complete_handshake(
+        cls, pending: PendingHandshake, keys: HandshakeKeys
+    ) -> tuple[bytearray, ServerFlight | None]:
+        """鍵交換の結果でServerHelloを作り、begin_handshake()と同じものを返す。"""
+        start = time.perf_counter()
         server_hello = ServerHello.from_bytes(
-            client_sessionid=client_hello.session_id, key_pair=key_pair
+            client_sessionid=pending.client_hello.session_id,
+            raw_public_key=keys.raw_public_key,
+            selected_identity=pending.selected_identity,
         )
-        server_hello_buffer = server_hello.bytes()
         server_hello_handshake = Handshake(
             msg_type=HandshakeType.ServerHello,
-            length=len(server_hello_buffer),
-            body=server_hello_buffer,
+            length=server_hello.encoded_size(),
+            body=server_hello,
         )
         server_hello_tls_record = TlsRecord(
             content_type=ContentType.handshake,
             legacy_record_version=ProtocolVersion.TLS_1_2,
-            length=len(server_hello_handshake.bytes()),
+            length=server_hello_handshake.encoded_size(),
             fragment=server_hello_handshake,
         )
-        print("ServerHelloを送信")
-        socket.sendall(server_hello_tls_record.bytes())
-        print("ハンドシェイク処理を終了")
+        # レコードのヘッダーもServerHelloも、1回確保したバッファに直接書き込む
+        response = bytearray(server_hello_tls_record.encoded_size())
+        server_hello_tls_record.write_into(response)
+        now = time.perf_counter()
+        Metrics.observe("server_hello_build", now - start)
+        start = now
+        key_schedule = pending.key_schedule
+        if key_schedule is not None:
+            if keys.secrets is None:
+                raise ValueError("鍵交換でシークレットを導出していません。")
+            key_schedule.transcript.update(pending.client_hello_message.bytes())
+            # ServerHelloのハンドシェイクメッセージはレコードヘッダーの後ろ
+            key_schedule.transcript.update(memoryview(response)[5:])
+            # HKDF-Extractは鍵交換と一緒に済んでいるので、transcriptを使う分だけ
+            key_schedule.set_handshake_secrets(*keys.secrets)
+            Metrics.observe("handshake_secrets", time.perf_counter() - start)
+        Metrics.count("handshakes")
+        if key_schedule is None or (
+            pending.selected_identity is None and pending.credentials is None
+        ):
+            return response, None
+        return response, ServerFlight(
+            response,
+            key_schedule,
+            pending.credentials,
+            record_size_limit=cls.record_size_limit(pending.client_hello),
+        )
+
+    @classmethod
+    def record_size_limit(cls, client_hello: ClientHello) -> int | None:
+        """ClientHelloのrecord_size_limit(RFC 8449)の値。なければNone。"""
+        extension = client_hello.extension(ExtensionType.RecordSizeLimit)
+        if extension is None:
+            return None
+        if (
+            not isinstance(extension.data, RecordSizeLimit)
+            or extension.data.limit < MIN_RECORD_SIZE_LIMIT
+        ):
+            raise TlsAlert(
+                AlertDescription.illegal_parameter, "record_size_limitが小さすぎます。"
+            )
+        return extension.data.limit
+
+    @classmethod
+    def accepts_signature_scheme(
+        cls, client_hello: ClientHello, signature_scheme: int
+    ) -> bool:
+        """ClientHelloのsignature_algorithmsにsignature_schemeが入っているか。"""
+        data = client_hello.extension_data(EXTENSION_SIGNATURE_ALGORITHMS)
+        if data is None:
+            return False
+        # supported_signature_algorithms<2..2^16-2>: 2バイトの長さの後ろに2バイトずつ
+        length = int.from_bytes(data[:2], "big")
+        if len(data) < 2 or length != len(data) - 2 or length % 2:
+            raise TlsAlert(
+                AlertDescription.decode_error,
+                "signature_algorithmsの長さが不正です。",
+            )
+        return signature_scheme in struct.unpack_from(f"!{length // 2}H", data, 2)
+
+    @classmethod
+    def resume_session(
+        cls,
+        client_hello_message: Handshake,
+        client_hello: ClientHello,
+        has_key_share: bool,
+        key_schedule: KeySchedule,
+    ) -> tuple[int, PskKeyExchangeMode] | None:
+        """pre_shared_keyのチケットを検証し、使えれば(identityの番号, モード)を返す。
+
+        使えるチケットがなければNoneを返し、フルハンドシェイクにする。
+        binderが合わないときはdecrypt_errorのTlsAlertにする(RFC 8446 6.2)。
+        """
+        if cls.session_tickets is None:
+            return None
+        pre_shared_key = client_hello.extension(ExtensionType.PreSharedKey)
+        if pre_shared_key is None or not isinstance(pre_shared_key.data, PreSharedKey):
+            return None
+        modes = client_hello.extension(ExtensionType.PskKeyExchangeModes)
+        # RFC 8446 4.2.9: pre_shared_keyにはpsk_key_exchange_modesが必須
+        if modes is None or not isinstance(modes.data, PskKeyExchangeModes):
+            raise TlsAlert(
+                AlertDescription.missing_extension,
+                "psk_key_exchange_modesがないpre_shared_keyです。",
+            )
+        # forward secrecyのあるpsk_dhe_keを優先する
+        if has_key_share and modes.data.supports(PskKeyExchangeMode.psk_dhe_ke):
+            mode = PskKeyExchangeMode.psk_dhe_ke
+        elif modes.data.supports(PskKeyExchangeMode.psk_ke):
+            mode = PskKeyExchangeMode.psk_ke
+        else:
+            return None
+        truncated_length = 4 + client_hello.psk_binders_offset()
+        for index, identity in enumerate(pre_shared_key.data.identities):
+            state = cls.session_tickets.resume(identity)
+            if state is None:
+                continue
+            key_schedule.set_psk(state.psk_secrets)
+            binder = key_schedule.psk_binder(
+                memoryview(client_hello_message.bytes())[:truncated_length]
+            )
+            if not hmac.compare_digest(binder, pre_shared_key.data.binders[index]):
+                raise TlsAlert(
+                    AlertDescription.decrypt_error, "PSKのbinderが一致しません。"
+                )
+            return index, mode
+        return None
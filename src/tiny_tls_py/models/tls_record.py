@@ -1,26 +1,11 @@
-from enum import IntEnum
 from typing import Self
 
 from pydantic import BaseModel
 
+from tiny_tls_py.models.enums import ContentType, ProtocolVersion
 from tiny_tls_py.models.handshake import Handshake
 
 
-class ContentType(IntEnum):
-    invalid = 0
-    change_cipher_spec = 20
-    alert = 21
-    handshake = 22
-    application_data = 23
-
-
-class ProtocolVersion(IntEnum):
-    TLS_1_0 = 0x0301
-    TLS_1_1 = 0x0302
-    TLS_1_2 = 0x0303
-    TLS_1_3 = 0x0304
-
-
 class TlsRecord(BaseModel):
     content_type: ContentType
     legacy_record_version: ProtocolVersion
@@ -28,15 +13,22 @@ class TlsRecord(BaseModel):
     fragment: bytes | Handshake
 
     @classmethod
-    def from_bytes(cls, data: bytes) -> Self:
-        content_type = ContentType(int.from_bytes(data[:1], "big"))
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        # memoryviewのスライスはコピーしないので、下の層にもそのまま渡す
+        view = memoryview(data)
+        content_type = ContentType(view[0])
         if content_type not in ContentType:
             raise ValueError(f"Invalid content type: {content_type}")
-        version = ProtocolVersion(int.from_bytes(data[1:3], "big"))
+        version = ProtocolVersion(int.from_bytes(view[1:3], "big"))
         if version not in ProtocolVersion:
             raise ValueError(f"Invalid protocol version: {version}")
-        length = int.from_bytes(data[3:5], "big")
-        fragment = Handshake.from_bytes(data[5:])
+        length = int.from_bytes(view[3:5], "big")
+        fragment: bytes | Handshake
+        # Handshake以外(alert, change_cipher_specなど)は生のバイト列のまま持つ
+        if content_type == ContentType.handshake:
+            fragment = Handshake.from_bytes(view[5 : 5 + length])
+        else:
+            fragment = bytes(view[5 : 5 + length])
         return cls(
             content_type=content_type,
             legacy_record_version=version,
@@ -44,6 +36,18 @@ class TlsRecord(BaseModel):
             fragment=fragment,
         )
 
+    @classmethod
+    def from_handshake_message(
+        cls, legacy_record_version: int, message: bytes | memoryview
+    ) -> Self:
+        """複数のレコードから組み立て直したハンドシェイクメッセージを1つのTLSRecordとして扱う。"""
+        return cls(
+            content_type=ContentType.handshake,
+            legacy_record_version=ProtocolVersion(legacy_record_version),
+            length=len(message),
+            fragment=Handshake.from_bytes(message),
+        )
+
     def bytes(self) -> bytes:
         header_buffer = (
             self.content_type.to_bytes(1, "big")
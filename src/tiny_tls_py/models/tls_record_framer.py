@@ -0,0 +1,177 @@
+import socket
+from collections.abc import Iterator
+
+from tiny_tls_py.models.alert import TlsAlert
+from tiny_tls_py.models.buffer_pool import BufferPool
+from tiny_tls_py.models.enums import AlertDescription, ContentType
+
+# content_type(1) + legacy_record_version(2) + length(2)
+RECORD_HEADER_LENGTH = 5
+# RFC 8446 5.2: TLSCiphertext.lengthは2^14 + 256を超えてはいけない
+MAX_RECORD_LENGTH = 2**14 + 256
+# msg_type(1) + length(3)
+HANDSHAKE_HEADER_LENGTH = 4
+
+_CONTENT_TYPES = frozenset(ContentType)
+
+
+class TlsRecordFramer:
+    """任意の長さのバイト列を受け取って、完全なTLSRecordだけを切り出すSans-IOなフレーマー。
+
+    recv()の境界とTLSRecordの境界は一致しないので、足りない分はバッファに残して
+    次のfeed()/recv_into()を待つ。バッファは使い切ったら先頭に巻き戻すリングバッファで、
+    1つのTLSRecordが入りきらないときだけ大きくする。
+
+    poolを渡すと、バッファは受信するときにプールから借りて、release()で返す。
+    プールのバッファは最大のTLSRecordより大きいので、大きくすることはない。
+
+    records()が返すmemoryviewはバッファをコピーせずに切り出したものなので、
+    次にfeed()/recv_into()/release()を呼ぶまでしか有効ではない。
+    """
+
+    def __init__(self, initial_capacity: int = 4096, pool: BufferPool | None = None):
+        self._pool = pool
+        self._buffer: bytearray | None = None if pool else bytearray(initial_capacity)
+        # 未処理のデータは_buffer[_start:_end]にある
+        self._start = 0
+        self._end = 0
+
+    @property
+    def pending(self) -> int:
+        return self._end - self._start
+
+    def feed(self, data: bytes | bytearray | memoryview) -> None:
+        buffer = self._reserve(len(data))
+        buffer[self._end : self._end + len(data)] = data
+        self._end += len(data)
+
+    def recv_into(self, sock: socket.socket, min_free: int = 1024) -> int:
+        """ソケットからバッファの空き領域に直接読み込む。0が返ったら切断。"""
+        received = sock.recv_into(self.writable(min_free))
+        self._end += received
+        return received
+
+    def writable(self, min_free: int = 1024) -> memoryview:
+        """受信データを直接書き込める空き領域。書いたらadvance()で知らせる。
+
+        asyncio.BufferedProtocol.get_buffer()のように、読み込み先を渡すAPI用。
+        バッファが大きければ、読み残しを先頭に詰めて空いた分だけを返す
+        (min_freeに足りなくても、1つのTLSRecordが入るなら大きくはしない)。
+        """
+        room = self.capacity - self.pending
+        buffer = self._reserve(min(min_free, room) if room > 0 else min_free)
+        return memoryview(buffer)[self._end :]
+
+    def advance(self, size: int) -> None:
+        self._end += size
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._buffer is None else len(self._buffer)
+
+    def release(self) -> None:
+        """読み残しがなければ、バッファをプールに返す。"""
+        if self._start == self._end:
+            self.close()
+
+    def close(self) -> None:
+        """読み残しがあっても捨てて、バッファをプールに返す。接続を閉じるときに呼ぶ。"""
+        if self._pool is None or self._buffer is None:
+            return
+        # 大きくしたバッファはfeed()で渡されたものなので、プールには戻さない
+        if len(self._buffer) == self._pool.buffer_size:
+            self._pool.release(self._buffer)
+        self._buffer = None
+        self._start = self._end = 0
+
+    def records(self) -> Iterator[memoryview]:
+        """バッファにある完全なTLSRecord(ヘッダー込み)を順に返す。"""
+        buffer = self._buffer
+        if buffer is None:
+            return
+        while self._end - self._start >= RECORD_HEADER_LENGTH:
+            start = self._start
+            if buffer[start] not in _CONTENT_TYPES:
+                raise TlsAlert(
+                    AlertDescription.unexpected_message,
+                    f"不正なContentTypeを検出しました: {buffer[start]}",
+                )
+            length = (buffer[start + 3] << 8) | buffer[start + 4]
+            if length > MAX_RECORD_LENGTH:
+                raise TlsAlert(
+                    AlertDescription.record_overflow,
+                    f"TLSRecordが長すぎます: {length}バイト",
+                )
+            record_end = start + RECORD_HEADER_LENGTH + length
+            if record_end > self._end:
+                # 続きはまだ届いていない
+                break
+            self._start = record_end
+            yield memoryview(buffer)[start:record_end]
+        if self._start == self._end:
+            # 全部読み終わったら先頭に巻き戻す
+            self._start = self._end = 0
+
+    def _reserve(self, size: int) -> bytearray:
+        if self._buffer is None:
+            # poolがあるときだけここに来る
+            assert self._pool is not None
+            self._buffer = self._pool.acquire()
+        if len(self._buffer) - self._end >= size:
+            return self._buffer
+        pending = self._end - self._start
+        if pending + size <= len(self._buffer):
+            # 未処理のデータを先頭に詰めれば足りる
+            self._buffer[0:pending] = self._buffer[self._start : self._end]
+        else:
+            # memoryviewが外に出ているとbytearrayはリサイズできないので、新しく確保する
+            buffer = bytearray(max(len(self._buffer) * 2, pending + size))
+            buffer[0:pending] = self._buffer[self._start : self._end]
+            if self._pool is not None:
+                self._pool.release(self._buffer)
+            self._buffer = buffer
+        self._start = 0
+        self._end = pending
+        return self._buffer
+
+
+class HandshakeReassembler:
+    """handshakeレコードのfragmentから、完全なハンドシェイクメッセージを組み立てる。
+
+    1つのレコードに複数のメッセージが入っていることも、1つのメッセージが
+    複数のレコードにまたがっていることもある(RFC 8446 5.1)。
+    1つのレコードに収まっているメッセージはコピーせずにそのまま切り出す。
+    """
+
+    def __init__(self, max_message_length: int = 2**17):
+        self.max_message_length = max_message_length
+        self._pending = bytearray()
+
+    @property
+    def has_pending(self) -> bool:
+        """メッセージの途中まで受け取っているか。
+
+        この間に別のContentTypeのレコードが来たらプロトコル違反。
+        """
+        return bool(self._pending)
+
+    def feed(self, fragment: memoryview) -> Iterator[memoryview]:
+        if self._pending:
+            # 前のレコードからの続きなので、つなげてから切り出す
+            self._pending += fragment
+            fragment = memoryview(bytes(self._pending))
+            self._pending = bytearray()
+        offset = 0
+        while len(fragment) - offset >= HANDSHAKE_HEADER_LENGTH:
+            length = int.from_bytes(fragment[offset + 1 : offset + 4], "big")
+            if length > self.max_message_length:
+                raise ValueError(
+                    f"ハンドシェイクメッセージが長すぎます: {length}バイト"
+                )
+            message_end = offset + HANDSHAKE_HEADER_LENGTH + length
+            if message_end > len(fragment):
+                break
+            yield fragment[offset:message_end]
+            offset = message_end
+        if offset < len(fragment):
+            self._pending += fragment[offset:]
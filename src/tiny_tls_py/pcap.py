@@ -0,0 +1,294 @@
+"""pcap/pcapngのキャプチャファイルを、ファイル全体を読み込まずにmmapで読む。
+
+数GBのキャプチャを複数のプロセスで分けて読めるように、chunks()でファイルを
+パケットの境界で区切る。区切りはファイルの途中のオフセットから、
+ヘッダーとして妥当な位置を探して合わせる(先頭から全部なめる必要がない)。
+
+pcapngはすべてのInterface Description Blockがファイルの先頭
+(最初のパケットより前)にあり、セクションが1つだけのものを想定している。
+tcpdumpやdumpcapが書き出すファイルはこの形になっている。
+"""
+
+import mmap
+import struct
+from collections.abc import Iterator
+from itertools import pairwise
+from pathlib import Path
+from typing import Self
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+PCAP_HEADER_LENGTH = 24
+PCAP_RECORD_HEADER_LENGTH = 16
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION = 1
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+# 区切りの位置を探すときに、妥当なヘッダーが続いているか確かめる数
+_RESYNC_CHAIN = 4
+# pcapngの仕様で定義されているブロックの種類
+_PCAPNG_BLOCK_TYPES = frozenset(
+    (PCAPNG_SECTION_HEADER, 1, 2, 3, 4, 5, 6, 0x0A, 0x0BAD, 0x40000BAD)
+)
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86DD
+_ETHERTYPE_VLAN = frozenset((0x8100, 0x88A8))
+_IPPROTO_TCP = 6
+
+
+class CaptureFile:
+    """pcap/pcapngのファイルをmmapしたもの。packets()でパケットを順に返す。"""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.buffer)
+        magic = self.buffer[:4]
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+            self.format = "pcap"
+            self.endian = "<"
+        elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+            self.format = "pcap"
+            self.endian = ">"
+        elif magic == PCAPNG_SECTION_HEADER.to_bytes(4, "big"):
+            self.format = "pcapng"
+            byte_order = self.buffer[8:12]
+            self.endian = "<" if byte_order == b"\x4d\x3c\x2b\x1a" else ">"
+        else:
+            raise ValueError(f"pcap/pcapngのファイルではありません: {self.path}")
+        if self.format == "pcap":
+            self.nanosecond = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+            self.snaplen, linktype = struct.unpack_from(
+                self.endian + "II", self.buffer, 16
+            )
+            # 上位ビットはFCSの情報なので、リンクタイプは下位16ビット
+            self.linktypes = [linktype & 0xFFFF]
+            self.snaplen = self.snaplen or 0x40000
+            self.first_packet = PCAP_HEADER_LENGTH
+        else:
+            self.linktypes, self.first_packet = self._read_interfaces()
+
+    def close(self) -> None:
+        self.buffer.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _read_interfaces(self) -> tuple[list[int], int]:
+        """最初のパケットまでのブロックから、インターフェースごとのリンクタイプを集める。"""
+        linktypes = []
+        offset = 0
+        while offset + 12 <= self.size:
+            block_type, length = struct.unpack_from(
+                self.endian + "II", self.buffer, offset
+            )
+            if block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_SIMPLE_PACKET):
+                break
+            if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+                (linktype,) = struct.unpack_from(
+                    self.endian + "H", self.buffer, offset + 8
+                )
+                linktypes.append(linktype)
+            if length < 12:
+                raise ValueError(f"pcapngのブロックの長さが不正です: {offset}")
+            offset += length
+        return linktypes, offset
+
+    def packets(self, start: int | None = None) -> Iterator[tuple[int, int, int, int]]:
+        """startから最後まで(ブロックのオフセット, リンクタイプ, データの位置, 長さ)を返す。"""
+        offset = self.first_packet if start is None else start
+        buffer = self.buffer
+        size = self.size
+        if self.format == "pcap":
+            record_header = struct.Struct(self.endian + "8xI4x")
+            linktype = self.linktypes[0]
+            while offset + PCAP_RECORD_HEADER_LENGTH <= size:
+                (caplen,) = record_header.unpack_from(buffer, offset)
+                data = offset + PCAP_RECORD_HEADER_LENGTH
+                if data + caplen > size:
+                    return
+                yield offset, linktype, data, caplen
+                offset = data + caplen
+            return
+        block_header = struct.Struct(self.endian + "II")
+        enhanced_packet = struct.Struct(self.endian + "I8xI")
+        linktypes = self.linktypes
+        while offset + 12 <= size:
+            block_type, length = block_header.unpack_from(buffer, offset)
+            if length < 12 or offset + length > size:
+                return
+            if block_type == PCAPNG_ENHANCED_PACKET:
+                interface, caplen = enhanced_packet.unpack_from(buffer, offset + 8)
+                # ブロックヘッダー(8) + 固定のフィールド(20) + 末尾の長さ(4)を除いた分が
+                # データの上限。超えていれば次のブロックまで読んでしまうので飛ばす
+                if interface < len(linktypes) and caplen <= length - 32:
+                    yield offset, linktypes[interface], offset + 28, caplen
+            elif block_type == PCAPNG_SIMPLE_PACKET and linktypes:
+                (original_length,) = struct.unpack_from(
+                    self.endian + "I", buffer, offset + 8
+                )
+                yield (
+                    offset,
+                    linktypes[0],
+                    offset + 12,
+                    min(original_length, length - 16),
+                )
+            offset += length
+
+    def chunks(self, chunk_size: int) -> list[tuple[int, int]]:
+        """ファイルをおよそchunk_sizeバイトずつ、パケットの境界で区切る。"""
+        boundaries = [self.first_packet]
+        for offset in range(
+            self.first_packet + chunk_size, self.size, max(chunk_size, 1)
+        ):
+            boundary = self.resync(offset)
+            if boundary is not None and boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        boundaries.append(self.size)
+        return list(pairwise(boundaries))
+
+    def resync(self, offset: int) -> int | None:
+        """offset以降で、最初にパケット(ブロック)のヘッダーとして妥当な位置を返す。"""
+        if self.format == "pcapng":
+            # pcapngのブロックは4バイト境界にそろっている
+            offset += -offset % 4
+            step = 4
+        else:
+            step = 1
+        for candidate in range(offset, self.size, step):
+            if self._valid_chain(candidate):
+                return candidate
+        return None
+
+    def _valid_chain(self, offset: int) -> bool:
+        previous_seconds = None
+        for _ in range(_RESYNC_CHAIN):
+            if offset == self.size:
+                return True
+            if self.format == "pcapng":
+                if offset + 12 > self.size:
+                    return False
+                block_type, length = struct.unpack_from(
+                    self.endian + "II", self.buffer, offset
+                )
+                if (
+                    block_type not in _PCAPNG_BLOCK_TYPES
+                    or length < 12
+                    or length % 4
+                    or offset + length > self.size
+                ):
+                    return False
+                (trailer,) = struct.unpack_from(
+                    self.endian + "I", self.buffer, offset + length - 4
+                )
+                if trailer != length:
+                    return False
+                offset += length
+                continue
+            if offset + PCAP_RECORD_HEADER_LENGTH > self.size:
+                return False
+            seconds, fraction, caplen, original_length = struct.unpack_from(
+                self.endian + "IIII", self.buffer, offset
+            )
+            # 0で埋まった領域をヘッダーと見間違えないように、空のパケットは認めない
+            if (
+                seconds == 0
+                or caplen == 0
+                or fraction >= (1_000_000_000 if self.nanosecond else 1_000_000)
+                or caplen > self.snaplen
+                or caplen > original_length
+                or original_length > 0x40000
+                or (
+                    previous_seconds is not None
+                    and abs(seconds - previous_seconds) > 86400
+                )
+            ):
+                return False
+            previous_seconds = seconds
+            offset += PCAP_RECORD_HEADER_LENGTH + caplen
+        return True
+
+
+def tcp_segment(
+    buffer: bytes | mmap.mmap, linktype: int, offset: int, length: int
+) -> tuple[bytes, int, int, int] | None:
+    """パケットがTCPなら(フローのキー, シーケンス番号, ペイロードの位置, 終わり)を返す。
+
+    フローのキーは送信元と宛先のアドレスとポートをつなげたもので、
+    片方向ごとに別のキーになる。IPv4のフラグメントやIPv6の拡張ヘッダーは扱わない。
+    """
+    # lengthが壊れていても、バッファの外は読まない
+    end = min(offset + length, len(buffer))
+    if linktype == LINKTYPE_ETHERNET:
+        if offset + 14 > end:
+            return None
+        ethertype = (buffer[offset + 12] << 8) | buffer[offset + 13]
+        offset += 14
+        while ethertype in _ETHERTYPE_VLAN and offset + 4 <= end:
+            ethertype = (buffer[offset + 2] << 8) | buffer[offset + 3]
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if offset + 16 > end:
+            return None
+        ethertype = (buffer[offset + 14] << 8) | buffer[offset + 15]
+        offset += 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if offset + 20 > end:
+            return None
+        ethertype = (buffer[offset] << 8) | buffer[offset + 1]
+        offset += 20
+    elif linktype == LINKTYPE_NULL:
+        if offset + 4 > end:
+            return None
+        # アドレスファミリーはキャプチャしたホストのバイトオーダー
+        family = buffer[offset] | buffer[offset + 3]
+        ethertype = _ETHERTYPE_IPV4 if family == 2 else _ETHERTYPE_IPV6
+        offset += 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if offset >= end:
+            return None
+        ethertype = _ETHERTYPE_IPV4 if buffer[offset] >> 4 == 4 else _ETHERTYPE_IPV6
+    else:
+        return None
+
+    if ethertype == _ETHERTYPE_IPV4:
+        if offset + 20 > end or buffer[offset + 9] != _IPPROTO_TCP:
+            return None
+        # MFフラグかフラグメントオフセットがあればフラグメント
+        if ((buffer[offset + 6] << 8) | buffer[offset + 7]) & 0x3FFF:
+            return None
+        # Ethernetのパディングを除くため、IPの全長で終わりを決める
+        end = min(end, offset + ((buffer[offset + 2] << 8) | buffer[offset + 3]))
+        addresses = buffer[offset + 12 : offset + 20]
+        header_length = (buffer[offset] & 0x0F) * 4
+        if header_length < 20:
+            return None
+        offset += header_length
+    elif ethertype == _ETHERTYPE_IPV6:
+        if offset + 40 > end or buffer[offset + 6] != _IPPROTO_TCP:
+            return None
+        end = min(end, offset + 40 + ((buffer[offset + 4] << 8) | buffer[offset + 5]))
+        addresses = buffer[offset + 8 : offset + 40]
+        offset += 40
+    else:
+        return None
+
+    if offset + 20 > end:
+        return None
+    ports = buffer[offset : offset + 4]
+    (sequence,) = struct.unpack_from("!I", buffer, offset + 4)
+    payload = offset + (buffer[offset + 12] >> 4) * 4
+    if payload > end:
+        return None
+    return addresses + ports, sequence, payload, end
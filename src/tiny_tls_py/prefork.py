@@ -0,0 +1,419 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from multiprocessing.sharedctypes import SynchronizedArray
+
+from tiny_tls_py.async_server import AsyncTlsServer
+from tiny_tls_py.config import ServerConfig, configure_logging
+from tiny_tls_py.connection import TlsConnection
+from tiny_tls_py.metrics import Metrics
+from tiny_tls_py.models.key_service import KeyService
+from tiny_tls_py.models.tls_handshake_processor import TlsHandshakeProcessor
+from tiny_tls_py.server import (
+    configure_capture,
+    load_credentials,
+)
+
+logger = logging.getLogger(__name__)
+
+# 起動してからこの秒数以内に落ちたワーカーは、すぐには再起動しない
+CRASH_BACKOFF = 1.0
+
+
+class PreforkServer:
+    """N個のワーカープロセスを起動して、それぞれにAsyncTlsServerを動かすサーバー。
+
+    各ワーカーは同じIP/PORTをSO_REUSEPORTでbindするので、カーネルが接続を
+    ワーカーに振り分ける。GILがあっても、X25519などのCPUを使う処理が
+    コアの数だけ並列に走る。
+
+    ハンドシェイク数はワーカーごとに共有メモリの自分の枠に書き込み、
+    親プロセスがSTATS_INTERVALごとに集計して表示する。
+    """
+
+    def __init__(
+        self,
+        workers: int | None = ServerConfig.WORKERS,
+        ip: str = ServerConfig.IP,
+        port: int = ServerConfig.PORT,
+        shutdown_timeout: float = ServerConfig.SHUTDOWN_TIMEOUT,
+        stats_interval: float = ServerConfig.STATS_INTERVAL,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.ip = ip
+        self.port = port
+        self.shutdown_timeout = shutdown_timeout
+        self.stats_interval = stats_interval
+        self._context = multiprocessing.get_context("fork")
+        # ワーカーi番のハンドシェイク数。書くのはそのワーカーだけなのでロックはいらない
+        self.handshake_counts: SynchronizedArray[int] = self._context.Array(
+            "Q", self.workers, lock=False
+        )
+        self._processes: dict[int, BaseProcess] = {}
+        self._started_at: dict[int, float] = {}
+        # 起動直後に落ちたワーカー -> 再起動する時刻
+        self._restart_at: dict[int, float] = {}
+        self._shutting_down = False
+
+    def run(self) -> None:
+        # シグナルを受けたらこのパイプに1バイト書かれるので、wait()がすぐに戻る
+        # (PEP 475でwait()はシグナルの後もtimeoutまで待ち直すため)
+        wakeup_reader, wakeup_writer = os.pipe()
+        os.set_blocking(wakeup_reader, False)
+        os.set_blocking(wakeup_writer, False)
+        signal.set_wakeup_fd(wakeup_writer)
+        signal.signal(signal.SIGTERM, self._request_shutdown)
+        signal.signal(signal.SIGINT, self._request_shutdown)
+        if ServerConfig.CAPTURE_PATH is not None:
+            # キャプチャのリングはワーカーごとにあるので、切り替えはワーカーに伝える
+            signal.signal(signal.SIGUSR1, self._forward_signal)
+        # チケットの鍵はfork前に作って、全ワーカーで同じものを使う
+        TlsHandshakeProcessor.enable_session_tickets(
+            ServerConfig.TICKET_LIFETIME,
+            ServerConfig.TICKET_KEY_ROTATION,
+            ServerConfig.TICKET_CACHE_SIZE,
+        )
+        # 証明書も読み込んでから(自己署名なら作ってから)forkして、全ワーカーで共有する
+        TlsHandshakeProcessor.set_credentials(
+            load_credentials(), ServerConfig.SIGNING_THREADS
+        )
+        TlsConnection.configure_buffer_pool(
+            ServerConfig.RECV_BUFFER_SIZE, ServerConfig.RECV_BUFFER_POOL_SIZE
+        )
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(
+            "サーバーがポート%dで起動しました。(prefork, %dワーカー)",
+            self.port,
+            self.workers,
+        )
+        last_total = 0
+        last_report = time.monotonic()
+        while not self._shutting_down:
+            # 再起動を待っているワーカーの終わったsentinelは、待つ対象から外す
+            sentinels = [
+                process.sentinel
+                for index, process in self._processes.items()
+                if index not in self._restart_at
+            ]
+            deadline = min(
+                [last_report + self.stats_interval, *self._restart_at.values()]
+            )
+            wait(
+                [wakeup_reader, *sentinels],
+                timeout=max(0.0, deadline - time.monotonic()),
+            )
+            _drain(wakeup_reader)
+            self._restart_crashed_workers()
+            now = time.monotonic()
+            if now - last_report >= self.stats_interval:
+                total = sum(self.handshake_counts[:])
+                rate = (total - last_total) / (now - last_report)
+                logger.info(
+                    "ハンドシェイク数: 合計%d (%.1f/s) ワーカー別%s",
+                    total,
+                    rate,
+                    self.handshake_counts[:],
+                )
+                last_total, last_report = total, now
+        self._stop_workers()
+        signal.set_wakeup_fd(-1)
+        os.close(wakeup_reader)
+        os.close(wakeup_writer)
+
+    def _request_shutdown(self, signum, frame) -> None:
+        self._shutting_down = True
+
+    def _forward_signal(self, signum, frame) -> None:
+        for process in self._processes.values():
+            if process.pid is not None and process.is_alive():
+                os.kill(process.pid, signum)
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_run_worker,
+            args=(
+                index,
+                self.ip,
+                self.port,
+                self.shutdown_timeout,
+                self.handshake_counts,
+            ),
+            name=f"tiny-tls-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _restart_crashed_workers(self) -> None:
+        now = time.monotonic()
+        for index, process in list(self._processes.items()):
+            if self._shutting_down:
+                return
+            restart_at = self._restart_at.get(index)
+            if restart_at is not None:
+                if now >= restart_at:
+                    del self._restart_at[index]
+                    self._spawn(index)
+                continue
+            if process.is_alive():
+                continue
+            logger.warning(
+                "ワーカー%dが終了しました(exitcode=%s)。再起動します。",
+                index,
+                process.exitcode,
+            )
+            process.join()
+            if now - self._started_at[index] < CRASH_BACKOFF:
+                # 起動直後に落ち続けるワーカーでCPUを食いつぶさないように、
+                # 少し後で起動する。その間もシグナルやほかのワーカーは待たせない
+                self._restart_at[index] = now + CRASH_BACKOFF
+            else:
+                self._spawn(index)
+
+    def _stop_workers(self) -> None:
+        logger.info("サーバーを停止します。")
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        logger.info("ハンドシェイク数: 合計%d", sum(self.handshake_counts[:]))
+
+
+def _drain(fd: int) -> None:
+    """ノンブロッキングのパイプにたまったバイトを読み捨てる。"""
+    try:
+        while os.read(fd, 512):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _run_worker(
+    index: int,
+    ip: str,
+    port: int,
+    shutdown_timeout: float,
+    handshake_counts: "SynchronizedArray[int]",
+) -> None:
+    # fork直後は親のハンドラとwakeup fdを引き継いでいるので戻しておく。
+    # Ctrl+Cは親プロセスが受け取って、SIGTERMで止めに来る
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 鍵プールのスレッドとcrypto_executorのプールは、fork後に各ワーカーで起動する
+    KeyService.start_key_pool(
+        ServerConfig.KEY_POOL_SIZE, ServerConfig.KEY_POOL_LOW_WATER
+    )
+    KeyService.configure_crypto_executor(
+        ServerConfig.CRYPTO_EXECUTOR, ServerConfig.CRYPTO_WORKERS
+    )
+    configure_capture(f".{index}")
+    # メトリクスはワーカーごとに持つので、ポートとファイルもワーカーごとに分ける
+    Metrics.reset()
+    Metrics.start_exporters(
+        None
+        if ServerConfig.METRICS_PORT is None
+        else ServerConfig.METRICS_PORT + index,
+        None
+        if ServerConfig.METRICS_DUMP_PATH is None
+        else f"{ServerConfig.METRICS_DUMP_PATH}.{index}",
+        ServerConfig.METRICS_DUMP_INTERVAL,
+    )
+    asyncio.run(_serve_worker(index, ip, port, shutdown_timeout, handshake_counts))
+
+
+async def _serve_worker(
+    index: int,
+    ip: str,
+    port: int,
+    shutdown_timeout: float,
+    handshake_counts: "SynchronizedArray[int]",
+) -> None:
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    tls_server = AsyncTlsServer(ip=ip, port=port, reuse_port=True)
+    # 再起動したワーカーは前のワーカーの数から数え続ける
+    base = handshake_counts[index]
+    server = await tls_server.start()
+
+    async def publish_counts() -> None:
+        while True:
+            handshake_counts[index] = base + tls_server.handshake_count
+            await asyncio.sleep(0.5)
+
+    publisher = asyncio.create_task(publish_counts())
+    await stop.wait()
+    # 新しい接続の受け付けをやめて、処理中の接続が終わるのを待つ
+    server.close()
+    try:
+        await asyncio.wait_for(server.wait_closed(), shutdown_timeout)
+    except TimeoutError:
+        logger.warning("ワーカー%d: 終わらない接続を残して停止します。", index)
+    publisher.cancel()
+    handshake_counts[index] = base + tls_server.handshake_count
+
+
+class ThreadedServer:
+    """PreforkServerのワーカーを、プロセスではなくスレッドで動かすサーバー。
+
+    各スレッドが自分のイベントループでAsyncTlsServerを動かし、それぞれの
+    ソケットで同じIP/PORTをSO_REUSEPORTでbindする。証明書、チケットの鍵、
+    鍵プール、受信バッファのプールを1つのプロセスで共有できる。GILのない
+    CPython(3.13t以降)なら、ワーカーはコアの数だけ並列に走る
+    (tests/test_threaded_server.pyをCIの3.13t/3.14tで動かしている)。
+    GILのあるCPythonでも動くが、CPUを使う処理は1つずつしか走らない。
+
+    どれかのワーカーが起動できなければ(ポートが使われているなど)、ほかの
+    ワーカーも止めて、run()がそのワーカーの例外を投げ直す。
+    """
+
+    def __init__(
+        self,
+        workers: int | None = ServerConfig.WORKERS,
+        ip: str = ServerConfig.IP,
+        port: int = ServerConfig.PORT,
+        shutdown_timeout: float = ServerConfig.SHUTDOWN_TIMEOUT,
+        stats_interval: float = ServerConfig.STATS_INTERVAL,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.ip = ip
+        self.port = port
+        self.shutdown_timeout = shutdown_timeout
+        self.stats_interval = stats_interval
+        self.servers: list[AsyncTlsServer] = []
+        self._loops: list[asyncio.AbstractEventLoop] = []
+        self._stops: list[asyncio.Event] = []
+        self._ready = threading.Barrier(self.workers + 1)
+        # 起動できなかったワーカーの例外
+        self._errors: list[BaseException] = []
+        self._shutting_down = threading.Event()
+
+    def run(self) -> None:
+        if getattr(sys, "_is_gil_enabled", lambda: True)():
+            logger.warning(
+                "GILが有効なので、スレッドのワーカーは並列に動きません。"
+                "preforkかGILのないCPythonを使ってください。"
+            )
+        signal.signal(signal.SIGTERM, self._request_shutdown)
+        signal.signal(signal.SIGINT, self._request_shutdown)
+        TlsHandshakeProcessor.enable_session_tickets(
+            ServerConfig.TICKET_LIFETIME,
+            ServerConfig.TICKET_KEY_ROTATION,
+            ServerConfig.TICKET_CACHE_SIZE,
+        )
+        TlsHandshakeProcessor.set_credentials(
+            load_credentials(), ServerConfig.SIGNING_THREADS
+        )
+        TlsConnection.configure_buffer_pool(
+            ServerConfig.RECV_BUFFER_SIZE, ServerConfig.RECV_BUFFER_POOL_SIZE
+        )
+        # キャプチャのリングは全スレッドで1つを共有する
+        configure_capture()
+        KeyService.start_key_pool(
+            ServerConfig.KEY_POOL_SIZE, ServerConfig.KEY_POOL_LOW_WATER
+        )
+        KeyService.configure_crypto_executor(
+            ServerConfig.CRYPTO_EXECUTOR, ServerConfig.CRYPTO_WORKERS
+        )
+        Metrics.start_exporters(
+            ServerConfig.METRICS_PORT,
+            ServerConfig.METRICS_DUMP_PATH,
+            ServerConfig.METRICS_DUMP_INTERVAL,
+        )
+        threads = [
+            threading.Thread(
+                target=asyncio.run,
+                args=(self._serve(),),
+                name=f"tiny-tls-worker-{index}",
+            )
+            for index in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            self._ready.wait()
+        except threading.BrokenBarrierError:
+            # 起動したワーカーは、_serve()でBarrierが壊れたのを見て止まる
+            for thread in threads:
+                thread.join()
+            raise self._errors[0] from None
+        logger.info(
+            "サーバーがポート%dで起動しました。(%dスレッド)", self.port, self.workers
+        )
+        last_total = 0
+        last_report = time.monotonic()
+        while not self._shutting_down.wait(self.stats_interval):
+            now = time.monotonic()
+            total = self.handshake_count
+            logger.info(
+                "ハンドシェイク数: 合計%d (%.1f/s)",
+                total,
+                (total - last_total) / (now - last_report),
+            )
+            last_total, last_report = total, now
+        logger.info("サーバーを停止します。")
+        for loop, stop in zip(self._loops, self._stops):
+            loop.call_soon_threadsafe(stop.set)
+        for thread in threads:
+            thread.join()
+        logger.info("ハンドシェイク数: 合計%d", self.handshake_count)
+
+    @property
+    def handshake_count(self) -> int:
+        return sum(server.handshake_count for server in self.servers)
+
+    def _request_shutdown(self, signum, frame) -> None:
+        self._shutting_down.set()
+
+    async def _serve(self) -> None:
+        stop = asyncio.Event()
+        tls_server = AsyncTlsServer(ip=self.ip, port=self.port, reuse_port=True)
+        try:
+            server = await tls_server.start()
+        except Exception as e:  # noqa: BLE001 run()が投げ直す
+            # Barrierを壊して、run()とほかのワーカーを待たせたままにしない
+            self._errors.append(e)
+            self._ready.abort()
+            return
+        # list.append()はスレッドセーフなので、ロックなしで登録してよい
+        self._loops.append(asyncio.get_running_loop())
+        self._stops.append(stop)
+        self.servers.append(tls_server)
+        try:
+            self._ready.wait()
+        except threading.BrokenBarrierError:
+            # ほかのワーカーが起動できなかった
+            server.close()
+            await server.wait_closed()
+            return
+        await stop.wait()
+        server.close()
+        try:
+            await asyncio.wait_for(server.wait_closed(), self.shutdown_timeout)
+        except TimeoutError:
+            logger.warning("終わらない接続を残して停止します。")
+
+
+def main() -> None:
+    configure_logging()
+    if ServerConfig.WORKER_THREADS:
+        ThreadedServer().run()
+    else:
+        PreforkServer().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,233 @@
+import io
+import logging
+import socket
 import socketserver
+import sys
+import time
 
-from rich.console import Console
-from rich.pretty import Pretty
-
+from tiny_tls_py.admission import SHED_ALERT, AdmissionFilter
+from tiny_tls_py.capture import WireCapture
+from tiny_tls_py.config import ServerConfig, configure_logging
+from tiny_tls_py.connection import ConnectionState, TlsConnection
+from tiny_tls_py.metrics import Metrics
+from tiny_tls_py.models.alert import TlsAlert
+from tiny_tls_py.models.certificate import ServerCredentials
+from tiny_tls_py.models.enums import AlertDescription
+from tiny_tls_py.models.key_service import KeyService
 from tiny_tls_py.models.tls_handshake_processor import TlsHandshakeProcessor
-from tiny_tls_py.models.tls_record import ContentType, TlsRecord
 
+logger = logging.getLogger(__name__)
+
+
+def load_credentials() -> ServerCredentials:
+    """ServerConfigの証明書と秘密鍵を読み込む。設定がなければ自己署名証明書を作る。"""
+    if ServerConfig.CERTIFICATE_PATH is None or ServerConfig.PRIVATE_KEY_PATH is None:
+        logger.warning(
+            "証明書が設定されていないので、自己署名証明書(%s)を使います。",
+            ServerConfig.SELF_SIGNED_ALGORITHM,
+        )
+        return ServerCredentials.generate_self_signed(
+            ServerConfig.SELF_SIGNED_ALGORITHM, ServerConfig.SELF_SIGNED_COMMON_NAME
+        )
+    return ServerCredentials.from_files(
+        ServerConfig.CERTIFICATE_PATH, ServerConfig.PRIVATE_KEY_PATH
+    )
+
+
+def configure_capture(suffix: str = "") -> None:
+    """ServerConfigのキャプチャを設定して、SIGUSR1で切り替えられるようにする。
+
+    リングはCAPTURE_PATHの末尾にsuffixを付けたファイルに作る。
+    """
+    path = (
+        None
+        if ServerConfig.CAPTURE_PATH is None
+        else ServerConfig.CAPTURE_PATH + suffix
+    )
+    WireCapture.configure(
+        path,
+        ServerConfig.CAPTURE_SIZE,
+        ServerConfig.CAPTURE_SAMPLE_RATE,
+        ServerConfig.CAPTURE_ENABLED,
+    )
+    if path is not None:
+        WireCapture.install_signal_handler()
 
-class ServerConfig:
-    IP = "0.0.0.0"
-    PORT = 10003
-    BUFFER_SIZE = 1024
+
+def build_admission_filter() -> AdmissionFilter:
+    return AdmissionFilter(
+        ServerConfig.CONNECTION_RATE_PER_IP,
+        ServerConfig.CONNECTION_BURST_PER_IP,
+        ServerConfig.HANDSHAKE_RATE_PER_IP,
+        ServerConfig.HANDSHAKE_BURST_PER_IP,
+        ServerConfig.RATE_LIMIT_SOURCES,
+        ServerConfig.MAX_CLIENT_HELLO_LENGTH,
+    )
+
+
+def accept_queue_length(listener: socket.socket) -> int | None:
+    """listenしているソケットでacceptを待っている接続の数。Linux以外ではNone。"""
+    try:
+        info = listener.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 32)
+    except (AttributeError, OSError):
+        return None
+    # struct tcp_infoのtcpi_unacked。LISTENのソケットではacceptキューの長さになる
+    return int.from_bytes(info[24:28], sys.byteorder)
+
+
+class TlsTCPServer(socketserver.TCPServer):
+    # 既定の5ではすぐにSYNが捨てられて、クライアントは再送を待たされる。
+    # キューに入れてから、溢れた分はTCPHandlerがalertを送って断る
+    request_queue_size = ServerConfig.ASYNC_BACKLOG
 
 
 class TCPHandler(socketserver.BaseRequestHandler):
+    # TCPServerは1接続ずつ処理するので、全接続で1つを共有してもロックはいらない
+    admission: AdmissionFilter = build_admission_filter()
+
+    def setup(self):
+        if ServerConfig.TCP_NODELAY:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
     def handle(self):
-        print("クライアントが接続しました。")
-        while True:
-            try:
-                data = self.request.recv(ServerConfig.BUFFER_SIZE)
-            except Exception as e:
-                print(f"ソケットエラー: {e}")
-                handshakeProcessor = TlsHandshakeProcessor()
-            if not data:
-                print("クライアントが切断しました。")
-                handshakeProcessor = TlsHandshakeProcessor()
-                break
-            print(f"クライアントからのメッセージ: {data.hex()}")
-            tls_records: list[TlsRecord] = []
-            offset = 0
-            while offset < len(data):
-                if offset + 5 > len(data):
-                    raise ValueError("不完全なTLSRecordヘッダーを検出しました。")
-                length = int.from_bytes(data[offset + 3 : offset + 5], "big")
-                record_end = offset + 5 + length
-                if record_end > len(data):
-                    raise ValueError("不完全なTLSRecordを検出しました。")
-                record_data = data[offset:record_end]
-                tls_record = TlsRecord.from_bytes(record_data)
-                tls_records.append(tls_record)
-                offset = record_end
-
-            for tls_record in tls_records:
-                if tls_record.content_type == ContentType.handshake:
-                    TlsHandshakeProcessor.process(tls_record, self.request)
-            console = Console()
-            console.print(tls_records)
+        logger.debug("クライアントが接続しました。")
+        Metrics.count("connections")
+        source = self.client_address[0]
+        connection = TlsConnection(source, self.admission)
+        try:
+            if not self.admission.admit_connection(source):
+                connection.send_alert(SHED_ALERT)
+            elif self.overloaded():
+                Metrics.count("shed_handshakes")
+                raise TlsAlert(SHED_ALERT, "過負荷のためハンドシェイクを断ります。")
+            else:
+                self.serve(connection)
+        except TlsAlert as e:
+            logger.info("ハンドシェイクを中断します: %s", e)
+            Metrics.count("connection_errors")
+            connection.send_alert(e.description)
+        except ValueError as e:
+            logger.info("接続エラー: %s", e)
+            Metrics.count("connection_errors")
+            connection.send_alert(AlertDescription.decode_error)
+        except TimeoutError:
+            logger.info("タイムアウトしたので接続を切ります。")
+            Metrics.count("timeouts")
+        except OSError as e:
+            logger.info("ソケットエラー: %s", e)
+            Metrics.count("connection_errors")
+        try:
+            # 最後のalertやclose_notify。この後は接続を切るので、送れなくても気にしない
+            self.flush(connection)
+        except OSError:
+            pass
+        connection.close()
 
+    def overloaded(self) -> bool:
+        """acceptを待っている接続がMAX_PENDING_HANDSHAKESを超えているか。
 
-if __name__ == "__main__":
-    with socketserver.TCPServer(
-        (ServerConfig.IP, ServerConfig.PORT), TCPHandler
-    ) as server:
-        print(f"サーバーがポート{ServerConfig.PORT}で起動しました。")
+        1接続ずつ処理するので、待っている接続はそのままハンドシェイクの待ち行列になる。
+        溢れたら待たせずに断って、残りの接続がタイムアウトする前に順番が来るようにする。
+        """
+        if not isinstance(self.server, socketserver.TCPServer):
+            return False
+        pending = accept_queue_length(self.server.socket)
+        return pending is not None and pending > ServerConfig.MAX_PENDING_HANDSHAKES
+
+    def serve(self, connection: TlsConnection) -> None:
+        while not connection.closed and self.receive(connection):
+            self.flush(connection)
+            # NewSessionTicketまで送ったら、以降の送信はカーネルに任せる
+            connection.offload_to_kernel(self.request)
+
+    def receive(self, connection: TlsConnection) -> bool:
+        """1回読み込んで、届いたレコードを処理する。切断されたらFalse。"""
+        self.request.settimeout(
+            ServerConfig.IDLE_TIMEOUT
+            if connection.state == ConnectionState.CONNECTED
+            else ServerConfig.CONNECTION_TIMEOUT
+        )
+        start = time.perf_counter()
+        received = connection.framer.recv_into(self.request)
+        Metrics.observe("recv", time.perf_counter() - start)
+        if not received:
+            logger.debug("クライアントが切断しました。")
+            return False
+        Metrics.count("bytes_received", received)
+        connection.receive_records()
+        while connection.state == ConnectionState.NEGOTIATED:
+            connection.finish_flight(
+                TlsHandshakeProcessor.sign_flight(connection.negotiated_flight)
+            )
+            connection.receive_records()
+        return True
+
+    def flush(self, connection: TlsConnection) -> None:
+        size = len(connection.outgoing)
+        if not size:
+            return
+        start = time.perf_counter()
+        connection.outgoing.send_all(self.request)
+        Metrics.observe("send", time.perf_counter() - start)
+        Metrics.count("bytes_sent", size)
+
+    def sendfile(
+        self,
+        connection: TlsConnection,
+        file: io.BufferedIOBase,
+        chunk_size: int = 2**16,
+    ) -> int:
+        """fileの残りをapplication_dataとして送り、送ったバイト数を返す。
+
+        kTLSに任せた接続ではos.sendfile()でファイルをユーザー空間に読み込まずに送る。
+        そうでなければchunk_sizeずつ読んで、暗号化して送る。
+        """
+        self.flush(connection)
+        if connection.offloaded:
+            sent = self.request.sendfile(file)
+            Metrics.count("bytes_sent", sent)
+            return sent
+        sent = 0
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while size := file.readinto(buffer):
+            connection.send_application_data(view[:size])
+            self.flush(connection)
+            sent += size
+        return sent
+
+
+def main() -> None:
+    configure_logging()
+    KeyService.start_key_pool(
+        ServerConfig.KEY_POOL_SIZE, ServerConfig.KEY_POOL_LOW_WATER
+    )
+    TlsHandshakeProcessor.enable_session_tickets(
+        ServerConfig.TICKET_LIFETIME,
+        ServerConfig.TICKET_KEY_ROTATION,
+        ServerConfig.TICKET_CACHE_SIZE,
+    )
+    TlsHandshakeProcessor.set_credentials(load_credentials())
+    KeyService.configure_crypto_executor(
+        ServerConfig.CRYPTO_EXECUTOR, ServerConfig.CRYPTO_WORKERS
+    )
+    TlsConnection.configure_buffer_pool(
+        ServerConfig.RECV_BUFFER_SIZE, ServerConfig.RECV_BUFFER_POOL_SIZE
+    )
+    TlsConnection.configure_kernel_tls(ServerConfig.KERNEL_TLS)
+    configure_capture()
+    # クラスを定義したときの設定ではなく、今のServerConfigで作り直す
+    TCPHandler.admission = build_admission_filter()
+    Metrics.start_exporters(
+        ServerConfig.METRICS_PORT,
+        ServerConfig.METRICS_DUMP_PATH,
+        ServerConfig.METRICS_DUMP_INTERVAL,
+    )
+    TlsTCPServer.request_queue_size = ServerConfig.ASYNC_BACKLOG
+    with TlsTCPServer((ServerConfig.IP, ServerConfig.PORT), TCPHandler) as server:
+        logger.info("サーバーがポート%dで起動しました。", ServerConfig.PORT)
         server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
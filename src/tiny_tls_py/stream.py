@@ -0,0 +1,163 @@
+"""asyncioサーバーの、ハンドシェイクが終わった接続でapplication_dataを読み書きするAPI。
+
+AsyncTlsServerにhandlerを渡すと、接続ごとにCONNECTEDになったところで
+handler(reader, writer)をタスクとして動かす。
+
+    async def echo(reader: TlsReader, writer: TlsWriter) -> None:
+        async for chunk in reader:
+            writer.write(chunk)
+            await writer.drain()
+
+    asyncio.run(AsyncTlsServer(handler=echo).serve_forever())
+
+readerは復号した平文を受信した塊ごとに返し、writerはwrite()した分をその場で
+レコードにしてtransportに渡す。どちらもasyncioのStreamReader/StreamWriterと
+同じように、溜まりすぎたら読むのを止め、書き込み待ちが多ければdrain()で待つ。
+"""
+
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterable, Iterable
+from typing import TYPE_CHECKING, BinaryIO
+
+from tiny_tls_py.models.record_sizer import SMALL_RECORD_LENGTH
+
+if TYPE_CHECKING:
+    from tiny_tls_py.async_server import TlsServerProtocol
+
+# これ以上の平文がreaderに溜まったら、handlerが読むまでソケットから読まない
+READ_LIMIT = 2**18
+# write_all()でファイルを読む大きさ
+WRITE_CHUNK_SIZE = 2**16
+
+Writable = bytes | bytearray | memoryview
+Source = Writable | BinaryIO | Iterable[Writable] | AsyncIterable[Writable]
+
+
+class TlsReader:
+    """受信したapplication_dataの平文を、届いた塊ごとに返す。
+
+    クライアントがclose_notifyを送るか接続が切れたら、read()はb""を返し、
+    async forは終わる。
+    """
+
+    def __init__(self, protocol: "TlsServerProtocol", limit: int = READ_LIMIT):
+        self._protocol = protocol
+        self._limit = limit
+        self._chunks: deque[bytes] = deque()
+        self._size = 0
+        self._eof = False
+        self._paused = False
+        self._waiter: asyncio.Future | None = None
+
+    def at_eof(self) -> bool:
+        return self._eof and not self._chunks
+
+    def feed_data(self, data: memoryview) -> None:
+        """TlsConnection.on_application_dataに渡す。dataはframerのバッファなのでコピーする。"""
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        self._wake()
+        if self._size > self._limit and not self._paused:
+            self._paused = True
+            self._protocol.transport.pause_reading()
+
+    def feed_eof(self) -> None:
+        self._eof = True
+        self._wake()
+
+    async def read(self) -> bytes:
+        """次の塊を返す。もう届かなければb""。"""
+        while not self._chunks:
+            if self._eof:
+                return b""
+            self._waiter = self._protocol.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        chunk = self._chunks.popleft()
+        self._size -= len(chunk)
+        if self._paused and self._size <= self._limit // 2:
+            self._paused = False
+            self._protocol.transport.resume_reading()
+        return chunk
+
+    def __aiter__(self) -> "TlsReader":
+        return self
+
+    async def __anext__(self) -> bytes:
+        chunk = await self.read()
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+
+class TlsWriter:
+    """application_dataを送る。write()は暗号化してtransportに渡すだけで待たない。"""
+
+    def __init__(self, protocol: "TlsServerProtocol"):
+        self._protocol = protocol
+
+    def write(self, data: Writable) -> None:
+        """dataはその場でレコードにするので、戻ったら書き換えてよい。"""
+        if data:
+            self._protocol.send_application_data(data)
+
+    async def drain(self) -> None:
+        """transportの書き込み待ちが減るまで待つ。"""
+        await self._protocol.drain()
+
+    async def write_all(
+        self, source: Source, chunk_size: int = WRITE_CHUNK_SIZE
+    ) -> int:
+        """bytes、ファイル、bytesのイテラブルか非同期イテラブルを全部送り、バイト数を返す。
+
+        bytesとファイルは、小さいレコード1つ分から倍々にchunk_sizeまで増やしながら
+        分けて送る。全部を暗号化してからtransportに渡すと、最初のバイトが遅れるため。
+        ファイルは1つのバッファにreadinto()する(write()が暗号化してから戻るので、
+        使い回してよい)。
+        """
+        written = 0
+        size = min(SMALL_RECORD_LENGTH, chunk_size)
+        if isinstance(source, bytes | bytearray | memoryview):
+            view = memoryview(source).cast("B")
+            while written < len(view):
+                self.write(view[written : written + size])
+                written += size
+                size = min(size * 2, chunk_size)
+                await self.drain()
+            return len(view)
+        if hasattr(source, "readinto"):
+            view = memoryview(bytearray(chunk_size))
+            while length := source.readinto(view[:size]):
+                self.write(view[:length])
+                written += length
+                size = min(size * 2, chunk_size)
+                await self.drain()
+            return written
+        if isinstance(source, AsyncIterable):
+            async for chunk in source:
+                self.write(chunk)
+                written += len(chunk)
+                await self.drain()
+            return written
+        for chunk in source:
+            self.write(chunk)
+            written += len(chunk)
+            await self.drain()
+        return written
+
+    def close(self) -> None:
+        """close_notifyを送って接続を閉じる。"""
+        self._protocol.close()
+
+    def is_closing(self) -> bool:
+        return self._protocol.transport.is_closing()
+
+    async def wait_closed(self) -> None:
+        await self._protocol.closed
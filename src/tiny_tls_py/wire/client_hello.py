@@ -0,0 +1,167 @@
+from dataclasses import dataclass, field
+from typing import Self
+
+from tiny_tls_py.models.alert import TlsAlert
+from tiny_tls_py.models.enums import AlertDescription, ExtensionType, ProtocolVersion
+from tiny_tls_py.wire.encoding import write_bytes
+from tiny_tls_py.wire.extension import Extension, PreSharedKey
+
+
+@dataclass(frozen=True, slots=True)
+class ClientHello:
+    """拡張はパース時にはデコードせず、種類 → (オフセット, 長さ)の索引だけを作る。
+
+    ブラウザのClientHelloには15〜20個の拡張が入っているが、
+    ハンドシェイクで使うのはそのうち数個なので、extension()で
+    最初に参照されたときにだけデコードする。
+    """
+
+    protocol_version: ProtocolVersion
+    session_id: bytes
+    random: bytes
+    cipher_suites: bytes
+    # Transcript-Hashの導出に使う
+    _original_data: bytes
+    # 拡張の種類 -> 拡張データの_original_data内での(オフセット, 長さ)
+    _extension_index: dict[int, tuple[int, int]]
+    _decoded_extensions: dict[int, Extension] = field(default_factory=dict)
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        # legacy_version(2) + random(32) + legacy_session_idの長さ(1)
+        if len(view) < 35:
+            raise ValueError("ClientHelloが短すぎます。")
+        legacy_version = int.from_bytes(view[:2], "big")
+        if legacy_version != ProtocolVersion.TLS_1_2:
+            raise ValueError(f"Unsupported protocol version: {bytes(view[:2])!r}")
+
+        session_id_length = view[34]
+        cipher_suites_start = 35 + session_id_length
+        if cipher_suites_start + 2 > len(view):
+            raise ValueError("ClientHelloが短すぎます。")
+        cipher_suites_end = (
+            cipher_suites_start
+            + 2
+            + int.from_bytes(view[cipher_suites_start : cipher_suites_start + 2], "big")
+        )
+        # compression_methods(2) + 拡張の長さ(2)まで入っているか
+        if cipher_suites_end + 4 > len(view):
+            raise ValueError("ClientHelloが短すぎます。")
+        # RFC 8446 4.1.2: compression_methodsは1バイトの長さ + null(0x00)のみ
+        if view[cipher_suites_end : cipher_suites_end + 2] != b"\x01\x00":
+            raise TlsAlert(
+                AlertDescription.illegal_parameter,
+                "compression_methodsがnullだけではありません。",
+            )
+        extensions_length_start = cipher_suites_end + 2
+        extensions_start = extensions_length_start + 2
+        extensions_end = extensions_start + int.from_bytes(
+            view[extensions_length_start:extensions_start], "big"
+        )
+        return cls(
+            ProtocolVersion.TLS_1_2,
+            bytes(view[35:cipher_suites_start]),
+            bytes(view[2:34]),
+            bytes(view[cipher_suites_start + 2 : cipher_suites_end]),
+            bytes(view),
+            cls.index_extensions(view, extensions_start, extensions_end),
+        )
+
+    @classmethod
+    def index_extensions(
+        cls, view: memoryview, start: int, end: int
+    ) -> dict[int, tuple[int, int]]:
+        """拡張を1回なめて、種類 -> (オフセット, 長さ)の索引を作る。"""
+        if end > len(view):
+            raise ValueError("拡張の長さがClientHelloをはみ出しています。")
+        index: dict[int, tuple[int, int]] = {}
+        offset = start
+        while offset < end:
+            if offset + 4 > end:
+                raise ValueError("拡張のヘッダーがClientHelloをはみ出しています。")
+            extension_type = (view[offset] << 8) | view[offset + 1]
+            length = (view[offset + 2] << 8) | view[offset + 3]
+            if offset + 4 + length > end:
+                raise ValueError("拡張の長さがClientHelloをはみ出しています。")
+            # RFC 8446 4.2: 同じ種類の拡張が2つ以上あってはいけない
+            if extension_type in index:
+                raise ValueError(f"重複した拡張を検出しました: {extension_type}")
+            index[extension_type] = (offset + 4, length)
+            offset += 4 + length
+        return index
+
+    def extension(self, extension_type: int) -> Extension | None:
+        """指定した種類の拡張を返す。最初の参照でデコードしてキャッシュする。"""
+        extension = self._decoded_extensions.get(extension_type)
+        if extension is not None:
+            return extension
+        location = self._extension_index.get(extension_type)
+        if location is None:
+            return None
+        offset, length = location
+        extension = Extension.decode(
+            extension_type, memoryview(self._original_data)[offset : offset + length]
+        )
+        self._decoded_extensions[extension_type] = extension
+        return extension
+
+    def extension_data(self, extension_type: int) -> memoryview | None:
+        """拡張の中身をデコードせずに返す。フィンガープリントのようにバイト列だけを使うとき用。"""
+        location = self._extension_index.get(extension_type)
+        if location is None:
+            return None
+        offset, length = location
+        return memoryview(self._original_data)[offset : offset + length]
+
+    def psk_binders_offset(self) -> int:
+        """Truncate(ClientHello)の長さ。pre_shared_keyのbindersの直前までのバイト数。
+
+        ハンドシェイクヘッダー(4バイト)は含まないので、binderの検証では
+        ヘッダー込みのメッセージの先頭から4 + この長さまでをハッシュする。
+        """
+        extension = self.extension(ExtensionType.PreSharedKey)
+        if extension is None or not isinstance(extension.data, PreSharedKey):
+            raise ValueError("pre_shared_key拡張がありません。")
+        # RFC 8446 4.2.11: pre_shared_keyは最後の拡張でなければいけない
+        if self.extension_types[-1] != ExtensionType.PreSharedKey:
+            raise ValueError("pre_shared_keyが最後の拡張ではありません。")
+        offset, _ = self._extension_index[ExtensionType.PreSharedKey]
+        return offset + extension.data.binders_offset
+
+    @property
+    def extension_types(self) -> tuple[int, ...]:
+        """ClientHelloに入っていた順の拡張の種類。デコードはしない。"""
+        return tuple(self._extension_index)
+
+    @property
+    def extensions(self) -> tuple[Extension, ...]:
+        """すべての拡張をデコードして、ClientHelloに入っていた順に返す。"""
+        # インデックスにある種類だけを引くので、extension()がNoneを返すことはない
+        return tuple(
+            extension
+            for extension_type in self._extension_index
+            if (extension := self.extension(extension_type)) is not None
+        )
+
+    def encoded_size(self) -> int:
+        return len(self._original_data)
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        return write_bytes(buffer, offset, self._original_data)
+
+    def bytes(self) -> bytes:
+        return self._original_data
+
+    def to_model(self):
+        from tiny_tls_py.models.client_hello import ClientHello as ClientHelloModel
+
+        client_hello = ClientHelloModel(
+            protocol_version=self.protocol_version,
+            session_id=self.session_id,
+            random=self.random,
+            cipher_suites=self.cipher_suites,
+            extensions=[extension.to_model() for extension in self.extensions],
+        )
+        client_hello._original_data = self._original_data
+        return client_hello
@@ -0,0 +1,27 @@
+from typing import Protocol
+
+
+class WireMessage(Protocol):
+    """自分のエンコード後のサイズを知っていて、渡されたバッファに直接書き込めるメッセージ。
+
+    レコード全体のサイズを先に求めて1回だけ確保し、ヘッダーも入れ子のメッセージも
+    そこへ順に書き込めば、途中でbytesを連結してコピーすることがなくなる。
+    """
+
+    def encoded_size(self) -> int: ...
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        """buffer[offset:]に書き込んで、書き終わった位置を返す。"""
+        ...
+
+
+def serialize(message: WireMessage) -> bytes:
+    buffer = bytearray(message.encoded_size())
+    message.write_into(buffer)
+    return bytes(buffer)
+
+
+def write_bytes(buffer: bytearray | memoryview, offset: int, data: bytes) -> int:
+    end = offset + len(data)
+    buffer[offset:end] = data
+    return end
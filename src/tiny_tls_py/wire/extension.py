@@ -0,0 +1,333 @@
+import struct
+from dataclasses import dataclass
+from typing import Final, Self, Union
+
+from tiny_tls_py.models.enums import ExtensionType, PskKeyExchangeMode
+from tiny_tls_py.wire.encoding import serialize, write_bytes
+
+X25519_GROUP: Final[bytes] = bytes.fromhex("00 1d")
+
+
+@dataclass(frozen=True, slots=True)
+class Extension:
+    extension_type: ExtensionType
+    data: Union[
+        bytes,
+        "SupportedVersion",
+        "KeyShare",
+        "PreSharedKey",
+        "PskKeyExchangeModes",
+        "RecordSizeLimit",
+    ]
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        extension_type = ExtensionType(int.from_bytes(view[:2], "big"))
+        length = int.from_bytes(view[2:4], "big")
+        raw_extension_data = view[4 : 4 + length]
+        match extension_type:
+            case ExtensionType.SupportedVersions:
+                return cls(
+                    extension_type, SupportedVersion.from_bytes(raw_extension_data)
+                )
+            case ExtensionType.KeyShare:
+                return cls(extension_type, KeyShare.from_bytes(raw_extension_data))
+            case _:
+                raise ValueError(f"Invalid extension type: {extension_type.name}")
+
+    @classmethod
+    def decode(cls, extension_type: int, data: memoryview) -> Self:
+        """拡張の中身を種類に応じてデコードする。知らない拡張はbytesのまま持つ。"""
+        match extension_type:
+            case ExtensionType.SupportedVersions:
+                return cls(
+                    ExtensionType(extension_type), SupportedVersion.from_bytes(data)
+                )
+            case ExtensionType.KeyShare:
+                return cls(ExtensionType(extension_type), KeyShare.from_bytes(data))
+            case ExtensionType.PreSharedKey:
+                return cls(ExtensionType(extension_type), PreSharedKey.from_bytes(data))
+            case ExtensionType.PskKeyExchangeModes:
+                return cls(
+                    ExtensionType(extension_type), PskKeyExchangeModes.from_bytes(data)
+                )
+            case ExtensionType.RecordSizeLimit:
+                return cls(
+                    ExtensionType(extension_type), RecordSizeLimit.from_bytes(data)
+                )
+            case _:
+                return cls(ExtensionType(extension_type), bytes(data))
+
+    def encoded_size(self) -> int:
+        if isinstance(self.data, bytes):
+            return 4 + len(self.data)
+        return 4 + self.data.encoded_size()
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        data_size = self.encoded_size() - 4
+        struct.pack_into("!HH", buffer, offset, self.extension_type, data_size)
+        if isinstance(self.data, bytes):
+            return write_bytes(buffer, offset + 4, self.data)
+        return self.data.write_into(buffer, offset + 4)
+
+    def bytes(self) -> bytes:
+        return serialize(self)
+
+    def to_model(self):
+        from tiny_tls_py.models.extension import Extension as ExtensionModel
+
+        data: object = self.data
+        if isinstance(self.data, (SupportedVersion, KeyShare)):
+            data = self.data.to_model()
+        elif not isinstance(self.data, bytes):
+            # pydanticのモデルがない拡張はバイト列で表示する
+            data = serialize(self.data)
+        return ExtensionModel(extension_type=self.extension_type, data=data)
+
+
+@dataclass(frozen=True, slots=True)
+class SupportedVersion:
+    version: bytes
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        return cls(bytes(data))
+
+    def encoded_size(self) -> int:
+        return len(self.version)
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        return write_bytes(buffer, offset, self.version)
+
+    def bytes(self) -> bytes:
+        return self.version
+
+    def to_model(self):
+        from tiny_tls_py.models.extension import (
+            SupportedVersion as SupportedVersionModel,
+        )
+
+        return SupportedVersionModel(version=self.version)
+
+
+@dataclass(frozen=True, slots=True)
+class KeyShare:
+    length: int
+    entries: tuple["KeyShareEntry", ...]
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        length = int.from_bytes(view[0:2], "big")
+        entries: list[KeyShareEntry] = []
+        offset = 2
+        while offset < len(view):
+            entry_length = int.from_bytes(view[offset + 2 : offset + 4], "big")
+            entries.append(
+                KeyShareEntry.from_bytes(view[offset : offset + 4 + entry_length])
+            )
+            offset += 4 + entry_length
+        return cls(length, tuple(entries))
+
+    def x2559Key(self) -> bytes | None:
+        # x25519の要素がないときはNone
+        return next(
+            (
+                entry.key_exchange
+                for entry in self.entries
+                if entry.group == X25519_GROUP
+            ),
+            None,
+        )
+
+    def encoded_size(self) -> int:
+        return sum(entry.encoded_size() for entry in self.entries)
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        for entry in self.entries:
+            offset = entry.write_into(buffer, offset)
+        return offset
+
+    def bytes(self) -> bytes:
+        return serialize(self)
+
+    def to_model(self):
+        from tiny_tls_py.models.extension import KeyShare as KeyShareModel
+
+        return KeyShareModel(
+            length=self.length, entries=[entry.to_model() for entry in self.entries]
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class KeyShareEntry:
+    group: bytes
+    length: int
+    key_exchange: bytes
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        length = int.from_bytes(view[2:4], "big")
+        return cls(bytes(view[:2]), length, bytes(view[4 : 4 + length]))
+
+    def encoded_size(self) -> int:
+        return 4 + len(self.key_exchange)
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        struct.pack_into("!2sH", buffer, offset, self.group, len(self.key_exchange))
+        return write_bytes(buffer, offset + 4, self.key_exchange)
+
+    def bytes(self) -> bytes:
+        return serialize(self)
+
+    def to_model(self):
+        from tiny_tls_py.models.extension import KeyShareEntry as KeyShareEntryModel
+
+        return KeyShareEntryModel(
+            group=self.group, length=self.length, key_exchange=self.key_exchange
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class PskIdentity:
+    identity: bytes
+    obfuscated_ticket_age: int
+
+    def encoded_size(self) -> int:
+        return 2 + len(self.identity) + 4
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        struct.pack_into("!H", buffer, offset, len(self.identity))
+        offset = write_bytes(buffer, offset + 2, self.identity)
+        struct.pack_into("!I", buffer, offset, self.obfuscated_ticket_age)
+        return offset + 4
+
+
+@dataclass(frozen=True, slots=True)
+class PreSharedKey:
+    """ClientHelloのpre_shared_key拡張(RFC 8446 4.2.11)。
+
+    binderはClientHelloのbindersより前の部分(Truncate(ClientHello))に対する
+    HMACなので、検証のために拡張データ内でのbindersの位置も持っておく。
+    """
+
+    identities: tuple[PskIdentity, ...]
+    binders: tuple[bytes, ...]
+    # 拡張データの先頭から、bindersの長さフィールドまでのバイト数
+    binders_offset: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        identities_end = 2 + int.from_bytes(view[0:2], "big")
+        binders_end = identities_end + 2
+        binders_end += int.from_bytes(view[identities_end:binders_end], "big")
+        if binders_end != len(view):
+            raise ValueError("pre_shared_keyの長さが不正です。")
+        identities: list[PskIdentity] = []
+        offset = 2
+        while offset < identities_end:
+            identity_end = offset + 2 + int.from_bytes(view[offset : offset + 2], "big")
+            if identity_end + 4 > identities_end:
+                raise ValueError("pre_shared_keyの長さが不正です。")
+            identities.append(
+                PskIdentity(
+                    bytes(view[offset + 2 : identity_end]),
+                    int.from_bytes(view[identity_end : identity_end + 4], "big"),
+                )
+            )
+            offset = identity_end + 4
+        binders: list[bytes] = []
+        offset = identities_end + 2
+        while offset < binders_end:
+            binder_end = offset + 1 + view[offset]
+            if binder_end > binders_end:
+                raise ValueError("pre_shared_keyの長さが不正です。")
+            binders.append(bytes(view[offset + 1 : binder_end]))
+            offset = binder_end
+        # RFC 8446 4.2.11: identitiesとbindersは同じ数でなければいけない
+        if not identities or len(identities) != len(binders):
+            raise ValueError("pre_shared_keyのidentitiesとbindersの数が合いません。")
+        return cls(tuple(identities), tuple(binders), identities_end)
+
+    def encoded_size(self) -> int:
+        return (
+            2
+            + sum(identity.encoded_size() for identity in self.identities)
+            + 2
+            + sum(1 + len(binder) for binder in self.binders)
+        )
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        identities_size = sum(identity.encoded_size() for identity in self.identities)
+        struct.pack_into("!H", buffer, offset, identities_size)
+        offset += 2
+        for identity in self.identities:
+            offset = identity.write_into(buffer, offset)
+        struct.pack_into(
+            "!H", buffer, offset, sum(1 + len(binder) for binder in self.binders)
+        )
+        offset += 2
+        for binder in self.binders:
+            buffer[offset] = len(binder)
+            offset = write_bytes(buffer, offset + 1, binder)
+        return offset
+
+    def bytes(self) -> bytes:
+        return serialize(self)
+
+
+@dataclass(frozen=True, slots=True)
+class PskKeyExchangeModes:
+    # 知らないモードも捨てずにそのまま持つ
+    modes: tuple[int, ...]
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        length = view[0]
+        if 1 + length != len(view):
+            raise ValueError("psk_key_exchange_modesの長さが不正です。")
+        return cls(tuple(view[1 : 1 + length]))
+
+    def supports(self, mode: PskKeyExchangeMode) -> bool:
+        return mode in self.modes
+
+    def encoded_size(self) -> int:
+        return 1 + len(self.modes)
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        buffer[offset] = len(self.modes)
+        return write_bytes(buffer, offset + 1, bytes(self.modes))
+
+    def bytes(self) -> bytes:
+        return serialize(self)
+
+
+@dataclass(frozen=True, slots=True)
+class RecordSizeLimit:
+    """record_size_limit(RFC 8449)。送ってよい保護済みレコードの平文の最大長。
+
+    TLS 1.3ではTLSInnerPlaintextのcontent_type(1バイト)も含むので、
+    中身に使えるのはlimit - 1バイトまで。
+    """
+
+    limit: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        if len(data) != 2:
+            raise ValueError("record_size_limitの長さが不正です。")
+        return cls(int.from_bytes(data, "big"))
+
+    def encoded_size(self) -> int:
+        return 2
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        struct.pack_into("!H", buffer, offset, self.limit)
+        return offset + 2
+
+    def bytes(self) -> bytes:
+        return serialize(self)
@@ -0,0 +1,50 @@
+import struct
+from dataclasses import dataclass
+from typing import Self
+
+from tiny_tls_py.models.enums import HandshakeType
+from tiny_tls_py.wire.client_hello import ClientHello
+from tiny_tls_py.wire.encoding import WireMessage, serialize, write_bytes
+
+
+@dataclass(frozen=True, slots=True)
+class Handshake:
+    msg_type: HandshakeType
+    length: int
+    # 送信するメッセージ(ServerHelloなど)はWireMessageのまま持てば、書き込み時にコピーしない
+    body: bytes | ClientHello | WireMessage
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        # 未定義のmsg_typeはValueErrorになる
+        msg_type = HandshakeType(view[0])
+        length = int.from_bytes(view[1:4], "big")
+        body = view[4 : 4 + length]
+        if msg_type == HandshakeType.ClientHello:
+            return cls(msg_type, length, ClientHello.from_bytes(body))
+        return cls(msg_type, length, bytes(body))
+
+    def encoded_size(self) -> int:
+        return 4 + self.length
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        # msg_type(1バイト)とlength(3バイト)をまとめて4バイトで書く
+        struct.pack_into("!I", buffer, offset, (self.msg_type << 24) | self.length)
+        if isinstance(self.body, bytes):
+            return write_bytes(buffer, offset + 4, self.body)
+        return self.body.write_into(buffer, offset + 4)
+
+    def bytes(self) -> bytes:
+        return serialize(self)
+
+    def to_model(self):
+        from tiny_tls_py.models.handshake import Handshake as HandshakeModel
+
+        body: object = self.body
+        if isinstance(self.body, ClientHello):
+            body = self.body.to_model()
+        elif not isinstance(self.body, bytes):
+            # pydanticのモデルがないメッセージはバイト列で表示する
+            body = serialize(self.body)
+        return HandshakeModel(msg_type=self.msg_type, length=self.length, body=body)
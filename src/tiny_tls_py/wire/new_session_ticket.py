@@ -0,0 +1,74 @@
+import struct
+from dataclasses import dataclass
+from typing import Self
+
+from tiny_tls_py.wire.encoding import serialize, write_bytes
+
+
+@dataclass(frozen=True, slots=True)
+class NewSessionTicket:
+    """RFC 8446 4.6.1
+
+    struct {
+        uint32 ticket_lifetime;
+        uint32 ticket_age_add;
+        opaque ticket_nonce<0..255>;
+        opaque ticket<1..2^16-1>;
+        Extension extensions<0..2^16-2>;
+    } NewSessionTicket;
+    """
+
+    ticket_lifetime: int
+    ticket_age_add: int
+    ticket_nonce: bytes
+    ticket: bytes
+    # early_dataを受け付けないので、今は常に空
+    extensions: bytes = b""
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        ticket_lifetime, ticket_age_add = struct.unpack_from("!II", view)
+        nonce_end = 9 + view[8]
+        ticket_end = (
+            nonce_end + 2 + int.from_bytes(view[nonce_end : nonce_end + 2], "big")
+        )
+        extensions_end = (
+            ticket_end + 2 + int.from_bytes(view[ticket_end : ticket_end + 2], "big")
+        )
+        return cls(
+            ticket_lifetime,
+            ticket_age_add,
+            bytes(view[9:nonce_end]),
+            bytes(view[nonce_end + 2 : ticket_end]),
+            bytes(view[ticket_end + 2 : extensions_end]),
+        )
+
+    def encoded_size(self) -> int:
+        return (
+            8
+            + 1
+            + len(self.ticket_nonce)
+            + 2
+            + len(self.ticket)
+            + 2
+            + len(self.extensions)
+        )
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        struct.pack_into(
+            "!IIB",
+            buffer,
+            offset,
+            self.ticket_lifetime,
+            self.ticket_age_add,
+            len(self.ticket_nonce),
+        )
+        offset = write_bytes(buffer, offset + 9, self.ticket_nonce)
+        struct.pack_into("!H", buffer, offset, len(self.ticket))
+        offset = write_bytes(buffer, offset + 2, self.ticket)
+        struct.pack_into("!H", buffer, offset, len(self.extensions))
+        return write_bytes(buffer, offset + 2, self.extensions)
+
+    def bytes(self) -> bytes:
+        return serialize(self)
@@ -0,0 +1,83 @@
+import struct
+from dataclasses import dataclass
+from typing import Self
+
+from tiny_tls_py.models.enums import ContentType, ProtocolVersion
+from tiny_tls_py.wire.encoding import serialize, write_bytes
+from tiny_tls_py.wire.handshake import Handshake
+
+
+@dataclass(frozen=True, slots=True)
+class TlsRecord:
+    """pydanticを使わないTLSRecord。ハンドシェイクのホットパスではこちらを使う。
+
+    フィールドはパース時に手で検証しているので、モデルとしての検証はしない。
+    デバッグで中身を表示したいときはto_model()でpydanticのモデルに変換する。
+    """
+
+    content_type: ContentType
+    legacy_record_version: ProtocolVersion
+    length: int
+    fragment: bytes | Handshake
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> Self:
+        view = memoryview(data)
+        # 未定義の値はValueErrorになる
+        content_type = ContentType(view[0])
+        version = ProtocolVersion(int.from_bytes(view[1:3], "big"))
+        length = int.from_bytes(view[3:5], "big")
+        if content_type == ContentType.handshake:
+            return cls(
+                content_type,
+                version,
+                length,
+                Handshake.from_bytes(view[5 : 5 + length]),
+            )
+        return cls(content_type, version, length, bytes(view[5 : 5 + length]))
+
+    @classmethod
+    def from_handshake_message(
+        cls, legacy_record_version: int, message: bytes | memoryview
+    ) -> Self:
+        """複数のレコードから組み立て直したハンドシェイクメッセージを1つのTLSRecordとして扱う。"""
+        return cls(
+            ContentType.handshake,
+            ProtocolVersion(legacy_record_version),
+            len(message),
+            Handshake.from_bytes(message),
+        )
+
+    def encoded_size(self) -> int:
+        return 5 + self.length
+
+    def write_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        struct.pack_into(
+            "!BHH",
+            buffer,
+            offset,
+            self.content_type,
+            self.legacy_record_version,
+            self.length,
+        )
+        if isinstance(self.fragment, bytes):
+            return write_bytes(buffer, offset + 5, self.fragment)
+        return self.fragment.write_into(buffer, offset + 5)
+
+    def bytes(self) -> bytes:
+        return serialize(self)
+
+    def to_model(self):
+        from tiny_tls_py.models.tls_record import TlsRecord as TlsRecordModel
+
+        fragment = (
+            self.fragment
+            if isinstance(self.fragment, bytes)
+            else self.fragment.to_model()
+        )
+        return TlsRecordModel(
+            content_type=self.content_type,
+            legacy_record_version=self.legacy_record_version,
+            length=self.length,
+            fragment=fragment,
+        )
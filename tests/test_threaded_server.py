@@ -0,0 +1,159 @@
+"""ThreadedServerとスレッドで共有する状態のテスト。
+
+CIではGILのないCPython(3.13t/3.14t)でも動かす。
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tiny_tls_py.admission import RateLimiter
+from tiny_tls_py.metrics import Metrics
+
+SRC_DIR = str(Path(__file__).resolve().parent.parent / "src")
+THREADS = 8
+
+
+def run_in_threads(target, threads: int = THREADS) -> None:
+    """threads本のスレッドでtarget()を同時に始めて、全部終わるのを待つ。"""
+    barrier = threading.Barrier(threads)
+
+    def run() -> None:
+        barrier.wait()
+        target()
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SharedStateTest(unittest.TestCase):
+    def setUp(self):
+        Metrics.reset()
+
+    def tearDown(self):
+        Metrics.reset()
+
+    def test_metrics_count_does_not_lose_increments(self):
+        def count() -> None:
+            for _ in range(20000):
+                Metrics.count("records")
+                Metrics.observe("test", 0.001)
+
+        run_in_threads(count)
+        self.assertEqual(Metrics.counters["records"], THREADS * 20000)
+        histogram = Metrics.phases["test"]
+        self.assertEqual(histogram.count, THREADS * 20000)
+        self.assertEqual(sum(histogram.counts), THREADS * 20000)
+
+    def test_rate_limiter_does_not_overspend(self):
+        # rate=0なので補充されず、burst回だけ許される
+        limiter = RateLimiter(rate=0.0, burst=1000)
+        allowed = []
+
+        def allow() -> None:
+            allowed.extend(limiter.allow("192.0.2.1", now=0.0) for _ in range(500))
+
+        run_in_threads(allow)
+        self.assertEqual(allowed.count(True), 1000)
+        self.assertEqual(len(limiter), 1)
+
+
+class ThreadedServerTest(unittest.TestCase):
+    workers = 4
+    handshakes = 64
+
+    def setUp(self):
+        self.port = free_port()
+        self.server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "tiny_tls_py",
+                "serve",
+                "--server",
+                "prefork",
+                "--threads",
+                "--workers",
+                str(self.workers),
+                "--port",
+                str(self.port),
+            ],
+            env=dict(os.environ, PYTHONPATH=SRC_DIR),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        self.addCleanup(self._stop_server)
+        self._wait_until_listening()
+
+    def _wait_until_listening(self) -> None:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.server.poll() is not None:
+                self.fail(
+                    f"サーバーが起動できませんでした:\n{self.server.stdout.read()}"
+                )
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.fail("サーバーが30秒たってもlistenしません。")
+
+    def _stop_server(self) -> None:
+        if self.server.poll() is None:
+            self.server.kill()
+            self.server.wait()
+        self.server.stdout.close()
+
+    def _handshake(self, context: ssl.SSLContext) -> str | None:
+        with (
+            socket.create_connection(("127.0.0.1", self.port), 10) as sock,
+            context.wrap_socket(sock) as tls,
+        ):
+            return tls.version()
+
+    def test_handshakes_across_worker_threads(self):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        # 証明書は自己署名なので確かめない
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        context.minimum_version = ssl.TLSVersion.TLSv1_3
+        with ThreadPoolExecutor(16) as executor:
+            versions = list(
+                executor.map(lambda _: self._handshake(context), range(self.handshakes))
+            )
+        self.assertEqual(versions, ["TLSv1.3"] * self.handshakes)
+
+        self.server.send_signal(signal.SIGTERM)
+        self.assertEqual(self.server.wait(timeout=30), 0)
+        log = self.server.stdout.read()
+        self.assertIn(f"({self.workers}スレッド)", log)
+        self.assertIn(f"ハンドシェイク数: 合計{self.handshakes}", log)
+        self.assertNotIn("Traceback", log)
+        if not getattr(sys, "_is_gil_enabled", lambda: True)():
+            # cryptographyやpydanticを読み込んでもGILが有効にならない
+            self.assertNotIn("GILが有効", log)
+
+
+if __name__ == "__main__":
+    unittest.main()